@@ -1,7 +1,7 @@
 import os
+import tempfile
 from pathlib import Path
 import cloudinary
-import cloudinary.uploader
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -72,6 +72,7 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'systems.middleware.request_metrics_middleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -129,11 +130,114 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
+# locmem is per process, set REDIS_URL in production so cache invalidation reaches every worker
+if os.getenv('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+        'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+    }
+
+USER_TOKENS_CACHE_ALIAS = 'default'
+USER_TOKENS_CACHE_TTL = 300  # seconds a wallet's token list is kept
+USER_TOKENS_CACHE_MAX_TOKENS = 5000  # larger wallets are not cached
+USER_TOKENS_HEAD_TTL = 5  # seconds between Whatcraft max(block_number) checks
+RUNTIME_CONFIG_TTL = 5  # seconds a worker trusts its AppSettings and ImageUrl copies
+RUNTIME_CONFIG_MAX_AGE = 60  # seconds after which the copies are reloaded even if no version bump was seen
+
 CUSTOM_EXPIRATION_HOURS = 24
+AUTH_TOKEN_CACHE_TTL = 30  # seconds a token lookup is reused by a worker
+AUTH_TOKEN_CACHE_SIZE = 1024
+# 'signed' issues self-verifying tokens at login, 'db' ExpiringToken rows, both are always accepted
+SESSION_TOKEN_MODE = os.getenv('SESSION_TOKEN_MODE', 'db')
+SIGNED_TOKEN_DENYLIST_REFRESH = 30  # seconds before a worker reloads revoked signed tokens
+TOKEN_PURGE_BATCH_SIZE = 1000  # expired tokens deleted per statement
+TOKEN_PURGE_TIME_BUDGET = 20  # seconds a purge may run before stopping
+
+UPDATE_REQUEST_EXPORT_CHUNK_SIZE = 100  # rows read per query when streaming zip exports
+UPDATE_REQUEST_EXPORT_FETCH_WORKERS = 8  # images downloaded in parallel per export
+UPDATE_REQUEST_EXPORT_FETCH_TIMEOUT = 20  # seconds allowed for a single image, connecting and retries included
+UPDATE_REQUEST_EXPORT_FETCH_RETRIES = 3
+UPDATE_REQUEST_EXPORT_FETCH_BACKOFF = 0.5
+# Under ASGI the archive is complete before its first byte is sent (Django 4.1 can't stream
+# asynchronously), see README. It is built in memory up to this, then on disk.
+UPDATE_REQUEST_EXPORT_SPOOL_BYTES = 16 * 1024 * 1024
+UPDATE_REQUEST_CLAIM_BATCH_SIZE = 500  # max rows claimed by one download_new
 
 ETH_COLLECTION_CONTRACT = "0xF1ddcE4A958E4FBaa4a14cB65073a28663F2F350"
+ETH_BURN_MANAGER_CONTRACT = "0xFFaCdbB2BF77efDE0d26650213B1804ff89c824f"
 ETH_PROVIDER_URL = "https://rpc.hyperliquid.xyz/evm"
 
+RPC_TIMEOUT = 10  # seconds per JSON-RPC request
+RPC_BATCH_SIZE = 100  # calls per JSON-RPC batch or multicall
+RPC_MULTICALL_ADDRESS = os.getenv('RPC_MULTICALL_ADDRESS')  # Multicall3, batched eth_calls when unset
+RPC_RETRY_MAX_BACKOFF = 300  # seconds, longest wait of the indexer and verifier workers after RPC failures
+RPC_RETRY_ATTEMPTS = 5  # consecutive failures a --once run of those workers retries before giving up
+
+INDEXER_START_BLOCK = 0  # first block scanned for Transfer logs
+INDEXER_CONFIRMATIONS = 5  # blocks behind the head considered final
+INDEXER_CHUNK_SIZE = 2000  # initial eth_getLogs block range
+INDEXER_MAX_CHUNK_SIZE = 10000
+INDEXER_POLL_INTERVAL = 2  # seconds between polls once caught up
+
+VERIFY_BATCH_SIZE = 50  # update requests checked per JSON-RPC batch
+VERIFY_MAX_PENDING_HOURS = 24  # reject burns still not found after this long
+VERIFY_POLL_INTERVAL = 5
+
+# raced in order of measured latency, comma separated in IPFS_GATEWAYS to override
+IPFS_GATEWAYS = os.getenv(
+    'IPFS_GATEWAYS', 'https://ipfs.io/ipfs/,https://dweb.link/ipfs/,https://gateway.pinata.cloud/ipfs/'
+).split(',')
+IPFS_CACHE_DIR = os.getenv('IPFS_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'what-the-burn-ipfs'))
+IPFS_HEDGE_DELAY = 0.5  # seconds before the next gateway joins the race
+IPFS_TIMEOUT = 10  # seconds for a whole fetch
+
+THUMBNAIL_SIZES = (128, 300, 600)  # square bounds in px, each rendered as webp and png
+THUMBNAIL_CACHE_DIR = os.getenv('THUMBNAIL_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'what-the-burn-thumbnails'))
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024  # least recently used thumbnails are dropped past this
+THUMBNAIL_PREWARM_WORKERS = 8
+
+# stage update-request images and upload them off the request path, needs upload_staged_images running (README)
+IMAGE_UPLOAD_DEFERRED = os.getenv('IMAGE_UPLOAD_DEFERRED', '0') == '1'
+IMAGE_STORAGE_BACKEND = 'systems.storage.CloudinaryStorage'
+IMAGE_UPLOAD_BATCH_SIZE = 20
+IMAGE_UPLOAD_WORKERS = 4  # concurrent uploads per batch
+IMAGE_UPLOAD_MAX_ATTEMPTS = 8
+IMAGE_UPLOAD_BACKOFF = 30  # seconds before the first retry, doubled after each failure
+IMAGE_UPLOAD_LEASE = 300  # seconds a claimed batch is hidden from other uploaders while it uploads
+IMAGE_UPLOAD_TIMEOUT = 60
+IMAGE_UPLOAD_POLL_INTERVAL = 5
+IMAGE_UPLOAD_MAX_BYTES = 8 * 1024 * 1024  # refused while streaming in once over this
+IMAGE_MAX_DIMENSION = 2048  # longer side in px, larger images are downscaled
+IMAGE_MAX_PIXELS = 4096 * 4096  # refused before decoding above this
+
+SIGN_NONCE_TTL = 300  # seconds a sign-message nonce can be used for
+# also store each issued nonce on existing EthUsers for clients that don't post it back, costs a write per request
+SIGN_NONCE_LEGACY_CLIENTS = os.getenv('SIGN_NONCE_LEGACY_CLIENTS', '0') == '1'
+
+# 'coincurve' (libsecp256k1, pip install coincurve), 'eth_account', or 'auto' for the first that imports
+SIGNATURE_RECOVERY_BACKEND = os.getenv('SIGNATURE_RECOVERY_BACKEND', 'auto')
+
+# set by core/asgi.py, the async views need an event loop per worker to pool connections on
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', '0') == '1'
+ASYNC_HTTP_POOL_SIZE = 100  # connections of the shared aiohttp session per worker
+
+# per-request query and outbound call timings, sent as Server-Timing and aggregated per view at metrics/
+REQUEST_METRICS_ENABLED = os.getenv('REQUEST_METRICS_ENABLED', '1') == '1'
+REQUEST_METRICS_SERVER_TIMING = True  # the header shows clients where the time went, turn off to hide it
+REQUEST_METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # seconds
+
+COLD_START_BUDGET_MS = 600  # checked by bench_cold_start
+# only imported by the views that need them, never at startup
+COLD_START_FORBIDDEN_MODULES = ('web3', 'eth_account', 'eth_abi', 'PIL.Image', 'aiohttp')
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'UTC'
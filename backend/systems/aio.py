@@ -0,0 +1,32 @@
+import asyncio
+import weakref
+import aiohttp
+from django.conf import settings
+from .instrumentation import aiohttp_trace_config
+
+# one pooled session per event loop, an aiohttp session can't move between loops
+_sessions = weakref.WeakKeyDictionary()
+
+def client_timeout(total:float, connect:float = None) -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(total=total, sock_connect=connect)
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Keep-alive session shared by every async view running on this loop"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        # no per-host bound, a handful of gateways and the RPC node get all the traffic
+        connector = aiohttp.TCPConnector(
+            limit=getattr(settings, "ASYNC_HTTP_POOL_SIZE", 100), limit_per_host=0, ttl_dns_cache=300
+        )
+        session = aiohttp.ClientSession(
+            connector=connector, timeout=client_timeout(30, 5), trace_configs=[aiohttp_trace_config()]
+        )
+        _sessions[loop] = session
+    return session
+
+async def close_http_session():
+    """Close the session of the running loop, for shutdown and tests"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class SystemsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'systems'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        if getattr(settings, "REQUEST_METRICS_ENABLED", True):
+            from .instrumentation import install
+            install()
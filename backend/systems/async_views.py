@@ -0,0 +1,122 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse
+from django.utils import timezone
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from .auth import ExpiringTokenAuthentication
+from .cache import runtime_config, user_tokens_cache
+from .conditional import make_etag, etag_matches, with_etag
+from .models import ImageUrl, Update_Request
+from .views import Gettokens, UpdateRequestViewSet
+
+class AsyncAPIView(View):
+    """
+    Async counterpart of APIView for the I/O bound endpoints served by
+    core/asgi.py. DRF only dispatches sync handlers, this covers what those
+    endpoints need from it: token authentication, an authenticated or admin
+    check and JSON errors shaped like DRF's.
+    """
+    admin_only = False
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            authenticated = await ExpiringTokenAuthentication().aauthenticate(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({"detail": str(e.detail)}, status=status.HTTP_403_FORBIDDEN)
+        if authenticated is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."}, status=status.HTTP_403_FORBIDDEN
+            )
+        request.user, request.auth = authenticated
+        if self.admin_only and not request.user.is_staff:
+            return JsonResponse(
+                {"detail": "You do not have permission to perform this action."}, status=status.HTTP_403_FORBIDDEN
+            )
+        return await super().dispatch(request, *args, **kwargs)
+
+class AsyncGettokens(AsyncAPIView):
+    async def get(self, request):
+        wallet = request.user.address.lower()
+        thumbnail = request.GET.get("thumbnail")
+        fmt = request.GET.get("thumbnail_format", "webp")
+        error = Gettokens.thumbnail_error(thumbnail, fmt)
+        if error:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        async def build():
+            image_url = await runtime_config.aimage_url()
+            return [
+                Gettokens.token_row(token, is_updated, image_url)
+                async for token, is_updated in Gettokens.owned(wallet)
+            ]
+
+        entry = await user_tokens_cache.aget_or_build(wallet, build)
+        etag = entry["etag"] if thumbnail is None else make_etag(entry["etag"], thumbnail, fmt)
+        if etag_matches(request, etag):
+            return with_etag(HttpResponse(status=status.HTTP_304_NOT_MODIFIED), etag)
+        tokens = entry["tokens"]
+        if thumbnail is not None:
+            tokens = Gettokens.with_thumbnails(request, tokens, await runtime_config.aimage_url(), int(thumbnail), fmt)
+        return with_etag(JsonResponse({"tokens": tokens}), etag)
+
+class AsyncUpdateImageUrlFromIPFS(AsyncAPIView):
+    async def get(self, request):
+        from .ipfs import acollection_image_base
+        from .rpc import get_client
+        url = request.GET.get("url", "")
+        try:
+            if url == "":
+                url = await get_client().atoken_uri(settings.ETH_COLLECTION_CONTRACT, 1)
+            image_url = await acollection_image_base(url)
+        except Exception as e:
+            return JsonResponse({"error": f"Error fetching {url}: {e}"}, status=status.HTTP_502_BAD_GATEWAY)
+
+        if not await ImageUrl.objects.filter(id=1, url=image_url).aexists():
+            await ImageUrl.objects.aupdate_or_create(id=1, defaults={'url': image_url})
+        return JsonResponse({"message": f"{image_url} Added"})
+
+class AsyncUpdateRequestDownload(AsyncAPIView):
+    """
+    The download actions of UpdateRequestViewSet, with the images fetched on
+    the event loop. Exported rows are marked as downloaded once the archive is
+    complete. download_new holds its row locks on one connection until then,
+    so it runs the sync export in a worker thread instead.
+    """
+    admin_only = True
+    scope = None
+
+    async def get(self, request, pk=None):
+        from .exports import abuild_zip, export_chunk_size, spool_zip
+        queryset = Update_Request.objects.order_by('created_at')
+        if self.scope == "new":
+            batch_size, error = UpdateRequestViewSet.claim_batch_size(request.GET.get('batch_size'))
+            if error:
+                return JsonResponse({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+            # claimed, exported and committed in that thread before anything is sent
+            archive = await sync_to_async(spool_zip)(UpdateRequestViewSet().generate_claimed_zip(batch_size))
+            return self.zip_response(archive, 'new_update_requests.zip')
+        if self.scope == "one":
+            try:
+                instance = await queryset.aget(pk=pk)
+            except Update_Request.DoesNotExist:
+                return JsonResponse({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
+            instances, filename = [instance], f"{instance.transaction_hash}.zip"
+        elif self.scope == "downloaded":
+            instances = queryset.filter(downloaded=True).aiterator(chunk_size=export_chunk_size())
+            filename = 'already_downloaded_update_requests.zip'
+        else:
+            instances = queryset.aiterator(chunk_size=export_chunk_size())
+            filename = 'all_update_requests.zip'
+
+        archive, exported = await abuild_zip(instances)
+        await Update_Request.objects.filter(pk__in=exported, downloaded=False).aupdate(
+            downloaded=True, updated_at=timezone.now()
+        )
+        return self.zip_response(archive, filename)
+
+    def zip_response(self, archive, filename):
+        response = FileResponse(archive, as_attachment=True, filename=filename, content_type='application/zip')
+        response.block_size = 64 * 1024
+        return response
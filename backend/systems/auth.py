@@ -1,6 +1,183 @@
+import base64
+import binascii
+import datetime
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
-from .models import ExpiringToken
+from .models import EthUser, ExpiringToken, RevokedToken
+
+SIGNED_TOKEN_PREFIX = "st1."
+SIGNED_TOKEN_SALT = "systems.auth.signed-token"
+
+class TokenCache:
+    """
+    Small in-process LRU of key -> ExpiringToken (with its user loaded).
+    Entries are dropped after AUTH_TOKEN_CACHE_TTL seconds so revocations made
+    by other workers are seen quickly, expiry is still checked on every hit.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key:str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            token, cached_at = entry
+            if time.monotonic() - cached_at > getattr(settings, "AUTH_TOKEN_CACHE_TTL", 30):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return token
+
+    def set(self, token:ExpiringToken):
+        with self._lock:
+            self._entries[token.key] = (token, time.monotonic())
+            self._entries.move_to_end(token.key)
+            while len(self._entries) > getattr(settings, "AUTH_TOKEN_CACHE_SIZE", 1024):
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key:str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user):
+        with self._lock:
+            for key in [key for key, (token, _) in self._entries.items() if token.user_id == user.pk]:
+                del self._entries[key]
+
+    def purge_expired(self):
+        now = timezone.now()
+        with self._lock:
+            for key in [key for key, (token, _) in self._entries.items() if token.expires_at <= now]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+token_cache = TokenCache()
+
+def _b64encode(data:bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(data:str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(payload:str) -> str:
+    return _b64encode(salted_hmac(SIGNED_TOKEN_SALT, payload, algorithm="sha256").digest())
+
+def token_lifetime() -> datetime.timedelta:
+    return datetime.timedelta(hours=getattr(settings, "CUSTOM_EXPIRATION_HOURS", 24))
+
+class SignedToken:
+    """
+    Self-verifying session token, 'st1.<payload>.<hmac>' where the payload
+    carries the address, is_staff, issue and expiry times and a token id.
+    Authenticating one needs no database access.
+    """
+    def __init__(self, key:str, address:str, is_staff:bool, issued_at:int, expires_at:int, jti:str):
+        self.key = key
+        self.address = address
+        self.is_staff = is_staff
+        self.issued_at = issued_at
+        self.expires_at = datetime.datetime.fromtimestamp(expires_at, tz=datetime.timezone.utc)
+        self.jti = jti
+
+    @classmethod
+    def issue(cls, user) -> "SignedToken":
+        issued_at = int(time.time())
+        expires_at = issued_at + int(token_lifetime().total_seconds())
+        jti = secrets.token_hex(8)
+        payload = _b64encode(json.dumps(
+            {"a": user.address, "s": user.is_staff, "i": issued_at, "e": expires_at, "j": jti},
+            separators=(",", ":")
+        ).encode())
+        key = f"{SIGNED_TOKEN_PREFIX}{payload}.{_sign(payload)}"
+        return cls(key, user.address, user.is_staff, issued_at, expires_at, jti)
+
+    @classmethod
+    def decode(cls, key:str) -> "SignedToken":
+        try:
+            payload, signature = key[len(SIGNED_TOKEN_PREFIX):].split(".")
+        except ValueError:
+            raise AuthenticationFailed("Invalid token")
+        if not constant_time_compare(signature, _sign(payload)):
+            raise AuthenticationFailed("Invalid token")
+        try:
+            data = json.loads(_b64decode(payload))
+            return cls(key, data["a"], bool(data["s"]), int(data["i"]), int(data["e"]), data["j"])
+        except (binascii.Error, ValueError, KeyError, TypeError):
+            raise AuthenticationFailed("Invalid token")
+
+    def is_expired(self):
+        return timezone.now() >= self.expires_at
+
+    def user(self) -> EthUser:
+        # built from the payload, never saved
+        user = EthUser(address=self.address, is_staff=self.is_staff)
+        user._state.adding = False
+        return user
+
+class DenyList:
+    """
+    Revoked signed tokens, reloaded from RevokedToken at most every
+    SIGNED_TOKEN_DENYLIST_REFRESH seconds per worker, so a revocation takes
+    up to that long to reach every worker.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._jtis = set()
+        self._addresses = {}
+
+    def _refresh(self):
+        jtis, addresses = set(), {}
+        rows = RevokedToken.objects.filter(expires_at__gt=timezone.now()).values_list('jti', 'address', 'revoked_at')
+        for jti, address, revoked_at in rows:
+            if jti:
+                jtis.add(jti)
+            if address:
+                revoked_at = revoked_at.timestamp()
+                addresses[address.lower()] = max(revoked_at, addresses.get(address.lower(), 0))
+        self._jtis, self._addresses = jtis, addresses
+        self._loaded_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        refresh = getattr(settings, "SIGNED_TOKEN_DENYLIST_REFRESH", 30)
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > refresh
+
+    def is_revoked(self, token:SignedToken) -> bool:
+        with self._lock:
+            if self.is_stale():
+                self._refresh()
+            if token.jti in self._jtis:
+                return True
+            return token.issued_at <= self._addresses.get(token.address.lower(), -1)
+
+    def invalidate(self):
+        """Reload on the next check, this worker sees its own revocations at once"""
+        with self._lock:
+            self._loaded_at = None
+
+deny_list = DenyList()
+
+def revoke_signed_tokens(address:str = None, token:SignedToken = None):
+    """Revoke one signed token, or every signed token issued to `address` so far"""
+    if token is not None:
+        RevokedToken.objects.create(jti=token.jti, expires_at=token.expires_at)
+    if address is not None:
+        RevokedToken.objects.create(address=address.lower(), expires_at=timezone.now() + token_lifetime())
+    deny_list.invalidate()
 
 class ExpiringTokenAuthentication(BaseAuthentication):
     def authenticate(self, request):
@@ -9,13 +186,47 @@ class ExpiringTokenAuthentication(BaseAuthentication):
             return None
 
         key = auth.split(' ')[1]
-        try:
-            token = ExpiringToken.objects.get(key=key)
-        except ExpiringToken.DoesNotExist:
-            raise AuthenticationFailed("Invalid token")
+        if key.startswith(SIGNED_TOKEN_PREFIX):
+            return self.authenticate_signed(key)
+
+        token = token_cache.get(key)
+        if token is None:
+            try:
+                token = ExpiringToken.objects.select_related('user').get(key=key)
+            except ExpiringToken.DoesNotExist:
+                raise AuthenticationFailed("Invalid token")
+            token_cache.set(token)
 
         if token.is_expired():
+            token_cache.invalidate(key)
             token.delete()
             raise AuthenticationFailed("Token has expired")
 
         return (token.user, token)
+
+    async def aauthenticate(self, request):
+        """
+        authenticate() for async views. Cached and signed tokens are checked on
+        the event loop, only a lookup that needs the database goes to a thread.
+        """
+        auth = request.headers.get('Authorization', '')
+        if not auth.startswith('Token '):
+            return None
+
+        key = auth.split(' ')[1]
+        if key.startswith(SIGNED_TOKEN_PREFIX):
+            if not deny_list.is_stale():
+                return self.authenticate_signed(key)
+        else:
+            token = token_cache.get(key)
+            if token is not None and not token.is_expired():
+                return (token.user, token)
+        return await sync_to_async(self.authenticate)(request)
+
+    def authenticate_signed(self, key:str):
+        token = SignedToken.decode(key)
+        if token.is_expired():
+            raise AuthenticationFailed("Token has expired")
+        if deny_list.is_revoked(token):
+            raise AuthenticationFailed("Token has been revoked")
+        return (token.user(), token)
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import platform
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import django
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from .auth import token_cache, token_lifetime
+from .cache import runtime_config, user_tokens_cache
+from .models import EthUser, ExpiringToken, ImageUrl, Update_Request, Whatcraft
+
+SCENARIOS = (
+    "sign-message", "verify-signature",
+    "user-tokens-cold", "user-tokens", "user-tokens-304",
+    "update-requests", "update-requests-page", "update-requests-304",
+    "update-from-ipfs",
+)
+# lower is better for every metric but throughput
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "rps", "queries_per_request")
+
+def percentile(ordered:list, q:float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+def summarize(latencies:list, queries:list, errors:int) -> dict:
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        # one client at a time, so this is the inverse of the mean latency
+        "rps": round(len(ordered) / sum(ordered), 1) if ordered else 0.0,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else 0.0,
+    }
+
+def compare(results:dict, baseline:dict, max_regression:float = 0.2) -> list:
+    """
+    One row per scenario and metric present in both runs. Latency or
+    throughput more than `max_regression` worse, or any extra query per
+    request, is flagged as a regression.
+    """
+    rows = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        for metric in METRICS:
+            if metric not in previous:
+                continue
+            old, new = previous[metric], current[metric]
+            if metric == "rps":
+                regressed = new < old / (1 + max_regression)
+            elif metric == "queries_per_request":
+                regressed = new > old + 0.01
+            else:
+                regressed = new > old * (1 + max_regression)
+            change = (new - old) / old if old else 0.0
+            rows.append({
+                "scenario": name, "metric": metric, "baseline": old, "current": new,
+                "change": round(change, 4), "regressed": regressed,
+            })
+    return rows
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        content = self.server.files.get(self.path.removeprefix("/ipfs/"))
+        if content is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.reply(content)
+
+    def do_POST(self):
+        from eth_abi import encode
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        result = "0x" + encode(["string"], [self.server.token_uri]).hex()
+        replies = [
+            {"jsonrpc": "2.0", "id": call["id"], "result": result}
+            for call in (payload if isinstance(payload, list) else [payload])
+        ]
+        self.reply(json.dumps(replies if isinstance(payload, list) else replies[0]).encode())
+
+    def reply(self, content:bytes):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+class StubUpstream(ThreadingHTTPServer):
+    """
+    Local stand-in for the JSON-RPC node and the IPFS gateways. Every eth_call
+    returns `token_uri` ABI encoded, GET /ipfs/<path> serves `files`.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, files:dict, token_uri:str):
+        super().__init__(("127.0.0.1", 0), _UpstreamHandler)
+        self.files = files
+        self.token_uri = token_uri
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+class BenchmarkSuite:
+    """
+    Seeds Whatcraft, Update_Request and ExpiringToken rows into the current
+    database and drives the hot paths through the Django test client, one
+    request at a time. Upstreams are local: RPC and IPFS are a StubUpstream,
+    images go to InMemoryStorage. Setup work (signing, cache priming) is
+    kept out of the timings.
+    """
+    IMAGE_BASE = "ipfs://benchimg/"
+
+    def __init__(self, tokens:int = 10000, update_requests:int = 2000, users:int = 50,
+                 requests:int = 200, login_wallets:int = 20):
+        self.volumes = {
+            "tokens": tokens, "update_requests": update_requests, "users": users, "login_wallets": login_wallets,
+        }
+        self.requests = requests
+        self.client = Client()
+
+    def seed(self):
+        users, tokens = self.volumes["users"], self.volumes["tokens"]
+        self.owners = [f"0x{i:040x}" for i in range(1, users + 1)]
+        EthUser.objects.bulk_create([EthUser(address=owner) for owner in self.owners])
+        self.user_keys = [get_random_string(40) for _ in self.owners]
+        # bulk_create skips save(), which sets the expiry
+        expires_at = timezone.now() + token_lifetime()
+        ExpiringToken.objects.bulk_create([
+            ExpiringToken(user_id=owner, key=key, expires_at=expires_at)
+            for owner, key in zip(self.owners, self.user_keys)
+        ])
+        admin = EthUser.objects.create(address="0x" + "ad" * 20, is_staff=True)
+        self.admin_key = ExpiringToken.objects.create(user=admin, key=get_random_string(40)).key
+
+        Whatcraft.objects.bulk_create([
+            Whatcraft(
+                token_id=token_id, current_owner=self.owners[token_id % users],
+                block_number=1, timestamp=0, transaction_hash="0x"
+            )
+            for token_id in range(1, tokens + 1)
+        ], batch_size=1000)
+        Update_Request.objects.bulk_create([
+            Update_Request(
+                transaction_hash=f"0x{i:064x}", address=self.owners[i % users], update_id=i % tokens + 1,
+                burn_ids=[i % tokens + 1], update_name=f"update {i}", image="sample",
+                image_original_url=f"https://res.cloudinary.com/bench/image/upload/v1/{i}.png",
+                image_small_url=f"https://res.cloudinary.com/bench/image/upload/c_fill,h_300,w_300/v1/{i}.png",
+            )
+            for i in range(self.volumes["update_requests"])
+        ], batch_size=1000)
+        ImageUrl.objects.update_or_create(id=1, defaults={"url": self.IMAGE_BASE})
+
+        from eth_account import Account
+        self.login_accounts = [
+            Account.from_key(hashlib.sha256(f"bench-login-{i}".encode()).digest())
+            for i in range(self.volumes["login_wallets"])
+        ]
+
+    def run(self, scenarios=None) -> dict:
+        """Seed, then measure `scenarios` (all by default), returns the results document"""
+        from . import ipfs
+        files = {"benchmeta/1.json": json.dumps({"image": f"{self.IMAGE_BASE}1.png"}).encode()}
+        with tempfile.TemporaryDirectory() as cache_dir, StubUpstream(files, "ipfs://benchmeta/1.json") as upstream, \
+                override_settings(
+                    ETH_PROVIDER_URL=upstream.url, IPFS_GATEWAYS=[f"{upstream.url}ipfs/"], IPFS_CACHE_DIR=cache_dir,
+                    IMAGE_STORAGE_BACKEND="systems.storage.InMemoryStorage", SESSION_TOKEN_MODE="db",
+                ):
+            # the IPFS client is built from settings once per process
+            previous, ipfs._client = ipfs._client, None
+            try:
+                self.seed()
+                token_cache.clear()
+                user_tokens_cache.invalidate_all()
+                runtime_config.bump()
+                results = {name: self.measure(name) for name in scenarios or SCENARIOS}
+            finally:
+                ipfs._client = previous
+        return {
+            "meta": {
+                "volumes": self.volumes,
+                "requests": self.requests,
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            },
+            "scenarios": results,
+        }
+
+    def measure(self, name:str) -> dict:
+        latencies, queries, errors = [], [], 0
+        for send, expected in getattr(self, f"scenario_{name.replace('-', '_')}")():
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = send()
+                latencies.append(time.perf_counter() - started)
+            queries.append(len(captured))
+            if response.status_code != expected:
+                errors += 1
+        return summarize(latencies, queries, errors)
+
+    def auth(self, key:str) -> dict:
+        return {"HTTP_AUTHORIZATION": f"Token {key}"}
+
+    def rotate(self, items:list):
+        for i in range(self.requests):
+            yield items[i % len(items)]
+
+    def scenario_sign_message(self):
+        for account in self.rotate(self.login_accounts):
+            yield lambda account=account: self.client.get("/sign-message/", {"wallet": account.address}), 200
+
+    def scenario_verify_signature(self):
+        from eth_account.messages import encode_defunct
+        for account in self.rotate(self.login_accounts):
+            issued = self.client.get("/sign-message/", {"wallet": account.address}).json()
+            data = {
+                "wallet_address": account.address, "nonce": issued["nonce"],
+                "signature": account.sign_message(encode_defunct(text=issued["message"])).signature.hex(),
+            }
+            yield lambda data=data: self.client.post("/verify-signature/", data), 200
+
+    def scenario_user_tokens_cold(self):
+        for key in self.rotate(self.user_keys):
+            user_tokens_cache.invalidate_all()
+            yield lambda key=key: self.client.get("/user-tokens/", **self.auth(key)), 200
+
+    def scenario_user_tokens(self):
+        for key in self.user_keys:
+            self.client.get("/user-tokens/", **self.auth(key))
+        for key in self.rotate(self.user_keys):
+            yield lambda key=key: self.client.get("/user-tokens/", **self.auth(key)), 200
+
+    def scenario_user_tokens_304(self):
+        etags = {key: self.client.get("/user-tokens/", **self.auth(key))["ETag"] for key in self.user_keys}
+        for key in self.rotate(self.user_keys):
+            yield lambda key=key: self.client.get(
+                "/user-tokens/", HTTP_IF_NONE_MATCH=etags[key], **self.auth(key)
+            ), 304
+
+    def scenario_update_requests(self):
+        for _ in range(self.requests):
+            yield lambda: self.client.get("/update-requests/", **self.auth(self.admin_key)), 200
+
+    def scenario_update_requests_page(self):
+        for _ in range(self.requests):
+            yield lambda: self.client.get("/update-requests/", {"page_size": 100}, **self.auth(self.admin_key)), 200
+
+    def scenario_update_requests_304(self):
+        etag = self.client.get("/update-requests/", **self.auth(self.admin_key))["ETag"]
+        for _ in range(self.requests):
+            yield lambda: self.client.get(
+                "/update-requests/", HTTP_IF_NONE_MATCH=etag, **self.auth(self.admin_key)
+            ), 304
+
+    def scenario_update_from_ipfs(self):
+        for _ in range(self.requests):
+            yield lambda: self.client.get("/update-from-ipfs/", **self.auth(self.admin_key)), 200
@@ -0,0 +1,221 @@
+import json
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+from .conditional import make_etag
+
+def get_stamp(cache, key:str) -> int:
+    """Read a version stamp, a lost stamp starts a new version instead of reviving an old one"""
+    stamp = cache.get(key)
+    if stamp is None:
+        cache.add(key, time.time_ns(), None)
+        stamp = cache.get(key)
+    return stamp
+
+def bump_stamp(cache, key:str):
+    cache.set(key, time.time_ns(), None)
+
+class UserTokensCache:
+    """
+    Per-wallet cache of the /user-tokens/ payload.
+
+    Entries live under a namespace version that is replaced whenever ImageUrl
+    changes, and remember the highest Whatcraft block_number seen when they
+    were built. A newer head (re-read at most every USER_TOKENS_HEAD_TTL
+    seconds) means ownership moved, so older entries are rebuilt.
+    """
+    VERSION_KEY = "user-tokens:version"
+    HEAD_KEY = "user-tokens:head"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "USER_TOKENS_CACHE_ALIAS", "default")]
+
+    def _count(self, hit:bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _version(self, version=None) -> int:
+        if version is None:
+            version = get_stamp(self.cache, self.VERSION_KEY)
+        return version
+
+    def _head(self, head=None) -> int:
+        if head is None:
+            from .models import Whatcraft
+            head = Whatcraft.objects.aggregate(head=Max('block_number'))['head'] or 0
+            self.cache.set(self.HEAD_KEY, head, getattr(settings, "USER_TOKENS_HEAD_TTL", 5))
+        return head
+
+    def _key(self, wallet:str, version:int) -> str:
+        return f"user-tokens:{version}:{wallet.lower()}"
+
+    def get_or_build(self, wallet:str, build) -> dict:
+        """
+        Return the cached {"tokens", "etag"} entry for `wallet`, calling `build()` on a miss.
+        The etag is derived once per build so conditional requests cost nothing on a hit.
+        """
+        state = self.cache.get_many([self.VERSION_KEY, self.HEAD_KEY])
+        version = self._version(state.get(self.VERSION_KEY))
+        head = self._head(state.get(self.HEAD_KEY))
+        key = self._key(wallet, version)
+
+        entry = self.cache.get(key)
+        if entry is not None and entry["head"] >= head:
+            self._count(hit=True)
+            return entry
+
+        self._count(hit=False)
+        entry = self._entry(build(), version, head)
+        if self._cacheable(entry):
+            self.cache.set(key, entry, getattr(settings, "USER_TOKENS_CACHE_TTL", 300))
+        return entry
+
+    async def aget_or_build(self, wallet:str, abuild) -> dict:
+        """get_or_build() for async views, `abuild()` is awaited on a miss"""
+        state = await self.cache.aget_many([self.VERSION_KEY, self.HEAD_KEY])
+        version = state.get(self.VERSION_KEY)
+        if version is None:
+            version = await sync_to_async(get_stamp)(self.cache, self.VERSION_KEY)
+        head = state.get(self.HEAD_KEY)
+        if head is None:
+            from .models import Whatcraft
+            head = (await Whatcraft.objects.aaggregate(head=Max('block_number')))['head'] or 0
+            await self.cache.aset(self.HEAD_KEY, head, getattr(settings, "USER_TOKENS_HEAD_TTL", 5))
+        key = self._key(wallet, version)
+
+        entry = await self.cache.aget(key)
+        if entry is not None and entry["head"] >= head:
+            self._count(hit=True)
+            return entry
+
+        self._count(hit=False)
+        entry = self._entry(await abuild(), version, head)
+        if self._cacheable(entry):
+            await self.cache.aset(key, entry, getattr(settings, "USER_TOKENS_CACHE_TTL", 300))
+        return entry
+
+    def _entry(self, tokens:list, version:int, head:int) -> dict:
+        return {"head": head, "tokens": tokens, "etag": make_etag(version, head, json.dumps(tokens))}
+
+    def _cacheable(self, entry:dict) -> bool:
+        return len(entry["tokens"]) <= getattr(settings, "USER_TOKENS_CACHE_MAX_TOKENS", 5000)
+
+    def invalidate_wallet(self, wallet:str):
+        self.cache.delete(self._key(wallet, self._version(self.cache.get(self.VERSION_KEY))))
+
+    def invalidate_all(self):
+        bump_stamp(self.cache, self.VERSION_KEY)
+
+    def advance_head(self, block_number:int):
+        """Let writers of Whatcraft publish a new head without waiting for the TTL"""
+        self.cache.set(self.HEAD_KEY, block_number, getattr(settings, "USER_TOKENS_HEAD_TTL", 5))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+user_tokens_cache = UserTokensCache()
+
+UPDATE_REQUESTS_STAMP_KEY = "update-requests:version"
+
+def update_requests_stamp() -> int:
+    """Changes whenever an Update_Request is saved or deleted through the ORM"""
+    return get_stamp(caches["default"], UPDATE_REQUESTS_STAMP_KEY)
+
+def bump_update_requests_stamp():
+    bump_stamp(caches["default"], UPDATE_REQUESTS_STAMP_KEY)
+
+class RuntimeConfig:
+    """
+    In-process copies of the AppSettings and ImageUrl singletons.
+
+    Saving either bumps a version stamp. Each worker compares its copy against
+    the stamp at most every RUNTIME_CONFIG_TTL seconds, and reloads any copy
+    older than RUNTIME_CONFIG_MAX_AGE whatever the stamp says. The stamp lives
+    in the default cache, so without a shared one (REDIS_URL) changes made in
+    other processes only arrive through the max age. Returned instances are
+    shared, treat them as read-only.
+    """
+    STAMP_KEY = "runtime-config:version"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}  # name -> (value, loaded at)
+        self._stamp = None
+        self._checked_at = None
+        # bumped whenever the copies are dropped, so a load that raced a bump isn't kept
+        self._generation = 0
+
+    def _cached(self, name:str, now:float):
+        entry = self._values.get(name)
+        if entry is not None and now - entry[1] <= getattr(settings, "RUNTIME_CONFIG_MAX_AGE", 60):
+            return entry[0]
+        return None
+
+    def _fresh(self, name:str):
+        """The value of `name` if it can be returned without a stamp check or a load"""
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at <= getattr(
+                settings, "RUNTIME_CONFIG_TTL", 5
+            ):
+                return self._cached(name, now)
+        return None
+
+    def _get(self, name:str, load):
+        now = time.monotonic()
+        with self._lock:
+            checked_at = self._checked_at
+        if checked_at is None or now - checked_at > getattr(settings, "RUNTIME_CONFIG_TTL", 5):
+            stamp = get_stamp(caches["default"], self.STAMP_KEY)
+            with self._lock:
+                if stamp != self._stamp:
+                    self._values, self._stamp = {}, stamp
+                    self._generation += 1
+                self._checked_at = now
+        with self._lock:
+            value = self._cached(name, now)
+            if value is not None:
+                return value
+            generation = self._generation
+        # loaded without the lock, concurrent misses may each query once
+        value = load()
+        with self._lock:
+            if generation == self._generation:
+                self._values[name] = (value, now)
+        return value
+
+    def app_settings(self):
+        from .models import AppSettings
+        return self._get("app_settings", AppSettings.load)
+
+    def image_url(self) -> str:
+        from .models import ImageUrl
+        return self._get("image_url", lambda: ImageUrl.objects.get(id=1).url)
+
+    async def aimage_url(self) -> str:
+        url = self._fresh("image_url")
+        if url is None:
+            url = await sync_to_async(self.image_url)()
+        return url
+
+    def bump(self):
+        bump_stamp(caches["default"], self.STAMP_KEY)
+        with self._lock:
+            # this worker sees its own writes at once
+            self._values, self._checked_at = {}, None
+            self._generation += 1
+
+runtime_config = RuntimeConfig()
@@ -0,0 +1,26 @@
+import hashlib
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+def make_etag(*parts) -> str:
+    """Quoted ETag from any values that together identify a response body"""
+    digest = hashlib.md5("|".join(str(part) for part in parts).encode(), usedforsecurity=False)
+    return quote_etag(digest.hexdigest())
+
+def etag_matches(request, etag:str) -> bool:
+    """True when the client's If-None-Match already covers `etag`"""
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags or etag.removeprefix('W/') in etags
+
+def not_modified(etag:str) -> Response:
+    return with_etag(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+
+def with_etag(response, etag:str):
+    response['ETag'] = etag
+    # let browsers keep the body but revalidate on every poll
+    response['Cache-Control'] = 'private, no-cache'
+    return response
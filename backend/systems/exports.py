@@ -0,0 +1,338 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Images are already compressed, deflating them again only burns CPU
+STORED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'avif'}
+
+class _ZipChunkBuffer:
+    """
+    Write-only file object for zipfile.
+    Has no tell/seek so zipfile falls back to data descriptors and never rewinds,
+    whatever it wrote since the last drain() can be sent straight to the client.
+    """
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class FetchStats:
+    """Thread-safe counters for image fetches"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.fetched = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def record(self, ok:bool, size:int = 0):
+        with self._lock:
+            if ok:
+                self.fetched += 1
+                self.bytes += size
+            else:
+                self.failed += 1
+
+    def merge(self, other:"FetchStats"):
+        with self._lock:
+            self.fetched += other.fetched
+            self.failed += other.failed
+            self.bytes += other.bytes
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"fetched": self.fetched, "failed": self.failed, "bytes": self.bytes}
+
+# Totals for the lifetime of the process
+fetch_totals = FetchStats()
+
+_session = None
+_session_lock = threading.Lock()
+
+def export_chunk_size() -> int:
+    return getattr(settings, "UPDATE_REQUEST_EXPORT_CHUNK_SIZE", 100)
+
+def fetch_workers() -> int:
+    return getattr(settings, "UPDATE_REQUEST_EXPORT_FETCH_WORKERS", 8)
+
+def get_session() -> requests.Session:
+    """Keep-alive session shared by every export, sized to the fetch pool"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            # no adapter retries, fetch_image retries within its own deadline
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=fetch_workers())
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def fetch_image(img_url:str) -> bytes:
+    """
+    Download one image. Connecting, retries with backoff and the body all
+    share one UPDATE_REQUEST_EXPORT_FETCH_TIMEOUT deadline, so a slow host
+    holds up the in-order archive for at most that long.
+    """
+    timeout = getattr(settings, "UPDATE_REQUEST_EXPORT_FETCH_TIMEOUT", 20)
+    retries = getattr(settings, "UPDATE_REQUEST_EXPORT_FETCH_RETRIES", 3)
+    backoff = getattr(settings, "UPDATE_REQUEST_EXPORT_FETCH_BACKOFF", 0.5)
+    deadline = time.monotonic() + timeout
+    for attempt in range(retries + 1):
+        remaining = deadline - time.monotonic()
+        try:
+            with get_session().get(img_url, stream=True, timeout=(min(5, remaining), remaining)) as response:
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    response.raise_for_status()
+                    chunks = []
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        if time.monotonic() > deadline:
+                            raise TimeoutError(f"Image took longer than {timeout}s")
+                        chunks.append(chunk)
+                    return b"".join(chunks)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+        delay = backoff * 2 ** attempt
+        if time.monotonic() + delay >= deadline:
+            raise TimeoutError(f"Image took longer than {timeout}s")
+        time.sleep(delay)
+
+def _fetch(img_url, stats:FetchStats):
+    """Returns (img_url, content, error) for an image url, never raises"""
+    if not img_url:
+        return None, None, None
+    try:
+        content = fetch_image(img_url)
+    except Exception as e:
+        stats.record(False)
+        return img_url, None, e
+    stats.record(True, len(content))
+    return img_url, content, None
+
+def prefetch(instances, stats:FetchStats, workers:int = None, window:int = None):
+    """
+    Yield (instance, (img_url, content, error)) in the order of `instances`,
+    fetching images for up to `window` upcoming instances in parallel.
+    """
+    workers = workers or fetch_workers()
+    window = window or workers * 2
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zip-fetch") as pool:
+        try:
+            for instance in instances:
+                # resolved here, it may persist the url and workers have no db connection
+                try:
+                    img_url = instance.get_image_original()
+                except Exception as e:
+                    stats.record(False)
+                    future = Future()
+                    future.set_result((None, None, e))
+                else:
+                    # in the request's context, so request metrics count the fetch
+                    future = pool.submit(contextvars.copy_context().run, _fetch, img_url, stats)
+                pending.append((instance, future))
+                if len(pending) >= window:
+                    instance, future = pending.popleft()
+                    yield instance, future.result()
+            while pending:
+                instance, future = pending.popleft()
+                yield instance, future.result()
+        finally:
+            # client went away, drop whatever has not started yet
+            for _, future in pending:
+                future.cancel()
+
+def build_metadata(instance) -> str:
+    return (
+        f"Transaction Hash: {instance.transaction_hash}\n"
+        f"Address: {instance.address}\n"
+        f"Update ID: {instance.update_id}\n"
+        f"Update Name: {instance.update_name}\n"
+        f"Burn IDs: {instance.burn_ids}\n"
+        f"Created At: {instance.created_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"Downloaded: {instance.downloaded}\n"
+        f"Description: {instance.description}\n"
+    )
+
+def image_extension(img_url:str) -> str:
+    return img_url.split('.')[-1].split('?')[0]
+
+def write_instance(zip_file, instance, fetched):
+    """Add the metadata and prefetched image of one Update_Request to an open ZipFile"""
+    zip_file.writestr(f"{instance.transaction_hash}/metadata.txt", build_metadata(instance))
+
+    img_url, content, error = fetched
+    if error is not None:
+        zip_file.writestr(f"{instance.transaction_hash}/error.txt", f"Image failed: {str(error)}")
+    elif content is not None:
+        ext = image_extension(img_url)
+        compress_type = zipfile.ZIP_STORED if ext.lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        zip_file.writestr(f"{instance.transaction_hash}/image.{ext}", content, compress_type=compress_type)
+
+def iter_zip(instances, on_written=None):
+    """
+    Yield a ZIP archive of Update_Request instances one entry at a time.
+    Images are prefetched concurrently but written in order, `on_written(instance)`
+    runs after each instance has been added to the archive.
+    """
+    stats = FetchStats()
+    started = time.monotonic()
+    count = 0
+    buffer = _ZipChunkBuffer()
+    try:
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for instance, fetched in prefetch(instances, stats):
+                write_instance(zip_file, instance, fetched)
+                count += 1
+                if on_written is not None:
+                    on_written(instance)
+                chunk = buffer.drain()
+                if chunk:
+                    yield chunk
+        # central directory is written when the archive closes
+        yield buffer.drain()
+    finally:
+        fetch_totals.merge(stats)
+        logger.info(
+            "Exported %d update requests in %.2fs: %s",
+            count, time.monotonic() - started, stats.snapshot()
+        )
+
+def _spool_file():
+    return tempfile.SpooledTemporaryFile(
+        max_size=getattr(settings, "UPDATE_REQUEST_EXPORT_SPOOL_BYTES", 16 * 1024 * 1024)
+    )
+
+def spool_zip(chunks):
+    """
+    Drain a streamed archive, e.g. from iter_zip(), into a spooled temporary
+    file for async views, which can't leave database work to the response
+    iterator. Returns the rewound file.
+    """
+    archive = _spool_file()
+    try:
+        for chunk in chunks:
+            archive.write(chunk)
+    except BaseException:
+        archive.close()
+        raise
+    finally:
+        # an unfinished generator rolls back whatever it had open
+        chunks.close()
+    archive.seek(0)
+    return archive
+
+async def afetch_image(img_url:str) -> bytes:
+    """fetch_image() for async views, retried within the same overall deadline"""
+    from .aio import client_timeout, get_http_session
+    timeout = getattr(settings, "UPDATE_REQUEST_EXPORT_FETCH_TIMEOUT", 20)
+    retries = getattr(settings, "UPDATE_REQUEST_EXPORT_FETCH_RETRIES", 3)
+    backoff = getattr(settings, "UPDATE_REQUEST_EXPORT_FETCH_BACKOFF", 0.5)
+    deadline = time.monotonic() + timeout
+    for attempt in range(retries + 1):
+        remaining = deadline - time.monotonic()
+        async with get_http_session().get(img_url, timeout=client_timeout(remaining, min(5, remaining))) as response:
+            if response.status not in RETRY_STATUSES or attempt == retries:
+                response.raise_for_status()
+                return await response.read()
+        delay = backoff * 2 ** attempt
+        if time.monotonic() + delay >= deadline:
+            raise TimeoutError(f"Image took longer than {timeout}s")
+        await asyncio.sleep(delay)
+
+async def _afetch(img_url, stats:FetchStats):
+    if not img_url:
+        return None, None, None
+    try:
+        content = await afetch_image(img_url)
+    except Exception as e:
+        stats.record(False)
+        return img_url, None, e
+    stats.record(True, len(content))
+    return img_url, content, None
+
+async def _aimage_url(instance):
+    if instance.image and not instance.image_original_url:
+        # resolving the url saves it
+        return await sync_to_async(instance.get_image_original)()
+    return instance.get_image_original()
+
+async def abuild_zip(instances, window:int = None):
+    """
+    Build a ZIP archive of Update_Request instances, a sync or async iterable,
+    with up to `window` image fetches in flight on the event loop.
+
+    Django 4.1 iterates streaming responses synchronously even under ASGI,
+    so the archive is written to a spooled temporary file and sent once
+    complete. Returns the rewound file and the exported primary keys.
+    """
+    window = window or fetch_workers() * 2
+    stats = FetchStats()
+    started = time.monotonic()
+    exported, pending = [], deque()
+    archive = _spool_file()
+
+    async def fetched(instance):
+        try:
+            img_url = await _aimage_url(instance)
+        except Exception as e:
+            stats.record(False)
+            return None, None, e
+        return await _afetch(img_url, stats)
+
+    if not hasattr(instances, "__aiter__"):
+        instances = _aiter(instances)
+    try:
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            async def write_next():
+                instance, task = pending.popleft()
+                write_instance(zip_file, instance, await task)
+                exported.append(instance.pk)
+
+            async for instance in instances:
+                pending.append((instance, asyncio.ensure_future(fetched(instance))))
+                if len(pending) >= window:
+                    await write_next()
+            while pending:
+                await write_next()
+    except BaseException:
+        for _, task in pending:
+            task.cancel()
+        archive.close()
+        raise
+    finally:
+        fetch_totals.merge(stats)
+        logger.info(
+            "Exported %d update requests in %.2fs: %s",
+            len(exported), time.monotonic() - started, stats.snapshot()
+        )
+    archive.seek(0)
+    return archive, exported
+
+async def _aiter(iterable):
+    for item in iterable:
+        yield item
@@ -0,0 +1,140 @@
+import os
+import struct
+from io import BytesIO
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+
+# Pillow format -> (extension, content type)
+FORMATS = {
+    "PNG": ("png", "image/png"),
+    "JPEG": ("jpg", "image/jpeg"),
+    "WEBP": ("webp", "image/webp"),
+}
+# info keys that carry camera, location or editor data, the color profile is kept
+METADATA_KEYS = {"exif", "xmp", "XML:com.adobe.xmp", "comment", "photoshop"}
+# PNG chunks holding text or EXIF, Pillow only sees those after the pixel data once it decodes
+PNG_METADATA_CHUNKS = {b"tEXt", b"zTXt", b"iTXt", b"eXIf"}
+
+def max_upload_bytes() -> int:
+    return getattr(settings, "IMAGE_UPLOAD_MAX_BYTES", 8 * 1024 * 1024)
+
+class ImageTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_code = 'image_too_large'
+
+    def __init__(self):
+        super().__init__(f"Images are limited to {max_upload_bytes() // (1024 * 1024)} MB")
+
+class ImageSizeLimitHandler(FileUploadHandler):
+    """
+    First upload handler of image uploads, aborts the request as soon as a
+    file goes over IMAGE_UPLOAD_MAX_BYTES instead of buffering all of it.
+    """
+    # room for the other form fields of an update request
+    FORM_OVERHEAD = 64 * 1024
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_bytes = max_upload_bytes()
+        self.received = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length and content_length > self.max_bytes + self.FORM_OVERHEAD:
+            raise ImageTooLarge()
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_bytes:
+            raise ImageTooLarge()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+def png_chunk_types(file) -> set:
+    """Types of the chunks of a PNG, from the chunk headers alone, nothing is inflated"""
+    position = 8  # signature
+    types = set()
+    while True:
+        file.seek(position)
+        header = file.read(8)
+        if len(header) < 8:
+            raise serializers.ValidationError("The image file is truncated.")
+        length, kind = struct.unpack(">I4s", header)
+        types.add(kind)
+        if kind == b"IEND":
+            return types
+        position += 12 + length  # header, data and CRC
+
+class ProcessedImage:
+    def __init__(self, file, width:int, height:int):
+        self.file = file
+        self.width = width
+        self.height = height
+        self.size = file.size
+
+def process_image(file) -> ProcessedImage:
+    """
+    Validate an uploaded image from its header and re-encode it without
+    metadata, downscaled to IMAGE_MAX_DIMENSION, when it needs either.
+    Clean images within bounds are kept byte for byte.
+    """
+    from PIL import Image, UnidentifiedImageError
+    max_dimension = getattr(settings, "IMAGE_MAX_DIMENSION", 2048)
+    max_pixels = getattr(settings, "IMAGE_MAX_PIXELS", 4096 * 4096)
+    if file.size > max_upload_bytes():
+        raise ImageTooLarge()
+
+    file.seek(0)
+    try:
+        # only the header is read here, pixels are decoded on demand
+        image = Image.open(file)
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        # Pillow's own limit, far above ours, is checked on the header too
+        raise serializers.ValidationError(f"Images are limited to {max_pixels} pixels.")
+    except (UnidentifiedImageError, OSError):
+        raise serializers.ValidationError("Upload a valid PNG, JPEG or WebP image.")
+    if image.format not in FORMATS:
+        raise serializers.ValidationError(f"{image.format} images are not supported, use PNG, JPEG or WebP.")
+    width, height = image.size
+    if width * height > max_pixels:
+        raise serializers.ValidationError(f"Images are limited to {max_pixels} pixels.")
+
+    oversized = max(width, height) > max_dimension
+    has_metadata = bool(METADATA_KEYS & set(image.info))
+    if image.format == "PNG":
+        # also catches a PNG cut short, which would otherwise be stored as is
+        has_metadata = has_metadata or bool(PNG_METADATA_CHUNKS & png_chunk_types(file))
+    if not oversized and not has_metadata:
+        file.seek(0)
+        return ProcessedImage(file, width, height)
+
+    fmt = image.format
+    out = BytesIO()
+    try:
+        if oversized:
+            # JPEG can decode straight at a reduced scale
+            image.draft("RGB", (max_dimension, max_dimension))
+            image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        else:
+            image.load()
+        profile = {"icc_profile": image.info["icc_profile"]} if image.info.get("icc_profile") else {}
+        if fmt == "JPEG":
+            image.convert("RGB").save(out, "JPEG", quality=90, optimize=True, **profile)
+        elif fmt == "WEBP":
+            image.save(out, "WEBP", quality=90, **profile)
+        else:
+            image.save(out, "PNG", optimize=True, **profile)
+    except (OSError, Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise serializers.ValidationError("The image could not be decoded.")
+    ext, content_type = FORMATS[fmt]
+    name = f"{os.path.splitext(file.name or 'image')[0]}.{ext}"
+    processed = SimpleUploadedFile(name, out.getvalue(), content_type=content_type)
+    return ProcessedImage(processed, image.width, image.height)
@@ -0,0 +1,272 @@
+import logging
+import time
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from .cache import user_tokens_cache
+from .models import IndexerCheckpoint, IndexerSnapshot, Whatcraft
+from .rpc import RPCError, RpcClient
+
+logger = logging.getLogger(__name__)
+
+# Whatcraft fields an IndexerSnapshot restores
+SNAPSHOT_FIELDS = ("current_owner", "block_number", "timestamp", "transaction_hash")
+
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+def token_topic(token_id:int) -> str:
+    return "0x" + format(token_id, "064x")
+
+def topic_address(topic:str) -> str:
+    return "0x" + topic[-40:].lower()
+
+class IndexStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.blocks = 0
+        self.rows = 0
+
+    def rates(self) -> tuple:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return self.blocks / elapsed, self.rows / elapsed
+
+class TransferIndexer:
+    """
+    Follows ERC-721 Transfer logs of `contract` and keeps Whatcraft's
+    current_owner, block_number and transaction_hash up to date.
+
+    Logs are read with eth_getLogs in block ranges that halve when the node
+    rejects or times out on a range and double after a run of small ones.
+    Only blocks `confirmations` behind the head are indexed, the hashes of
+    recently indexed blocks are kept on the checkpoint so a deeper reorg is
+    detected. The rows each of those chunks changed are snapshotted first,
+    a reorg is rewound from the snapshots without reading the chain again.
+    """
+    def __init__(self, rpc:RpcClient, contract:str, name:str = "whatcraft", start_block:int = None,
+                 confirmations:int = None, chunk_size:int = None, max_chunk_size:int = None,
+                 keep_blocks:int = 64):
+        self.rpc = rpc
+        self.contract = contract
+        self.name = name
+        self.start_block = start_block if start_block is not None else getattr(settings, "INDEXER_START_BLOCK", 0)
+        self.confirmations = confirmations if confirmations is not None else getattr(settings, "INDEXER_CONFIRMATIONS", 5)
+        self.max_chunk_size = max_chunk_size or getattr(settings, "INDEXER_MAX_CHUNK_SIZE", 10000)
+        self.chunk_size = min(chunk_size or getattr(settings, "INDEXER_CHUNK_SIZE", 2000), self.max_chunk_size)
+        self.keep_blocks = keep_blocks
+        self._successes = 0
+        self.stats = IndexStats()
+
+    def checkpoint(self) -> IndexerCheckpoint:
+        checkpoint, _ = IndexerCheckpoint.objects.get_or_create(
+            name=self.name, defaults={"block_number": self.start_block - 1}
+        )
+        return checkpoint
+
+    def safe_head(self) -> int:
+        return int(self.rpc.call("eth_blockNumber"), 16) - self.confirmations
+
+    def block(self, number:int) -> dict:
+        return self.rpc.call("eth_getBlockByNumber", hex(number), False)
+
+    def get_logs(self, from_block:int, to_block:int, token_ids=None) -> list:
+        topics = [TRANSFER_TOPIC]
+        if token_ids:
+            topics += [None, None, [token_topic(token_id) for token_id in token_ids]]
+        return self.rpc.call("eth_getLogs", {
+            "address": self.contract,
+            "fromBlock": hex(from_block),
+            "toBlock": hex(to_block),
+            "topics": topics,
+        })
+
+    def fetch_chunk(self, start:int, last:int, token_ids=None):
+        """Returns (end, logs) for the largest range from `start` the node accepts"""
+        while True:
+            end = min(start + self.chunk_size - 1, last)
+            try:
+                logs = self.get_logs(start, end, token_ids)
+            except (RPCError, requests.Timeout) as e:
+                if self.chunk_size == 1:
+                    raise
+                self.chunk_size = max(1, self.chunk_size // 2)
+                self._successes = 0
+                logger.info("eth_getLogs %s-%s failed (%s), chunk size now %s", start, end, e, self.chunk_size)
+                continue
+            # grow back only after a run of small, successful ranges
+            self._successes = self._successes + 1 if len(logs) < 1000 else 0
+            if self._successes >= 10:
+                self.chunk_size = min(self.chunk_size * 2, self.max_chunk_size)
+                self._successes = 0
+            return end, logs
+
+    def block_timestamps(self, logs) -> dict:
+        timestamps = {}
+        for log in logs:
+            if log.get("blockTimestamp"):
+                timestamps[int(log["blockNumber"], 16)] = int(log["blockTimestamp"], 16)
+        # nodes that don't put timestamps on logs get one batched header lookup
+        missing = sorted({int(log["blockNumber"], 16) for log in logs} - set(timestamps))
+        blocks = self.rpc.batch([("eth_getBlockByNumber", [hex(number), False]) for number in missing])
+        for number, block in zip(missing, blocks):
+            if isinstance(block, RPCError):
+                raise block
+            timestamps[number] = int(block["timestamp"], 16)
+        return timestamps
+
+    def latest_transfers(self, logs) -> dict:
+        """token_id -> the last Transfer log for it"""
+        latest = {}
+        ordered = sorted(logs, key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16)))
+        for log in ordered:
+            topics = log.get("topics", [])
+            # ERC-20 style transfers have no indexed tokenId
+            if len(topics) != 4 or topics[0].lower() != TRANSFER_TOPIC or log.get("removed"):
+                continue
+            latest[int(topics[3], 16)] = log
+        return latest
+
+    def apply(self, logs, snapshot_block:int = None) -> int:
+        """
+        Upsert the final owner of every token in `logs`, returns rows written.
+        With `snapshot_block` the rows are snapshotted before they change.
+        """
+        latest = self.latest_transfers(logs)
+        if not latest:
+            return 0
+        timestamps = self.block_timestamps(latest.values())
+        existing = {row.token_id: row for row in Whatcraft.objects.filter(token_id__in=list(latest))}
+        if snapshot_block is not None:
+            IndexerSnapshot.objects.bulk_create([
+                IndexerSnapshot(
+                    indexer=self.name, block_number=snapshot_block, token_id=token_id,
+                    previous=self.row_state(existing.get(token_id)),
+                )
+                for token_id in latest
+            ], batch_size=500)
+        updates, creates = [], []
+        for token_id, log in latest.items():
+            block_number = int(log["blockNumber"], 16)
+            row = existing.get(token_id) or Whatcraft(token_id=token_id)
+            row.current_owner = topic_address(log["topics"][2])
+            row.block_number = block_number
+            row.timestamp = timestamps[block_number]
+            row.transaction_hash = log["transactionHash"]
+            (updates if row.pk else creates).append(row)
+        Whatcraft.objects.bulk_update(
+            updates, ["current_owner", "block_number", "timestamp", "transaction_hash"], batch_size=500
+        )
+        Whatcraft.objects.bulk_create(creates, batch_size=500)
+        return len(latest)
+
+    @staticmethod
+    def row_state(row) -> dict:
+        if row is None:
+            return None
+        state = {field: getattr(row, field) for field in SNAPSHOT_FIELDS}
+        state["timestamp"] = int(state["timestamp"])
+        return state
+
+    def find_fork(self, checkpoint:IndexerCheckpoint):
+        """Returns the newest tracked block still on the canonical chain, or None if nothing moved"""
+        if not checkpoint.recent_blocks:
+            return None
+        number, block_hash = checkpoint.recent_blocks[-1]
+        if self.block(number)["hash"] == block_hash:
+            return None
+        for number, block_hash in reversed(checkpoint.recent_blocks[:-1]):
+            if self.block(number)["hash"] == block_hash:
+                return number
+        raise RuntimeError(
+            f"Reorg deeper than the {len(checkpoint.recent_blocks)} tracked blocks, "
+            f"reset the '{self.name}' checkpoint to re-index"
+        )
+
+    def rewind(self, checkpoint:IndexerCheckpoint, fork_point:int):
+        """Restore tokens touched after `fork_point` to their state as of `fork_point`"""
+        history = None
+        if checkpoint.snapshots_since is None or fork_point < checkpoint.snapshots_since:
+            # indexed before snapshots were kept
+            history = self.history(fork_point)
+        with transaction.atomic():
+            restored = self.restore_snapshots(fork_point) if history is None else self.replay(*history)
+            IndexerSnapshot.objects.filter(indexer=self.name, block_number__gt=fork_point).delete()
+            checkpoint.block_number = fork_point
+            checkpoint.recent_blocks = [pair for pair in checkpoint.recent_blocks if pair[0] <= fork_point]
+            checkpoint.save()
+        logger.warning("Reorg detected, rewound '%s' to block %s (%s tokens restored)", self.name, fork_point, restored)
+
+    def restore_snapshots(self, fork_point:int) -> int:
+        """Put back the rows the chunks after `fork_point` changed, returns the tokens restored"""
+        previous = {}
+        snapshots = IndexerSnapshot.objects.filter(indexer=self.name, block_number__gt=fork_point)
+        # the earliest snapshot of a token is its state as of the fork point
+        for token_id, state in snapshots.order_by("block_number", "id").values_list("token_id", "previous"):
+            previous.setdefault(token_id, state)
+        # minted in an orphaned block
+        Whatcraft.objects.filter(token_id__in=[token_id for token_id, state in previous.items() if state is None]).delete()
+        rows = list(Whatcraft.objects.filter(
+            token_id__in=[token_id for token_id, state in previous.items() if state is not None]
+        ))
+        for row in rows:
+            for field, value in previous[row.token_id].items():
+                setattr(row, field, value)
+        Whatcraft.objects.bulk_update(rows, SNAPSHOT_FIELDS, batch_size=500)
+        return len(previous)
+
+    def history(self, fork_point:int) -> tuple:
+        """(token ids touched after `fork_point`, all their Transfer logs up to it), read from the start block"""
+        stale = list(Whatcraft.objects.filter(block_number__gt=fork_point).values_list("token_id", flat=True))
+        logs = []
+        for i in range(0, len(stale), 100):
+            token_ids = stale[i:i + 100]
+            start = self.start_block
+            while start <= fork_point:
+                end, chunk = self.fetch_chunk(start, fork_point, token_ids)
+                logs += chunk
+                start = end + 1
+        return stale, logs
+
+    def replay(self, stale:list, logs:list) -> int:
+        restored = self.latest_transfers(logs)
+        # minted in an orphaned block
+        Whatcraft.objects.filter(token_id__in=set(stale) - set(restored)).delete()
+        self.apply(logs)
+        return len(stale)
+
+    def run_once(self, on_progress=None) -> IndexerCheckpoint:
+        """Index from the checkpoint up to the confirmed head"""
+        checkpoint = self.checkpoint()
+        fork_point = self.find_fork(checkpoint)
+        if fork_point is not None:
+            self.rewind(checkpoint, fork_point)
+
+        head = self.safe_head()
+        start = checkpoint.block_number + 1
+        written = 0
+        while start <= head:
+            end, logs = self.fetch_chunk(start, head)
+            end_hash = self.block(end)["hash"]
+            with transaction.atomic():
+                if checkpoint.snapshots_since is None:
+                    checkpoint.snapshots_since = checkpoint.block_number
+                rows = self.apply(logs, snapshot_block=end)
+                checkpoint.block_number = end
+                checkpoint.recent_blocks = (checkpoint.recent_blocks + [[end, end_hash]])[-self.keep_blocks:]
+                # no reorg can be rewound to before the oldest tracked block
+                IndexerSnapshot.objects.filter(
+                    indexer=self.name, block_number__lte=checkpoint.recent_blocks[0][0]
+                ).delete()
+                checkpoint.save()
+            self.stats.blocks += end - start + 1
+            self.stats.rows += rows
+            written += rows
+            if on_progress is not None:
+                on_progress(start, end, len(logs), rows)
+            start = end + 1
+
+        if written:
+            # let /user-tokens/ rebuild without waiting for its own head check
+            user_tokens_cache.advance_head(Whatcraft.objects.aggregate(head=Max("block_number"))["head"] or 0)
+        return checkpoint
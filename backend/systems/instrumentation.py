@@ -0,0 +1,242 @@
+import contextvars
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+# seconds, the upper bounds of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# outbound calls are counted under one of these, database queries under "db"
+KINDS = ("db", "rpc", "ipfs", "cloudinary", "http")
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+# set while an instrumented call runs, urllib3 retries and redirects call urlopen again
+_in_call = contextvars.ContextVar("request_metrics_in_call", default=False)
+
+class RequestMetrics:
+    """
+    Count and time of the database queries and outbound calls made while
+    serving one request, by kind. Threads that work for the request record
+    here as long as they run in a copy of its context.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.calls = {}  # kind -> [count, seconds]
+        self._lock = threading.Lock()
+
+    def add(self, kind:str, seconds:float):
+        with self._lock:
+            entry = self.calls.setdefault(kind, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {kind: tuple(entry) for kind, entry in self.calls.items()}
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in ms"""
+        parts = []
+        for kind, (count, seconds) in sorted(self.snapshot().items(), key=lambda item: KINDS.index(item[0])):
+            unit = "queries" if kind == "db" else "calls"
+            parts.append(f'{kind};dur={seconds * 1000:.1f};desc="{count} {unit}"')
+        parts.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(parts)
+
+@contextmanager
+def measure(metrics:RequestMetrics = None):
+    """Record into `metrics`, a new RequestMetrics by default, for the block"""
+    metrics = metrics or RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+@functools.lru_cache(maxsize=8)
+def _targets(provider_url:str, gateways:tuple) -> tuple:
+    return urlsplit(provider_url).hostname, urlsplit(provider_url).path.rstrip("/"), gateways
+
+def call_kind(url:str) -> str:
+    """Which dependency an outbound url belongs to"""
+    parts = urlsplit(url)
+    rpc_host, rpc_path, gateways = _targets(
+        getattr(settings, "ETH_PROVIDER_URL", ""), tuple(getattr(settings, "IPFS_GATEWAYS", ()))
+    )
+    if "/ipfs/" in parts.path or url.startswith(gateways):
+        return "ipfs"
+    if rpc_host and parts.hostname == rpc_host and parts.path.rstrip("/") == rpc_path:
+        return "rpc"
+    if parts.hostname and parts.hostname.endswith("cloudinary.com"):
+        return "cloudinary"
+    return "http"
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper of every database connection"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add("db", time.perf_counter() - started)
+
+def _connection_created(sender, connection, **kwargs):
+    # the wrapper list outlives reconnects of the same connection object
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+def _instrument_urllib3():
+    """
+    requests, web3's HTTPProvider and the cloudinary SDK all end up in
+    HTTPConnectionPool.urlopen. Streamed bodies are timed up to their headers.
+    """
+    from urllib3.connectionpool import HTTPConnectionPool
+    original = HTTPConnectionPool.urlopen
+    if getattr(original, "instrumented", False):
+        return
+
+    @functools.wraps(original)
+    def urlopen(self, method, url, *args, **kwargs):
+        metrics = _current.get()
+        if metrics is None or _in_call.get():
+            return original(self, method, url, *args, **kwargs)
+        token = _in_call.set(True)
+        started = time.perf_counter()
+        try:
+            return original(self, method, url, *args, **kwargs)
+        finally:
+            _in_call.reset(token)
+            if not url.startswith(("http://", "https://")):
+                url = f"{self.scheme}://{self.host}{url}"
+            metrics.add(call_kind(url), time.perf_counter() - started)
+
+    urlopen.instrumented = True
+    HTTPConnectionPool.urlopen = urlopen
+
+def aiohttp_trace_config():
+    """TraceConfig recording the calls of an aiohttp session, for systems.aio"""
+    import aiohttp
+
+    async def on_request_start(session, context, params):
+        context.metrics = _current.get()
+        context.started = time.perf_counter()
+
+    async def on_request_done(session, context, params):
+        if context.metrics is not None:
+            context.metrics.add(call_kind(str(params.url)), time.perf_counter() - context.started)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_done)
+    trace_config.on_request_exception.append(on_request_done)
+    return trace_config
+
+def install():
+    """Hook the database connections and urllib3, once per process"""
+    connection_created.connect(_connection_created, dispatch_uid="request-metrics")
+    _instrument_urllib3()
+
+class Histogram:
+    def __init__(self, buckets:tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value:float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def _labels(**labels) -> str:
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+def render_counter(name:str, help_text:str, samples) -> list:
+    """Prometheus text lines of a counter from (labels, value) pairs"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(**labels) if labels else ''} {value}")
+    return lines
+
+class MetricsRegistry:
+    """
+    Per-view aggregates of RequestMetrics in this process, rendered in the
+    Prometheus text format. Each worker process keeps its own, so every
+    worker has to be scraped.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._requests = {}  # (view, method, status) -> count
+            self._durations = {}  # view -> Histogram
+            self._dependencies = {}  # (view, kind) -> Histogram of seconds per request
+            self._calls = {}  # (view, kind) -> count
+
+    def _histogram(self, table:dict, key) -> Histogram:
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(tuple(getattr(settings, "REQUEST_METRICS_BUCKETS", DEFAULT_BUCKETS)))
+        return histogram
+
+    def observe(self, view:str, method:str, status:int, metrics:RequestMetrics):
+        duration, calls = metrics.elapsed(), metrics.snapshot()
+        with self._lock:
+            key = (view, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._histogram(self._durations, view).observe(duration)
+            for kind, (count, seconds) in calls.items():
+                self._histogram(self._dependencies, (view, kind)).observe(seconds)
+                self._calls[(view, kind)] = self._calls.get((view, kind), 0) + count
+
+    def render(self) -> str:
+        lines = []
+
+        def histogram(name, help_text, table, label_names):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} histogram"])
+            for key, value in sorted(table.items()):
+                labels = dict(zip(label_names, key if isinstance(key, tuple) else (key,)))
+                cumulative = 0
+                for bound, count in zip(value.buckets + (float("inf"),), value.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f"{name}_bucket{_labels(**labels, le=le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(**labels)} {value.sum!r}")
+                lines.append(f"{name}_count{_labels(**labels)} {value.count}")
+
+        def counter(name, help_text, table, label_names):
+            samples = ((dict(zip(label_names, key)), value) for key, value in sorted(table.items()))
+            lines.extend(render_counter(name, help_text, samples))
+
+        with self._lock:
+            counter("api_requests_total", "Requests served.", self._requests, ("view", "method", "status"))
+            histogram(
+                "api_request_duration_seconds", "Time spent serving a request.", self._durations, ("view",)
+            )
+            histogram(
+                "api_request_dependency_seconds",
+                "Time a request spent in database queries or outbound calls of a kind, for requests making any.",
+                self._dependencies, ("view", "kind"),
+            )
+            counter(
+                "api_request_dependency_calls_total", "Database queries and outbound calls made by requests.",
+                self._calls, ("view", "kind"),
+            )
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
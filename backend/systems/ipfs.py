@@ -0,0 +1,232 @@
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+# ipfs://CID/path or https://any.gateway/ipfs/CID/path
+IPFS_URL_RE = re.compile(r'^(?:ipfs://(?:ipfs/)?|https?://[^/]+/ipfs/)(?P<path>[A-Za-z0-9]+(?:/[^?#]*)?)')
+
+class IPFSError(Exception):
+    pass
+
+class _Cancelled(Exception):
+    pass
+
+def ipfs_path(url:str):
+    """Returns 'CID/path' for an IPFS url, None for anything else"""
+    match = IPFS_URL_RE.match(url)
+    return match.group('path') if match else None
+
+class IPFSClient:
+    """
+    Fetches IPFS content by racing several gateways.
+
+    The fastest known gateway is asked first and another one joins every
+    `hedge_delay` seconds until one succeeds, the rest are abandoned.
+    Gateway latency is tracked as a moving average to rank them. Content is
+    addressed by CID so it never changes, every fetch is kept on disk.
+    """
+    def __init__(self, gateways=None, cache_dir:str = None, hedge_delay:float = None, timeout:float = None):
+        self.gateways = list(gateways or settings.IPFS_GATEWAYS)
+        self.cache_dir = cache_dir or getattr(
+            settings, "IPFS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "what-the-burn-ipfs")
+        )
+        self.hedge_delay = hedge_delay if hedge_delay is not None else getattr(settings, "IPFS_HEDGE_DELAY", 0.5)
+        self.timeout = timeout or getattr(settings, "IPFS_TIMEOUT", 10)
+        self._lock = threading.Lock()
+        # unknown gateways rank in configured order ahead of slow ones
+        self.latency = {gateway: i * 0.001 for i, gateway in enumerate(self.gateways)}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.gateways), pool_maxsize=8)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool = ThreadPoolExecutor(max_workers=len(self.gateways) * 4, thread_name_prefix="ipfs")
+
+    def ranked_gateways(self) -> list:
+        with self._lock:
+            return sorted(self.gateways, key=self.latency.get)
+
+    def _record(self, gateway:str, seconds:float):
+        with self._lock:
+            self.latency[gateway] = 0.7 * self.latency[gateway] + 0.3 * seconds
+
+    def _cache_file(self, path:str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha256(path.encode()).hexdigest())
+
+    def _read_cache(self, path:str):
+        try:
+            with open(self._cache_file(path), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_cache(self, path:str, content:bytes):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        os.replace(tmp, self._cache_file(path))
+
+    def _get(self, gateway:str, path:str, cancelled:threading.Event) -> bytes:
+        started = time.monotonic()
+        try:
+            with self.session.get(gateway + path, stream=True, timeout=(3, self.timeout)) as response:
+                response.raise_for_status()
+                chunks = []
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    if cancelled.is_set():
+                        raise _Cancelled()
+                    chunks.append(chunk)
+        except _Cancelled:
+            raise
+        except Exception:
+            # a failing gateway ranks as if it took the whole timeout
+            self._record(gateway, self.timeout)
+            raise
+        self._record(gateway, time.monotonic() - started)
+        return b"".join(chunks)
+
+    def _race(self, path:str) -> bytes:
+        gateways = self.ranked_gateways()
+        cancelled = threading.Event()
+        deadline = time.monotonic() + self.timeout
+        pending, errors = {}, []
+        try:
+            while True:
+                if gateways and (not pending or len(errors) + len(pending) < len(self.gateways)):
+                    gateway = gateways.pop(0)
+                    # run in the caller's context, so request metrics count the fetch
+                    future = self.pool.submit(contextvars.copy_context().run, self._get, gateway, path, cancelled)
+                    pending[future] = (gateway, time.monotonic())
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise IPFSError(f"Timed out fetching {path}: {errors}")
+                done, _ = wait(
+                    pending, timeout=min(self.hedge_delay, remaining) if gateways else remaining,
+                    return_when=FIRST_COMPLETED
+                )
+                for future in done:
+                    gateway, _ = pending.pop(future)
+                    if future.exception() is None:
+                        # the losers took at least this long
+                        now = time.monotonic()
+                        for loser, started in pending.values():
+                            self._record(loser, now - started)
+                        return future.result()
+                    errors.append(f"{gateway}: {future.exception()}")
+                if not pending and not gateways:
+                    raise IPFSError(f"All gateways failed for {path}: {errors}")
+        finally:
+            cancelled.set()
+
+    def fetch(self, url:str) -> bytes:
+        path = ipfs_path(url)
+        if path is None:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            return response.content
+        content = self._read_cache(path)
+        if content is None:
+            content = self._race(path)
+            self._write_cache(path, content)
+        return content
+
+    def fetch_json(self, url:str):
+        return json.loads(self.fetch(url))
+
+    async def _aget(self, gateway:str, path:str) -> bytes:
+        from .aio import client_timeout, get_http_session
+        started = time.monotonic()
+        try:
+            async with get_http_session().get(gateway + path, timeout=client_timeout(self.timeout, 3)) as response:
+                response.raise_for_status()
+                content = await response.read()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._record(gateway, self.timeout)
+            raise
+        self._record(gateway, time.monotonic() - started)
+        return content
+
+    async def _arace(self, path:str) -> bytes:
+        """_race on the event loop, the abandoned requests are cancelled instead of drained"""
+        gateways = self.ranked_gateways()
+        deadline = time.monotonic() + self.timeout
+        pending, errors = {}, []
+        try:
+            while True:
+                if gateways and (not pending or len(errors) + len(pending) < len(self.gateways)):
+                    gateway = gateways.pop(0)
+                    pending[asyncio.ensure_future(self._aget(gateway, path))] = (gateway, time.monotonic())
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise IPFSError(f"Timed out fetching {path}: {errors}")
+                done, _ = await asyncio.wait(
+                    pending, timeout=min(self.hedge_delay, remaining) if gateways else remaining,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    gateway, _ = pending.pop(task)
+                    if task.exception() is None:
+                        now = time.monotonic()
+                        for loser, started in pending.values():
+                            self._record(loser, now - started)
+                        return task.result()
+                    errors.append(f"{gateway}: {task.exception()}")
+                if not pending and not gateways:
+                    raise IPFSError(f"All gateways failed for {path}: {errors}")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def afetch(self, url:str) -> bytes:
+        """fetch() for async views, over the shared aiohttp session"""
+        path = ipfs_path(url)
+        if path is None:
+            from .aio import client_timeout, get_http_session
+            async with get_http_session().get(url, timeout=client_timeout(self.timeout)) as response:
+                response.raise_for_status()
+                return await response.read()
+        content = self._read_cache(path)
+        if content is None:
+            content = await self._arace(path)
+            self._write_cache(path, content)
+        return content
+
+    async def afetch_json(self, url:str):
+        return json.loads(await self.afetch(url))
+
+def collection_image_base(json_url:str, client:IPFSClient = None) -> str:
+    """Image base url of the collection, from the metadata of token 1"""
+    data = (client or get_ipfs_client()).fetch_json(json_url)
+    image_uri = data.get("image")
+    if not image_uri:
+        raise IPFSError(f"No image in {json_url}")
+    return image_uri.split("/1.")[0] + "/"
+
+async def acollection_image_base(json_url:str, client:IPFSClient = None) -> str:
+    data = await (client or get_ipfs_client()).afetch_json(json_url)
+    image_uri = data.get("image")
+    if not image_uri:
+        raise IPFSError(f"No image in {json_url}")
+    return image_uri.split("/1.")[0] + "/"
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_ipfs_client() -> IPFSClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = IPFSClient()
+        return _client
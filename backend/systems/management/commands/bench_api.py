@@ -0,0 +1,72 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from systems.benchmarks import SCENARIOS, BenchmarkSuite, compare
+from systems.models import Whatcraft
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the API hot paths against seeded rows in a throwaway test database, "
+        "optionally writing JSON results and comparing them against a saved baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=10000, help='Whatcraft rows seeded')
+        parser.add_argument('--update-requests', type=int, default=2000, help='Update_Request rows seeded')
+        parser.add_argument('--users', type=int, default=50, help='Token owners, each with an ExpiringToken')
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per scenario')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='Only run these, repeatable')
+        parser.add_argument('--output', type=str, default=None, help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', type=str, default=None, help='Results file of an earlier run to compare with')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Allowed relative slowdown before a metric counts as a regression')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+
+        suite = BenchmarkSuite(
+            tokens=options['tokens'], update_requests=options['update_requests'],
+            users=options['users'], requests=options['requests'],
+        )
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with connection.schema_editor() as schema_editor:
+                schema_editor.create_model(Whatcraft)
+            results = suite.run(options['scenario'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{'scenario':>22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8} {'errors':>7}"
+        )
+        for name, result in results['scenarios'].items():
+            self.stdout.write(
+                f"{name:>22} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                f"{result['rps']:>8.0f} {result['queries_per_request']:>8.2f} {result['errors']:>7}"
+            )
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        failed = [name for name, result in results['scenarios'].items() if result['errors']]
+        if baseline is not None:
+            rows = compare(results, baseline, options['max_regression'])
+            self.stdout.write(f"\n{'scenario':>22} {'metric':>20} {'baseline':>10} {'current':>10} {'change':>8}")
+            for row in rows:
+                self.stdout.write(
+                    f"{row['scenario']:>22} {row['metric']:>20} {row['baseline']:>10} {row['current']:>10} "
+                    f"{row['change']:>+8.1%}{'  REGRESSED' if row['regressed'] else ''}"
+                )
+            regressed = sorted({f"{row['scenario']} {row['metric']}" for row in rows if row['regressed']})
+            if regressed:
+                raise CommandError(f"Regressed against {options['baseline']}: {', '.join(regressed)}")
+        if failed:
+            raise CommandError(f"Unexpected responses in: {', '.join(failed)}")
@@ -0,0 +1,160 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from systems.models import ImageUrl
+
+# one app per fresh interpreter, the url conf picks sync or async views at import
+PROBE = """
+import asyncio, io, json, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from wsgiref.util import setup_testing_defaults
+config = json.loads(os.environ["BENCH_CONFIG"])
+os.environ["ASYNC_VIEWS"] = "1" if config["mode"] == "asgi" else "0"
+if config["mode"] == "asgi":
+    from core.asgi import application
+else:
+    from core.wsgi import application
+from django.test.utils import setup_test_environment
+from systems.auth import SignedToken
+from systems.models import EthUser
+setup_test_environment()
+
+# signed, so authenticating writes nothing
+authorization = "Token " + SignedToken.issue(EthUser(address="0x" + "be" * 20)).key
+path, query = "/update-from-ipfs/", "url=" + quote(config["json_url"])
+latencies, errors = [], 0
+
+def record(started, status):
+    global errors
+    latencies.append(time.perf_counter() - started)
+    if status != 200:
+        errors += 1
+
+def wsgi_request(_):
+    environ = {
+        "REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": query,
+        "HTTP_HOST": "testserver", "HTTP_AUTHORIZATION": authorization, "wsgi.input": io.BytesIO(),
+    }
+    setup_testing_defaults(environ)
+    status = []
+    started = time.perf_counter()
+    body = application(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+    for _ in body:
+        pass
+    body.close()
+    record(started, status[0])
+
+async def asgi_request():
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(b"host", b"testserver"), (b"authorization", authorization.encode())],
+        "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+    }
+    status = []
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+    started = time.perf_counter()
+    await application(scope, receive, send)
+    record(started, status[0])
+
+async def asgi():
+    limit = asyncio.Semaphore(config["concurrency"])
+    async def one():
+        async with limit:
+            await asgi_request()
+    await asyncio.gather(*(one() for _ in range(config["requests"])))
+
+started = time.perf_counter()
+if config["mode"] == "asgi":
+    asyncio.run(asgi())
+else:
+    # a thread per request in flight, like a threaded WSGI server
+    with ThreadPoolExecutor(max_workers=config["concurrency"]) as pool:
+        list(pool.map(wsgi_request, range(config["requests"])))
+elapsed = time.perf_counter() - started
+latencies.sort()
+print(json.dumps({
+    "rps": len(latencies) / elapsed,
+    "p50": latencies[len(latencies) // 2] * 1000,
+    "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    "errors": errors,
+}))
+"""
+
+class _SlowMetadata(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        body = self.server.body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class _MetadataServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections long before the ASGI run's concurrency
+    request_queue_size = 1024
+
+class Command(BaseCommand):
+    help = (
+        "Concurrent requests per second to update-from-ipfs under WSGI (sync views, a thread per worker) "
+        "and ASGI (async views on one event loop), against a metadata server with fixed latency"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help='Requests per mode')
+        parser.add_argument('--wsgi-workers', type=int, default=8, help='Concurrent requests under WSGI, its worker threads')
+        parser.add_argument('--concurrency', type=int, default=100, help='Concurrent requests under ASGI')
+        parser.add_argument('--latency', type=float, default=0.2, help='Seconds the metadata server takes to answer')
+
+    def handle(self, *args, **options):
+        current = ImageUrl.objects.filter(id=1).values_list('url', flat=True).first()
+        if not current:
+            raise CommandError("Needs an ImageUrl row, the metadata server points back at its url so nothing changes")
+
+        # not an IPFS url, so the IPFS disk cache never answers for the server
+        server = _MetadataServer(("127.0.0.1", 0), _SlowMetadata)
+        server.latency = options['latency']
+        server.body = json.dumps({"image": f"{current}1.png"}).encode()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        json_url = f"http://127.0.0.1:{server.server_address[1]}/metadata/1.json"
+
+        env = {**os.environ}
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(settings.BASE_DIR), env.get('PYTHONPATH')]))
+        self.stdout.write(
+            f"{options['requests']} requests, {options['latency'] * 1000:.0f} ms upstream latency\n"
+            f"{'mode':>6} {'concurrency':>12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}"
+        )
+        try:
+            for mode, concurrency in (("wsgi", options['wsgi_workers']), ("asgi", options['concurrency'])):
+                env['BENCH_CONFIG'] = json.dumps({
+                    "mode": mode, "concurrency": concurrency, "requests": options['requests'], "json_url": json_url
+                })
+                result = subprocess.run(
+                    [sys.executable, '-c', PROBE], env=env, cwd=settings.BASE_DIR, capture_output=True, text=True
+                )
+                if result.returncode != 0:
+                    raise CommandError(f"{mode} run failed:\n{result.stderr}")
+                probe = json.loads(result.stdout.strip().splitlines()[-1])
+                self.stdout.write(
+                    f"{mode:>6} {concurrency:>12} {probe['rps']:>8.0f} {probe['p50']:>8.0f} "
+                    f"{probe['p95']:>8.0f} {probe['errors']:>7}"
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
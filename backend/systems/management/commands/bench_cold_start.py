@@ -0,0 +1,57 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# run in a fresh interpreter, the same work a serverless cold start does before its first request
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from core.wsgi import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+elapsed = time.perf_counter() - started
+print(json.dumps({"ms": elapsed * 1000, "modules": sorted(sys.modules)}))
+"""
+
+class Command(BaseCommand):
+    help = "Measure the import time of the WSGI app and url conf, failing over budget"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--settings-module', type=str, default=None,
+                            help='Settings to start with, defaults to the current DJANGO_SETTINGS_MODULE')
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts measured, the median is compared')
+        parser.add_argument('--budget-ms', type=float, default=None, help='Defaults to COLD_START_BUDGET_MS')
+
+    def handle(self, *args, **options):
+        settings_module = options['settings_module'] or os.environ.get('DJANGO_SETTINGS_MODULE', 'core.settings')
+        budget = options['budget_ms'] or getattr(settings, "COLD_START_BUDGET_MS", 600)
+        forbidden = getattr(settings, "COLD_START_FORBIDDEN_MODULES", ())
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings_module}
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(settings.BASE_DIR), env.get('PYTHONPATH')]))
+
+        timings, loaded = [], set()
+        for _ in range(options['runs']):
+            result = subprocess.run(
+                [sys.executable, '-c', PROBE], env=env, cwd=settings.BASE_DIR, capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                raise CommandError(f"Startup failed:\n{result.stderr}")
+            probe = json.loads(result.stdout.strip().splitlines()[-1])
+            timings.append(probe['ms'])
+            loaded = set(probe['modules'])
+
+        median = statistics.median(timings)
+        heavy = sorted(module for module in forbidden if module in loaded)
+        self.stdout.write(
+            f"{settings_module}: median {median:.0f} ms, min {min(timings):.0f} ms, "
+            f"max {max(timings):.0f} ms, {len(loaded)} modules"
+        )
+        if heavy:
+            raise CommandError(f"Imported at startup, should be lazy: {', '.join(heavy)}")
+        if median > budget:
+            raise CommandError(f"Cold start {median:.0f} ms is over the {budget:.0f} ms budget")
+        self.stdout.write(self.style.SUCCESS(f"Within the {budget:.0f} ms budget"))
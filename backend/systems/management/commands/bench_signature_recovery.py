@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from systems.signatures import BACKENDS
+
+class Command(BaseCommand):
+    help = "Recoveries per second on one core for each installed signature recovery backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seconds', type=float, default=2.0, help='Time spent per backend')
+
+    def handle(self, *args, **options):
+        from eth_account import Account
+        from eth_account.messages import encode_defunct
+        account = Account.create()
+        text = "Sign this message to authenticate: 0123456789abcdef0123456789abcdef"
+        signature = account.sign_message(encode_defunct(text=text)).signature.hex()
+
+        self.stdout.write(f"{'backend':>12} {'recoveries/s':>13} {'us/call':>8}")
+        for name, backend_class in BACKENDS.items():
+            try:
+                backend = backend_class()
+            except ImportError:
+                self.stdout.write(f"{name:>12} {'not installed':>13}")
+                continue
+            if backend.recover(text, signature) != account.address:
+                raise CommandError(f"{name} recovered the wrong address")
+            calls = 0
+            started = time.perf_counter()
+            deadline = started + options['seconds']
+            while time.perf_counter() < deadline:
+                backend.recover(text, signature)
+                calls += 1
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"{name:>12} {calls / elapsed:>13.0f} {elapsed / calls * 1e6:>8.0f}")
@@ -0,0 +1,56 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from systems.auth import SignedToken, token_cache
+from systems.models import EthUser, ExpiringToken
+
+class _Rollback(Exception):
+    pass
+
+class _Ping(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({"address": request.user.address})
+
+class Command(BaseCommand):
+    help = "Authenticated requests per second with database and signed session tokens (seeded rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per mode')
+
+    def handle(self, *args, **options):
+        view = _Ping.as_view()
+        factory = RequestFactory()
+        self.stdout.write(f"{'mode':>16} {'req/s':>8} {'queries/req':>12}")
+        try:
+            with transaction.atomic():
+                user = EthUser.objects.create_user("0x" + "be" * 20)
+                db_key = ExpiringToken.objects.create(user=user, key="b" * 40).key
+                signed_key = SignedToken.issue(user).key
+                modes = [
+                    ("db uncached", db_key, True),
+                    ("db cached", db_key, False),
+                    ("signed", signed_key, False),
+                ]
+                for name, key, clear_cache in modes:
+                    token_cache.clear()
+                    request = factory.get("/", HTTP_AUTHORIZATION=f"Token {key}")
+                    with CaptureQueriesContext(connection) as queries:
+                        started = time.perf_counter()
+                        for _ in range(options['requests']):
+                            if clear_cache:
+                                token_cache.clear()
+                            view(request)
+                        elapsed = time.perf_counter() - started
+                    rate = options['requests'] / elapsed
+                    self.stdout.write(f"{name:>16} {rate:>8.0f} {len(queries) / options['requests']:>12.2f}")
+                raise _Rollback
+        except _Rollback:
+            pass
+        token_cache.clear()
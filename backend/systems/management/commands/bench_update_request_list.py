@@ -0,0 +1,61 @@
+import time
+import cloudinary
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from systems.models import Update_Request
+from systems.serializers import UpdateRequestSerializer, UpdateRequestRows
+
+class _Rollback(Exception):
+    pass
+
+class Command(BaseCommand):
+    help = "Compare the serializer and .values() list paths for Update_Request (seeded rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000], help='Row counts to benchmark')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per path, the best is reported')
+
+    def handle(self, *args, **options):
+        # url building only needs a cloud name, nothing is uploaded
+        if not cloudinary.config().cloud_name:
+            cloudinary.config(cloud_name="benchmark")
+
+        self.stdout.write(f"{'rows':>8} {'serializer ms':>14} {'values ms':>10} {'speedup':>8}")
+        for count in options['rows']:
+            try:
+                with transaction.atomic():
+                    self.seed(count)
+                    slow = self.best_of(options['repeat'], self.serializer_path)
+                    fast = self.best_of(options['repeat'], self.values_path)
+                    raise _Rollback
+            except _Rollback:
+                pass
+            self.stdout.write(f"{count:>8} {slow * 1000:>14.1f} {fast * 1000:>10.1f} {slow / fast:>7.1f}x")
+
+    def seed(self, count):
+        rows = []
+        for i in range(count):
+            image = f"image/upload/v1/bench/{i}.png"
+            original, small = Update_Request.build_image_urls(image)
+            rows.append(Update_Request(
+                transaction_hash=f"0xbench{i:060}", address="0x" + "b" * 40, update_id=i,
+                burn_ids=[i, i + 1], update_name=f"bench {i}", image=image,
+                image_original_url=original, image_small_url=small,
+            ))
+        Update_Request.objects.bulk_create(rows, batch_size=1000)
+
+    def best_of(self, repeat, path):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            path()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def serializer_path(self):
+        return UpdateRequestSerializer(Update_Request.objects.all(), many=True).data
+
+    def values_path(self):
+        rows = UpdateRequestRows()
+        return rows.serialize(rows.values(Update_Request.objects.all()))
@@ -0,0 +1,58 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from systems.indexer import TransferIndexer
+from systems.rpc import TRANSIENT_ERRORS, get_client, retry_delay
+
+class Command(BaseCommand):
+    help = "Follow Transfer logs of the collection contract and keep the Whatcraft table up to date"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rpc-url', type=str, default=None, help='JSON-RPC endpoint, defaults to ETH_PROVIDER_URL')
+        parser.add_argument('--contract', type=str, default=None, help='Defaults to ETH_COLLECTION_CONTRACT')
+        parser.add_argument('--from-block', type=int, default=None, help='First block when there is no checkpoint yet')
+        parser.add_argument('--confirmations', type=int, default=None)
+        parser.add_argument('--chunk-size', type=int, default=None, help='Initial eth_getLogs block range')
+        parser.add_argument('--once', action='store_true', help='Exit once caught up instead of polling')
+
+    def handle(self, *args, **options):
+        indexer = TransferIndexer(
+            get_client(options['rpc_url']),
+            options['contract'] or settings.ETH_COLLECTION_CONTRACT,
+            start_block=options['from_block'],
+            confirmations=options['confirmations'],
+            chunk_size=options['chunk_size'],
+        )
+        poll_interval = getattr(settings, "INDEXER_POLL_INTERVAL", 2)
+        failures = 0
+        while True:
+            try:
+                checkpoint = indexer.run_once(on_progress=self.report(indexer))
+            except TRANSIENT_ERRORS as e:
+                # each chunk is committed with the checkpoint, the next pass resumes after the last one
+                failures += 1
+                if options['once'] and failures >= getattr(settings, "RPC_RETRY_ATTEMPTS", 5):
+                    raise
+                delay = retry_delay(failures, poll_interval)
+                self.stderr.write(f"Indexing pass failed ({e}), retrying in {delay:.0f}s")
+                time.sleep(delay)
+                continue
+            failures = 0
+            if options['once']:
+                break
+            time.sleep(poll_interval)
+
+        blocks_per_second, rows_per_second = indexer.stats.rates()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed to block {checkpoint.block_number}: {indexer.stats.blocks} blocks, {indexer.stats.rows} rows "
+            f"({blocks_per_second:.1f} blocks/s, {rows_per_second:.1f} rows/s)"
+        ))
+
+    def report(self, indexer):
+        def on_progress(start, end, transfers, rows):
+            blocks_per_second, rows_per_second = indexer.stats.rates()
+            self.stdout.write(
+                f"Blocks {start}-{end}: {transfers} transfers, {rows} rows "
+                f"({blocks_per_second:.1f} blocks/s, {rows_per_second:.1f} rows/s, chunk {indexer.chunk_size})"
+            )
+        return on_progress
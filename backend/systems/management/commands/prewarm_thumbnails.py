@@ -0,0 +1,37 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from systems.models import ImageUrl, Whatcraft
+from systems.thumbnails import get_thumbnail_cache
+
+class Command(BaseCommand):
+    help = "Render thumbnails of every token ahead of the first request"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Tokens rendered concurrently')
+        parser.add_argument('--force', action='store_true', help='Render tokens that are already cached again')
+
+    def handle(self, *args, **options):
+        workers = options['workers'] or getattr(settings, "THUMBNAIL_PREWARM_WORKERS", 8)
+        image_url = ImageUrl.objects.get(id=1).url
+        thumbnails = get_thumbnail_cache()
+        token_ids = list(Whatcraft.objects.order_by('token_id').values_list('token_id', flat=True))
+        if not options['force']:
+            token_ids = [token_id for token_id in token_ids if not thumbnails.has(image_url, token_id)]
+
+        started = time.monotonic()
+        done = failed = 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(thumbnails.warm, image_url, token_id): token_id for token_id in token_ids}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f"Token {futures[future]}: {e}")
+                if (done + failed) % 100 == 0:
+                    rate = (done + failed) / max(time.monotonic() - started, 1e-9)
+                    self.stdout.write(f"{done + failed}/{len(token_ids)} ({rate:.1f} tokens/s)")
+        self.stdout.write(self.style.SUCCESS(f"Rendered {done} tokens, {failed} failed"))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from systems.models import ExpiringToken, RevokedToken
+
+class Command(BaseCommand):
+    help = "Delete expired auth tokens in bounded batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Tokens deleted per statement')
+        parser.add_argument('--time-budget', type=float, default=None, help='Seconds to run before stopping')
+
+    def handle(self, *args, **options):
+        deleted, finished = ExpiringToken.purge_expired(
+            batch_size=options['batch_size'],
+            time_budget=options['time_budget']
+        )
+        revoked = RevokedToken.purge_expired()
+        if revoked:
+            self.stdout.write(f"Dropped {revoked} expired deny-list entries.")
+        if finished:
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired tokens."))
+        else:
+            self.stdout.write(self.style.WARNING(f"Deleted {deleted} expired tokens, time budget reached before finishing."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from systems.auth import SIGNED_TOKEN_PREFIX, SignedToken, revoke_signed_tokens, token_cache
+from systems.models import ExpiringToken
+
+class Command(BaseCommand):
+    help = "Revoke the session tokens of an address, or a single token"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', type=str, default=None, help='Revoke every token issued to this address so far')
+        parser.add_argument('--token', type=str, default=None, help='Revoke this token only')
+
+    def handle(self, *args, **options):
+        address, key = options['address'], options['token']
+        if not address and not key:
+            raise CommandError("Pass --address or --token")
+        if key and key.startswith(SIGNED_TOKEN_PREFIX):
+            revoke_signed_tokens(token=SignedToken.decode(key))
+        elif key:
+            ExpiringToken.objects.filter(key=key).delete()
+            token_cache.invalidate(key)
+        if address:
+            revoke_signed_tokens(address=address)
+            deleted, _ = ExpiringToken.objects.filter(user__address__iexact=address).delete()
+            token_cache.clear()
+            self.stdout.write(f"Deleted {deleted} database tokens of {address}.")
+        # other workers drop cached database tokens and reload the deny-list within their refresh interval
+        self.stdout.write(self.style.SUCCESS("Revoked."))
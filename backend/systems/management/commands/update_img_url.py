@@ -1,7 +1,5 @@
 from django.core.management.base import BaseCommand
 from systems.models import ImageUrl
-import requests
-from web3 import Web3
 from django.conf import settings
 
 class Command(BaseCommand):
@@ -22,16 +20,13 @@ class Command(BaseCommand):
             self.stderr.write(f"Error invalid parameters")
 
     def handel_ipfs(self):
+        from systems.ipfs import collection_image_base
         json_url = self.get_token_uri(1)
         try:
-            response = requests.get(json_url, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            image_uri:str = data.get("image")
-            image_uri = image_uri.split("/1.")[0]+"/"
-
+            image_uri = collection_image_base(json_url)
         except Exception as e:
             self.stderr.write(f"Error fetching {json_url}: {e}")
+            return
         self.update(image_uri)
 
     def update(self, img):
@@ -42,19 +37,5 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS("Finished populating tokens."))
 
     def get_token_uri(self, token_id:int = 1)-> str:
-        rpc_url = settings.ETH_PROVIDER_URL
-        web3 = Web3(Web3.HTTPProvider(rpc_url))
-        assert web3.is_connected(), "Can't connect to HyperEVM"
-        contract_address = settings.ETH_COLLECTION_CONTRACT
-        abi = [
-            {
-                "constant": True,
-                "inputs": [{"name": "tokenId","type": "uint256"}],
-                "name": "tokenURI",
-                "outputs": [{"name": "", "type": "string"}],
-                "type": "function"
-            }
-        ]
-        contract = web3.eth.contract(address=contract_address, abi=abi)
-        token_uri:str = contract.functions.tokenURI(token_id).call()
-        return token_uri
+        from systems.rpc import get_client
+        return get_client().token_uri(settings.ETH_COLLECTION_CONTRACT, token_id)
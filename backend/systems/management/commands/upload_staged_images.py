@@ -0,0 +1,28 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from systems.uploads import ImageUploader
+
+class Command(BaseCommand):
+    help = "Upload images staged by update-request creation to image storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Images claimed per batch')
+        parser.add_argument('--workers', type=int, default=None, help='Concurrent uploads')
+        parser.add_argument('--once', action='store_true', help='Exit when nothing is due instead of polling')
+
+    def handle(self, *args, **options):
+        uploader = ImageUploader(batch_size=options['batch_size'], workers=options['workers'])
+        poll_interval = getattr(settings, "IMAGE_UPLOAD_POLL_INTERVAL", 5)
+        totals = {"uploaded": 0, "retrying": 0, "failed": 0}
+        while True:
+            counts = uploader.upload_batch()
+            for outcome, count in counts.items():
+                totals[outcome] += count
+            if any(counts.values()):
+                self.stdout.write(f"{counts}")
+            if sum(counts.values()) < uploader.batch_size:
+                if options['once']:
+                    break
+                time.sleep(poll_interval)
+        self.stdout.write(self.style.SUCCESS(f"Done: {totals}"))
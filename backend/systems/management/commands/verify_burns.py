@@ -0,0 +1,45 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from systems.rpc import TRANSIENT_ERRORS, get_client, retry_delay
+from systems.verification import BurnVerifier
+
+class Command(BaseCommand):
+    help = "Verify pending update requests against their on-chain burn transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows checked per JSON-RPC batch')
+        parser.add_argument('--once', action='store_true', help='Exit when no pending rows are left instead of polling')
+
+    def handle(self, *args, **options):
+        verifier = BurnVerifier(get_client(), batch_size=options['batch_size'])
+        poll_interval = getattr(settings, "VERIFY_POLL_INTERVAL", 5)
+        started = time.monotonic()
+        totals = {"verified": 0, "rejected": 0, "pending": 0}
+        failures = 0
+        while True:
+            try:
+                counts = verifier.verify_batch()
+            except TRANSIENT_ERRORS as e:
+                failures += 1
+                if options['once'] and failures >= getattr(settings, "RPC_RETRY_ATTEMPTS", 5):
+                    raise
+                delay = retry_delay(failures, poll_interval)
+                self.stderr.write(f"Verification pass failed ({e}), retrying in {delay:.0f}s")
+                time.sleep(delay)
+                continue
+            failures = 0
+            checked = sum(counts.values())
+            for outcome, count in counts.items():
+                totals[outcome] += count
+            if checked:
+                rate = sum(totals.values()) / max(time.monotonic() - started, 1e-9)
+                self.stdout.write(f"Checked {checked}: {counts} ({rate:.1f} rows/s)")
+            # a short batch means we are caught up, rows still pending wait for the next pass
+            caught_up = checked < verifier.batch_size
+            if options['once'] and (caught_up or counts["pending"] == checked):
+                break
+            # a full batch of rows still pending would otherwise be re-checked back to back
+            if caught_up or not (counts["verified"] or counts["rejected"]):
+                time.sleep(poll_interval)
+        self.stdout.write(self.style.SUCCESS(f"Done: {totals}"))
@@ -0,0 +1,52 @@
+import asyncio
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse
+from django.utils.decorators import sync_and_async_middleware
+from .instrumentation import RequestMetrics, measure, registry
+
+def view_label(request) -> str:
+    """The url name of the view, so label values stay bounded whatever paths are requested"""
+    match = getattr(request, "resolver_match", None)
+    return match.view_name if match is not None else "unmatched"
+
+def _streamed(content, metrics:RequestMetrics, request, response):
+    # generated after the middleware returned, the calls made meanwhile belong to the request
+    try:
+        with measure(metrics):
+            yield from content
+    finally:
+        registry.observe(view_label(request), request.method, response.status_code, metrics)
+
+def _finish(request, response, metrics:RequestMetrics):
+    if getattr(settings, "REQUEST_METRICS_SERVER_TIMING", True):
+        response["Server-Timing"] = metrics.server_timing()
+    # a FileResponse is ready before it is returned and keeps its file for wsgi.file_wrapper
+    if response.streaming and not isinstance(response, FileResponse):
+        response.streaming_content = _streamed(response.streaming_content, metrics, request, response)
+    else:
+        registry.observe(view_label(request), request.method, response.status_code, metrics)
+    return response
+
+@sync_and_async_middleware
+def request_metrics_middleware(get_response):
+    """
+    Counts and times the database queries and outbound calls of each request,
+    sends them back in a Server-Timing header and adds them to the per-view
+    histograms served by MetricsView. Streamed responses are in the header up
+    to their first byte and in the histograms until their last one.
+    """
+    if not getattr(settings, "REQUEST_METRICS_ENABLED", True):
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            with measure() as metrics:
+                response = await get_response(request)
+            return _finish(request, response, metrics)
+    else:
+        def middleware(request):
+            with measure() as metrics:
+                response = get_response(request)
+            return _finish(request, response, metrics)
+    return middleware
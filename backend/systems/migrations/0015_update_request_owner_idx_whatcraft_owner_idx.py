@@ -0,0 +1,32 @@
+# Generated by Django 5.1.6 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+def create_whatcraft_owner_index(apps, schema_editor):
+    # Whatcraft is filled externally, only index it where the table exists
+    if 'Whatcraft' not in schema_editor.connection.introspection.table_names():
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS whatcraft_owner_idx ON "Whatcraft" (current_owner)'
+    )
+
+
+def drop_whatcraft_owner_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS whatcraft_owner_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('systems', '0014_whatcraft_alter_imageurl_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='update_request',
+            index=models.Index(django.db.models.functions.text.Lower('address'), models.F('update_id'), name='update_request_owner_idx'),
+        ),
+        migrations.RunPython(create_whatcraft_owner_index, drop_whatcraft_owner_index),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 11:40
+
+from django.db import migrations
+
+
+def create_whatcraft_block_index(apps, schema_editor):
+    # max(block_number) is the /user-tokens/ cache freshness check
+    if 'Whatcraft' not in schema_editor.connection.introspection.table_names():
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS whatcraft_block_idx ON "Whatcraft" (block_number)'
+    )
+
+
+def drop_whatcraft_block_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX IF EXISTS whatcraft_block_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('systems', '0015_update_request_owner_idx_whatcraft_owner_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_whatcraft_block_index, drop_whatcraft_block_index),
+    ]
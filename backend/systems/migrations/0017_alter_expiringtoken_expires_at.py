@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('systems', '0016_whatcraft_block_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='expiringtoken',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('systems', '0017_alter_expiringtoken_expires_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='update_request',
+            index=models.Index(fields=['downloaded', 'created_at', 'transaction_hash'], name='update_request_list_idx'),
+        ),
+    ]
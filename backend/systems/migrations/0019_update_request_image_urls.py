@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('systems', '0018_update_request_list_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='update_request',
+            name='image_original_url',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddField(
+            model_name='update_request',
+            name='image_small_url',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+    ]
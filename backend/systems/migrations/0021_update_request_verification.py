@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('systems', '0020_indexercheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='update_request',
+            name='verification_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('verified', 'Verified'), ('rejected', 'Rejected')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='update_request',
+            name='verification_block',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='update_request',
+            name='verification_error',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='update_request',
+            name='verification_checked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='update_request',
+            index=models.Index(fields=['verification_status', 'verification_checked_at'], name='update_request_verify_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:05
+
+import cloudinary.models
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('systems', '0021_update_request_verification'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='update_request',
+            name='image',
+            field=cloudinary.models.CloudinaryField(blank=True, max_length=255, null=True, verbose_name='image'),
+        ),
+        migrations.CreateModel(
+            name='StagedImage',
+            fields=[
+                ('update_request', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='staged_image', serialize=False, to='systems.update_request')),
+                ('data', models.BinaryField()),
+                ('name', models.CharField(max_length=255)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, default='', max_length=255)),
+                ('next_attempt_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
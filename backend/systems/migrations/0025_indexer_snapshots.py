@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('systems', '0024_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexercheckpoint',
+            name='snapshots_since',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='IndexerSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('indexer', models.CharField(max_length=64)),
+                ('block_number', models.BigIntegerField()),
+                ('token_id', models.BigIntegerField()),
+                ('previous', models.JSONField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['indexer', 'block_number'], name='indexer_snapshot_block_idx')],
+            },
+        ),
+    ]
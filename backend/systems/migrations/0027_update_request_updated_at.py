@@ -0,0 +1,20 @@
+# Generated by Django 5.1.6 on 2026-10-18 23:55
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('systems', '0026_usednonce'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='update_request',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
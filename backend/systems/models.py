@@ -2,9 +2,10 @@ from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.conf import settings
 from django.utils import timezone
+from django.db.models.functions import Lower
 import datetime
+import time
 from cloudinary.models import CloudinaryField
-from cloudinary import CloudinaryImage
 
 class EthUserManager(BaseUserManager):
     def create_user(self, address, password=None, **extra_fields):
@@ -88,8 +89,42 @@ class Whatcraft(models.Model):
     class Meta:
         managed = False  # Prevent Django from altering the table
         db_table = 'Whatcraft'
+        # current_owner and block_number are indexed by migrations 0015 and 0016,
+        # Django won't index unmanaged tables
+
+class IndexerCheckpoint(models.Model):
+    """Progress of a block indexer, see systems.indexer"""
+    name = models.CharField(max_length=64, primary_key=True)
+    block_number = models.BigIntegerField(default=0)
+    # [block_number, block_hash] pairs of recently indexed blocks, used to detect reorgs
+    recent_blocks = models.JSONField(default=list)
+    # chunks ending after this block have IndexerSnapshot rows, null until the first one
+    snapshots_since = models.BigIntegerField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.block_number}"
+
+class IndexerSnapshot(models.Model):
+    """
+    A Whatcraft row as it was before the indexer chunk ending at
+    `block_number` changed it, kept while that chunk can still be reorged.
+    """
+    indexer = models.CharField(max_length=64)
+    block_number = models.BigIntegerField()
+    token_id = models.BigIntegerField()
+    # current_owner, block_number, timestamp and transaction_hash, null when the chunk created the row
+    previous = models.JSONField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['indexer', 'block_number'], name='indexer_snapshot_block_idx')]
 
 class Update_Request(models.Model):
+    class Verification(models.TextChoices):
+        PENDING = 'pending'
+        VERIFIED = 'verified'
+        REJECTED = 'rejected'
+
     transaction_hash = models.CharField(max_length=88, primary_key=True, unique=True, null= False)
     address = models.CharField(max_length=44)
     update_id = models.IntegerField()
@@ -97,35 +132,175 @@ class Update_Request(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     update_name = models.CharField(max_length=100)
     description = models.TextField(blank=True, null=True)
-    image = CloudinaryField('image')  # Cloudinary handles storage
+    # empty until the uploader has pushed the StagedImage to storage
+    image = CloudinaryField('image', null=True, blank=True)
+    image_original_url = models.CharField(max_length=500, blank=True, default='')
+    image_small_url = models.CharField(max_length=500, blank=True, default='')
+    # of the stored image, after normalization on upload
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_bytes = models.PositiveIntegerField(null=True, blank=True)
     downloaded = models.BooleanField(default=False)
+    # filled in off the request path by the verify_burns command
+    verification_status = models.CharField(max_length=10, choices=Verification.choices, default=Verification.PENDING)
+    verification_block = models.BigIntegerField(null=True, blank=True)
+    verification_error = models.CharField(max_length=255, blank=True, default='')
+    verification_checked_at = models.DateTimeField(null=True, blank=True)
+    # also set by the .update() and bulk_update() writers, the list etag covers it
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(Lower('address'), 'update_id', name='update_request_owner_idx'),
+            models.Index(fields=['downloaded', 'created_at', 'transaction_hash'], name='update_request_list_idx'),
+            models.Index(fields=['verification_status', 'verification_checked_at'], name='update_request_verify_idx'),
+        ]
 
     def __str__(self):
         return f"{self.update_name} ({self.address})"
 
+    # stored value of `image` as last loaded or saved, None for a new row
+    _stored_image = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'image' in field_names:
+            instance._stored_image = instance.image_value()
+        return instance
+
+    def image_value(self):
+        """`image` as it is kept in the database"""
+        return self._meta.get_field('image').get_prep_value(self.image) or None
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # the image is only uploaded during save, derive its urls afterwards
+        image = self.image_value()
+        if image and (not self.image_small_url or image != self._stored_image):
+            self.store_image_urls()
+        elif not image and (self.image_original_url or self.image_small_url):
+            self.image_original_url = self.image_small_url = ''
+            Update_Request.objects.filter(pk=self.pk).update(
+                image_original_url='', image_small_url='', updated_at=timezone.now()
+            )
+        self._stored_image = image
+
+    @classmethod
+    def build_image_urls(cls, image):
+        """Returns (original, small 300x300) urls for a Cloudinary resource or its stored value"""
+        from cloudinary import CloudinaryImage
+        image = cls._meta.get_field('image').to_python(image)
+        small = CloudinaryImage(image.public_id).build_url(width=300, height=300, crop='limit')
+        return image.url, small
+
+    def store_image_urls(self):
+        """Build and persist the derived image urls"""
+        self.image_original_url, self.image_small_url = self.build_image_urls(self.image)
+        Update_Request.objects.filter(pk=self.pk).update(
+            image_original_url=self.image_original_url,
+            image_small_url=self.image_small_url,
+            updated_at=timezone.now()
+        )
+
     def get_image_small(self):
         """Returns small version (300x300)"""
         if self.image:
-            return CloudinaryImage(self.image.public_id).build_url(width=300, height=300, crop='limit')
+            if not self.image_small_url:
+                self.store_image_urls()
+            return self.image_small_url
         return None
 
     def get_image_original(self):
         """Returns original version"""
         if self.image:
-            return self.image.url
+            if not self.image_original_url:
+                self.store_image_urls()
+            return self.image_original_url
         return None
 
+class StagedImage(models.Model):
+    """An Update_Request image held in the database until the uploader stores it"""
+    update_request = models.OneToOneField(
+        Update_Request, on_delete=models.CASCADE, primary_key=True, related_name='staged_image'
+    )
+    data = models.BinaryField()
+    name = models.CharField(max_length=255)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.CharField(max_length=255, blank=True, default='')
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.attempts} attempts)"
+
+    @classmethod
+    def stage(cls, update_request, file):
+        return cls.objects.create(update_request=update_request, data=file.read(), name=file.name or 'image')
+
 class ExpiringToken(models.Model):
     key = models.CharField(max_length=40, primary_key=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     created = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
 
     def is_expired(self):
         return timezone.now() >= self.expires_at
 
+    @classmethod
+    def purge_expired(cls, batch_size=None, time_budget=None):
+        """
+        Delete expired tokens in batches of `batch_size` until none are left
+        or `time_budget` seconds have passed.
+        Returns (deleted, finished) where finished is False if rows may remain.
+        """
+        batch_size = batch_size or getattr(settings, "TOKEN_PURGE_BATCH_SIZE", 1000)
+        time_budget = time_budget or getattr(settings, "TOKEN_PURGE_TIME_BUDGET", 20)
+        deadline = time.monotonic() + time_budget
+        now = timezone.now()
+        deleted = 0
+        while time.monotonic() < deadline:
+            keys = list(cls.objects.filter(expires_at__lte=now).values_list('key', flat=True)[:batch_size])
+            if not keys:
+                return deleted, True
+            count, _ = cls.objects.filter(key__in=keys).delete()
+            deleted += count
+        return deleted, False
+
     def save(self, *args, **kwargs):
         if not self.expires_at:
             expiration_hours = getattr(settings, "CUSTOM_EXPIRATION_HOURS", 24)
             self.expires_at = timezone.now() + datetime.timedelta(hours=expiration_hours)
         return super().save(*args, **kwargs)
+
+class RevokedToken(models.Model):
+    """
+    Deny-list entry for signed session tokens: one token by its `jti`, or
+    every token of `address` issued up to `revoked_at`. Kept until the
+    revoked tokens would have expired anyway.
+    """
+    jti = models.CharField(max_length=32, blank=True, default='')
+    address = models.CharField(max_length=42, blank=True, default='')
+    revoked_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.jti or self.address} until {self.expires_at}"
+
+    @classmethod
+    def purge_expired(cls) -> int:
+        count, _ = cls.objects.filter(expires_at__lte=timezone.now()).delete()
+        return count
+
+class UsedNonce(models.Model):
+    """A spent sign-message nonce, kept until the nonce would have expired anyway"""
+    nonce = models.CharField(max_length=100, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.nonce
+
+    @classmethod
+    def purge_expired(cls) -> int:
+        count, _ = cls.objects.filter(expires_at__lte=timezone.now()).delete()
+        return count
@@ -0,0 +1,56 @@
+import re
+import secrets
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+from .models import UsedNonce
+
+WALLET_RE = re.compile(r'^0x[0-9a-fA-F]{40}$')
+KEY_SALT = "systems.nonces.sign-message"
+MESSAGE_PREFIX = "Sign this message to authenticate: "
+
+class InvalidNonce(Exception):
+    pass
+
+def nonce_ttl() -> int:
+    return getattr(settings, "SIGN_NONCE_TTL", 300)
+
+def sign_message(nonce:str) -> str:
+    return f"{MESSAGE_PREFIX}{nonce}"
+
+def _mac(wallet:str, payload:str) -> str:
+    return salted_hmac(KEY_SALT, f"{wallet.lower()}.{payload}", algorithm="sha256").hexdigest()[:32]
+
+def issue_nonce(wallet:str) -> str:
+    """'<timestamp>.<random>.<mac>', bound to `wallet` without storing anything"""
+    payload = f"{int(time.time())}.{secrets.token_hex(8)}"
+    return f"{payload}.{_mac(wallet, payload)}"
+
+def check_nonce(wallet:str, nonce:str):
+    """Raises InvalidNonce unless `nonce` was issued for `wallet` and has not expired"""
+    try:
+        timestamp, random, mac = nonce.split(".")
+        issued = int(timestamp)
+    except ValueError:
+        raise InvalidNonce("Malformed nonce")
+    if not constant_time_compare(mac, _mac(wallet, f"{timestamp}.{random}")):
+        raise InvalidNonce("Nonce was not issued for this wallet")
+    age = time.time() - issued
+    # a little leeway for clock skew between workers
+    if age > nonce_ttl() or age < -30:
+        raise InvalidNonce("Nonce expired")
+
+def claim_nonce(nonce:str) -> bool:
+    """
+    Mark a nonce used, False if it already was. The unique row is seen by every
+    worker, and is purged by the cleanup cron once the nonce has expired.
+    """
+    try:
+        with transaction.atomic():
+            UsedNonce.objects.create(nonce=nonce, expires_at=timezone.now() + timedelta(seconds=nonce_ttl() + 30))
+    except IntegrityError:
+        return False
+    return True
@@ -0,0 +1,17 @@
+from rest_framework.pagination import CursorPagination
+
+class UpdateRequestCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (created_at, transaction_hash).
+    Only used when the client sends `cursor` or `page_size`, plain list calls
+    still get every row as the admin dashboard expects.
+    """
+    ordering = ('created_at', 'transaction_hash')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
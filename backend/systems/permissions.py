@@ -1,11 +1,20 @@
 from rest_framework.permissions import BasePermission
 from dotenv import load_dotenv
 import os
+import secrets
 load_dotenv()
 
 class HasCronSecretPermission(BasePermission):
+    """
+    Requests carrying CRON_KEY in X-Cron-Secret. Nothing passes while
+    CRON_KEY is unset, a missing header must not match a missing key.
+    """
     def has_permission(self, request, view):
-        return request.META.get("HTTP_X_CRON_SECRET") == os.getenv('CRON_KEY')
+        key = os.getenv('CRON_KEY')
+        sent = request.META.get("HTTP_X_CRON_SECRET")
+        if not key or not sent:
+            return False
+        return secrets.compare_digest(sent.encode(), key.encode())
 
 class IsSuperUser(BasePermission):
     """
@@ -0,0 +1,158 @@
+import itertools
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from eth_abi import decode, encode
+
+# 4 byte selectors of the read calls we aggregate
+TOKEN_URI_SELECTOR = bytes.fromhex("c87b56dd")  # tokenURI(uint256)
+OWNER_OF_SELECTOR = bytes.fromhex("6352211e")  # ownerOf(uint256)
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")  # aggregate3((address,bool,bytes)[])
+
+class RPCError(Exception):
+    def __init__(self, code, message):
+        super().__init__(f"RPC error {code}: {message}")
+        self.code = code
+        self.message = message
+
+# failures a long-running worker waits out and retries instead of exiting
+TRANSIENT_ERRORS = (RPCError, requests.RequestException)
+
+def retry_delay(failures:int, base:float) -> float:
+    """Seconds to wait after `failures` consecutive transient errors, doubling up to RPC_RETRY_MAX_BACKOFF"""
+    return min(base * 2 ** (failures - 1), getattr(settings, "RPC_RETRY_MAX_BACKOFF", 300))
+
+class RpcClient:
+    """
+    JSON-RPC client over a pooled keep-alive session.
+
+    `batch()` sends many calls in one HTTP request, `token_uris()` and
+    `owners_of()` read many tokens at once, through Multicall3 when
+    RPC_MULTICALL_ADDRESS is set and as batched eth_calls otherwise.
+    """
+    def __init__(self, url:str, timeout:float = None, batch_size:int = None, pool_size:int = 10):
+        self.url = url
+        self.timeout = timeout or getattr(settings, "RPC_TIMEOUT", 10)
+        self.batch_size = batch_size or getattr(settings, "RPC_BATCH_SIZE", 100)
+        self.multicall_address = getattr(settings, "RPC_MULTICALL_ADDRESS", None)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._ids = itertools.count(1)
+
+    def _request(self, method:str, params) -> dict:
+        return {"jsonrpc": "2.0", "id": next(self._ids), "method": method, "params": list(params)}
+
+    def _post(self, payload, timeout):
+        response = self.session.post(self.url, json=payload, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def call(self, method:str, *params, timeout:float = None):
+        data = self._post(self._request(method, params), timeout)
+        if data.get("error"):
+            raise RPCError(data["error"].get("code"), data["error"].get("message"))
+        return data["result"]
+
+    def batch(self, calls, timeout:float = None, batch_size:int = None) -> list:
+        """
+        Run [(method, params), ...] as JSON-RPC batches of `batch_size`.
+        Results come back in order, a failed call is returned as its RPCError.
+        """
+        batch_size = batch_size or self.batch_size
+        results = []
+        for i in range(0, len(calls), batch_size):
+            payload = [self._request(method, params) for method, params in calls[i:i + batch_size]]
+            replies = self._post(payload, timeout)
+            if isinstance(replies, dict):
+                # some nodes answer a rejected batch with a single error
+                error = replies.get("error") or {}
+                raise RPCError(error.get("code"), error.get("message"))
+            by_id = {reply.get("id"): reply for reply in replies}
+            for request in payload:
+                reply = by_id.get(request["id"], {"error": {"code": None, "message": "missing from batch reply"}})
+                if reply.get("error"):
+                    results.append(RPCError(reply["error"].get("code"), reply["error"].get("message")))
+                else:
+                    results.append(reply["result"])
+        return results
+
+    def eth_call(self, to:str, data:bytes, timeout:float = None) -> bytes:
+        result = self.call("eth_call", {"to": to, "data": "0x" + data.hex()}, "latest", timeout=timeout)
+        return bytes.fromhex(result[2:])
+
+    def read_many(self, contract:str, selector:bytes, output_type:str, token_ids,
+                  timeout:float = None, batch_size:int = None) -> dict:
+        """token_id -> decoded result of `selector(token_id)`, None where the call reverted"""
+        token_ids = list(token_ids)
+        calldata = [selector + encode(["uint256"], [token_id]) for token_id in token_ids]
+        if self.multicall_address:
+            returned = self._multicall(contract, calldata, timeout, batch_size)
+        else:
+            replies = self.batch(
+                [("eth_call", [{"to": contract, "data": "0x" + data.hex()}, "latest"]) for data in calldata],
+                timeout=timeout, batch_size=batch_size
+            )
+            returned = [None if isinstance(reply, RPCError) else bytes.fromhex(reply[2:]) for reply in replies]
+
+        results = {}
+        for token_id, data in zip(token_ids, returned):
+            try:
+                results[token_id] = decode([output_type], data)[0] if data else None
+            except Exception:
+                results[token_id] = None
+        return results
+
+    def _multicall(self, contract:str, calldata:list, timeout:float, batch_size:int) -> list:
+        batch_size = batch_size or self.batch_size
+        returned = []
+        for i in range(0, len(calldata), batch_size):
+            calls = [(contract, True, data) for data in calldata[i:i + batch_size]]
+            raw = self.eth_call(
+                self.multicall_address, AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"], [calls]), timeout
+            )
+            for success, data in decode(["(bool,bytes)[]"], raw)[0]:
+                returned.append(data if success else None)
+        return returned
+
+    def token_uris(self, contract:str, token_ids, **kwargs) -> dict:
+        return self.read_many(contract, TOKEN_URI_SELECTOR, "string", token_ids, **kwargs)
+
+    def owners_of(self, contract:str, token_ids, **kwargs) -> dict:
+        owners = self.read_many(contract, OWNER_OF_SELECTOR, "address", token_ids, **kwargs)
+        return {token_id: owner.lower() if owner else None for token_id, owner in owners.items()}
+
+    def token_uri(self, contract:str, token_id:int) -> str:
+        data = self.eth_call(contract, TOKEN_URI_SELECTOR + encode(["uint256"], [token_id]))
+        return decode(["string"], data)[0]
+
+    async def acall(self, method:str, *params, timeout:float = None):
+        """call() for async views, over the shared aiohttp session"""
+        from .aio import client_timeout, get_http_session
+        payload = self._request(method, params)
+        async with get_http_session().post(
+            self.url, json=payload, timeout=client_timeout(timeout or self.timeout)
+        ) as response:
+            response.raise_for_status()
+            data = await response.json(content_type=None)
+        if data.get("error"):
+            raise RPCError(data["error"].get("code"), data["error"].get("message"))
+        return data["result"]
+
+    async def atoken_uri(self, contract:str, token_id:int) -> str:
+        data = TOKEN_URI_SELECTOR + encode(["uint256"], [token_id])
+        result = await self.acall("eth_call", {"to": contract, "data": "0x" + data.hex()}, "latest")
+        return decode(["string"], bytes.fromhex(result[2:]))[0]
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(url:str = None) -> RpcClient:
+    """Process-wide client per endpoint, so connections are reused across requests"""
+    url = url or settings.ETH_PROVIDER_URL
+    with _clients_lock:
+        if url not in _clients:
+            _clients[url] = RpcClient(url)
+        return _clients[url]
@@ -1,4 +1,7 @@
+from django.core.files.uploadedfile import UploadedFile
+from django.utils import timezone
 from rest_framework import serializers
+from .images import process_image
 from .models import Update_Request, AppSettings
 
 class AppSettingsSerializer(serializers.ModelSerializer):
@@ -9,6 +12,8 @@ class AppSettingsSerializer(serializers.ModelSerializer):
 class SignatureVerifySerializer(serializers.Serializer):
     wallet_address = serializers.CharField(max_length=42)
     signature = serializers.CharField()
+    # from /sign-message/, older clients leave it out
+    nonce = serializers.CharField(max_length=100, required=False)
 
 class UpdateRequestSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
@@ -19,11 +24,84 @@ class UpdateRequestSerializer(serializers.ModelSerializer):
         fields = [
             'transaction_hash', 'address', 'update_id', 'burn_ids', 'created_at',
             'update_name', 'image', 'image_url', 'image_small', 'downloaded', 
-            'description',
+            'description', 'verification_status', 'verification_block',
+            'image_width', 'image_height', 'image_bytes',
         ]
+        read_only_fields = [
+            'verification_status', 'verification_block', 'image_width', 'image_height', 'image_bytes'
+        ]
+        # the model allows no image while an upload is staged, requests still need one
+        extra_kwargs = {'image': {'required': True, 'allow_null': False}}
+
+    def validate(self, attrs):
+        image = attrs.get('image')
+        if isinstance(image, UploadedFile):
+            processed = process_image(image)
+            attrs['image'] = processed.file
+            attrs['image_width'] = processed.width
+            attrs['image_height'] = processed.height
+            attrs['image_bytes'] = processed.size
+        return attrs
 
     def get_image_url(self, obj):
         return obj.get_image_original()
 
     def get_image_small(self, obj):
         return obj.get_image_small()
+
+class UpdateRequestRows:
+    """
+    Fast list path producing the same output as UpdateRequestSerializer
+    straight from .values() rows, without model instances or method fields.
+    Image urls come from the stored columns, only rows saved before they
+    existed build them on the fly.
+    """
+    # database columns each output field is read from
+    COLUMNS = {
+        'image_url': ('image', 'image_original_url'),
+        'image_small': ('image', 'image_small_url'),
+    }
+    # always selected so cursor pagination can read its position
+    ORDERING_COLUMNS = ('created_at', 'transaction_hash')
+
+    def __init__(self, fields=None):
+        self.fields = [
+            field for field in UpdateRequestSerializer.Meta.fields
+            if fields is None or field in fields
+        ]
+        self.image_field = Update_Request._meta.get_field('image')
+
+    def values(self, queryset):
+        columns = set(self.ORDERING_COLUMNS)
+        for field in self.fields:
+            columns.update(self.COLUMNS.get(field, (field,)))
+        return queryset.values(*columns)
+
+    def _image_urls(self, row):
+        image = row['image']
+        if not image:
+            return None, None
+        original, small = row.get('image_original_url'), row.get('image_small_url')
+        if not original or not small:
+            original, small = Update_Request.build_image_urls(image)
+        return original, small
+
+    def serialize(self, rows) -> list:
+        # resolve the timezone once instead of per row
+        datetime_field = serializers.DateTimeField(default_timezone=timezone.get_current_timezone())
+        data = []
+        for row in rows:
+            item = {}
+            for field in self.fields:
+                if field == 'image':
+                    item[field] = self.image_field.get_prep_value(row['image'])
+                elif field == 'image_url':
+                    item[field] = self._image_urls(row)[0]
+                elif field == 'image_small':
+                    item[field] = self._image_urls(row)[1]
+                elif field == 'created_at':
+                    item[field] = datetime_field.to_representation(row['created_at'])
+                else:
+                    item[field] = row[field]
+            data.append(item)
+        return data
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import AppSettings, ImageUrl, Update_Request
+from .cache import runtime_config, user_tokens_cache, bump_update_requests_stamp
+
+@receiver(post_save, sender=Update_Request)
+@receiver(post_delete, sender=Update_Request)
+def update_request_changed(sender, instance, **kwargs):
+    user_tokens_cache.invalidate_wallet(instance.address)
+    bump_update_requests_stamp()
+
+@receiver(post_save, sender=ImageUrl)
+@receiver(post_delete, sender=ImageUrl)
+def image_url_changed(sender, instance, **kwargs):
+    user_tokens_cache.invalidate_all()
+    runtime_config.bump()
+
+@receiver(post_save, sender=AppSettings)
+@receiver(post_delete, sender=AppSettings)
+def app_settings_changed(sender, instance, **kwargs):
+    runtime_config.bump()
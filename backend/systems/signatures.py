@@ -0,0 +1,102 @@
+import threading
+from django.conf import settings
+from eth_hash.auto import keccak
+
+# secp256k1 group order, r and s must be below it
+SECP256K1_N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+
+class InvalidSignature(ValueError):
+    pass
+
+def eip191_hash(text:str) -> bytes:
+    """Hash signed by personal_sign, same as eth_account's encode_defunct"""
+    data = text.encode()
+    return keccak(b"\x19Ethereum Signed Message:\n" + str(len(data)).encode() + data)
+
+def split_signature(signature:str):
+    """Returns (r, s, v) of a 65 byte hex signature, v as 0 or 1 like eth_account reads it"""
+    try:
+        raw = bytes.fromhex(signature[2:] if signature[:2].lower() == "0x" else signature)
+    except ValueError:
+        raise InvalidSignature("Signature is not hex")
+    if len(raw) != 65:
+        raise InvalidSignature("Signature must be 65 bytes")
+    r, s, v = int.from_bytes(raw[:32], "big"), int.from_bytes(raw[32:64], "big"), raw[64]
+    if v in (27, 28):
+        v -= 27
+    elif v >= 35:
+        # EIP-155 style v carries a chain id
+        v = (v - 35) % 2
+    elif v not in (0, 1):
+        raise InvalidSignature(f"v {v} is invalid, must be one of: 0, 1, 27, 28, 35+")
+    if not (0 < r < SECP256K1_N and 0 < s < SECP256K1_N):
+        raise InvalidSignature("r and s must be in the secp256k1 range")
+    return r, s, v
+
+def to_checksum_address(address:bytes) -> str:
+    hex_address = address.hex()
+    digest = keccak(hex_address.encode()).hex()
+    return "0x" + "".join(c.upper() if int(d, 16) >= 8 else c for c, d in zip(hex_address, digest))
+
+class EthAccountBackend:
+    """The reference path, pure Python unless eth_keys finds coincurve itself"""
+    name = "eth_account"
+
+    def __init__(self):
+        from eth_account import Account
+        from eth_account.messages import encode_defunct
+        self.account = Account
+        self.encode_defunct = encode_defunct
+
+    def recover(self, text:str, signature:str) -> str:
+        try:
+            return self.account.recover_message(self.encode_defunct(text=text), signature=signature)
+        except Exception as e:
+            raise InvalidSignature(str(e))
+
+class CoincurveBackend:
+    """libsecp256k1 through coincurve, only available when it is installed"""
+    name = "coincurve"
+
+    def __init__(self):
+        from coincurve import PublicKey
+        self.public_key = PublicKey
+
+    def recover(self, text:str, signature:str) -> str:
+        r, s, v = split_signature(signature)
+        try:
+            public_key = self.public_key.from_signature_and_message(
+                r.to_bytes(32, "big") + s.to_bytes(32, "big") + bytes([v]), eip191_hash(text), hasher=None
+            )
+        except Exception as e:
+            raise InvalidSignature(str(e))
+        return to_checksum_address(keccak(public_key.format(compressed=False)[1:])[-20:])
+
+BACKENDS = {backend.name: backend for backend in (CoincurveBackend, EthAccountBackend)}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_recovery_backend():
+    """
+    The SIGNATURE_RECOVERY_BACKEND backend, built once per process.
+    'auto' takes the first of BACKENDS whose dependencies import.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = getattr(settings, "SIGNATURE_RECOVERY_BACKEND", "auto")
+            if name != "auto":
+                _backend = BACKENDS[name]()
+            else:
+                for backend in BACKENDS.values():
+                    try:
+                        _backend = backend()
+                        break
+                    except ImportError:
+                        continue
+        return _backend
+
+def recover_address(text:str, signature:str) -> str:
+    """Checksummed address that personal_sign'ed `text`, raises InvalidSignature"""
+    return get_recovery_backend().recover(text, signature)
@@ -0,0 +1,31 @@
+import hashlib
+import os
+from io import BytesIO
+import cloudinary.uploader
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+class CloudinaryStorage:
+    """Uploads to the configured Cloudinary account"""
+    def upload(self, data:bytes, name:str) -> str:
+        """Store an image, returns the value kept in Update_Request.image"""
+        file = BytesIO(data)
+        file.name = name
+        resource = cloudinary.uploader.upload_resource(
+            file, type="upload", resource_type="image", timeout=getattr(settings, "IMAGE_UPLOAD_TIMEOUT", 60)
+        )
+        return resource.get_prep_value()
+
+class InMemoryStorage:
+    """Keeps uploads in a dict, for tests and local runs without Cloudinary"""
+    def __init__(self):
+        self.files = {}
+
+    def upload(self, data:bytes, name:str) -> str:
+        ext = os.path.splitext(name)[1].lstrip(".").lower() or "png"
+        value = f"image/upload/v1/staged/{hashlib.sha256(data).hexdigest()[:20]}.{ext}"
+        self.files[value] = data
+        return value
+
+def get_image_storage():
+    return import_string(getattr(settings, "IMAGE_STORAGE_BACKEND", "systems.storage.CloudinaryStorage"))()
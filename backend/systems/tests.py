@@ -1,3 +1,1485 @@
-from django.test import TestCase
+import datetime
+import importlib.util
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+import zlib
+import requests
+from io import BytesIO, StringIO
+from unittest import mock
+import cloudinary
+from asgiref.sync import sync_to_async
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.cache import cache
+from django.db import connection, connections
+from django.db.models import QuerySet
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image, PngImagePlugin
+from eth_abi import decode, encode
+from .models import EthUser, ExpiringToken, ImageUrl, IndexerCheckpoint, IndexerSnapshot, StagedImage, Update_Request, UsedNonce, Whatcraft
+from .indexer import TransferIndexer, TRANSFER_TOPIC
+from .rpc import RPCError, RpcClient, TOKEN_URI_SELECTOR
+from .ipfs import IPFSClient, IPFSError, acollection_image_base, collection_image_base, ipfs_path
+from .thumbnails import ThumbnailCache, source_version
+from .storage import InMemoryStorage
+from .uploads import ImageUploader
+from .signatures import BACKENDS, InvalidSignature
+from .verification import BurnVerifier, CREATE_PREMIUM_SELECTOR
+from .auth import SignedToken, deny_list, revoke_signed_tokens, token_cache
+from .cache import RuntimeConfig, runtime_config, user_tokens_cache
+from .serializers import UpdateRequestRows, UpdateRequestSerializer
+from .views import Gettokens
+from .aio import close_http_session
+from .exports import FetchStats, fetch_image, iter_zip, prefetch, write_instance
+from .nonces import claim_nonce
+from .benchmarks import SCENARIOS, BenchmarkSuite, compare
+from .instrumentation import MetricsRegistry, RequestMetrics, call_kind, measure, registry
+from .async_views import AsyncGettokens, AsyncUpdateImageUrlFromIPFS, AsyncUpdateRequestDownload
 
-# Create your tests here.
+# url building only needs a cloud name, nothing is uploaded in tests
+if not cloudinary.config().cloud_name:
+    cloudinary.config(cloud_name="test")
+
+class WhatcraftTestCase(TestCase):
+    """Creates the unmanaged Whatcraft table for the duration of the test class"""
+    @classmethod
+    def setUpClass(cls):
+        with connection.schema_editor() as schema_editor:
+            schema_editor.create_model(Whatcraft)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as schema_editor:
+            schema_editor.delete_model(Whatcraft)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        runtime_config.bump()
+
+    def add_tokens(self, owner, token_ids, block_number=1):
+        Whatcraft.objects.bulk_create([
+            Whatcraft(token_id=token_id, current_owner=owner, block_number=block_number, timestamp=0, transaction_hash="0x")
+            for token_id in token_ids
+        ])
+
+class WalletTestCase(WhatcraftTestCase):
+    owner = "0x00000000000000000000000000000000000000aa"
+
+    def setUp(self):
+        super().setUp()
+        self.user = EthUser.objects.create_user(self.owner)
+        self.token = ExpiringToken.objects.create(user=self.user, key="a" * 40)
+        ImageUrl.objects.create(id=1, url="https://ipfs.io/ipfs/cid/")
+
+    def request_tokens(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/user-tokens/", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["tokens"], len(queries)
+
+class TokensOwnedTests(WalletTestCase):
+    def test_updated_flag_matches_address_case_insensitively(self):
+        self.add_tokens(self.owner, [1, 2, 3])
+        Update_Request.objects.create(
+            transaction_hash="0x1", address=self.owner.upper().replace("0X", "0x"),
+            update_id=2, burn_ids=[1], update_name="two", image="sample"
+        )
+        tokens, _ = self.request_tokens()
+        self.assertEqual([token["updated"] for token in tokens], [False, True, False])
+        self.assertEqual(tokens[1]["name"], "WHAT (Updated) #2")
+
+    def test_ownership_lookup_is_one_query(self):
+        self.add_tokens(self.owner, range(300))
+        with self.assertNumQueries(1):
+            tokens = Gettokens().tokens_owned(self.owner, "")
+        self.assertEqual(len(tokens), 300)
+
+    def test_query_count_constant_as_tokens_grow(self):
+        self.add_tokens(self.owner, range(5))
+        runtime_config.image_url()
+        _, few = self.request_tokens()
+        self.add_tokens(self.owner, range(5, 500), block_number=2)
+        cache.delete(user_tokens_cache.HEAD_KEY)
+        token_cache.clear()
+        tokens, many = self.request_tokens()
+        self.assertEqual(len(tokens), 500)
+        self.assertEqual(few, many)
+
+class UserTokensCacheTests(WalletTestCase):
+    def test_repeat_request_is_served_from_cache(self):
+        self.add_tokens(self.owner, [1, 2])
+        first, _ = self.request_tokens()
+        second, queries = self.request_tokens()
+        self.assertEqual(first, second)
+        # the token lookup is cached too
+        self.assertEqual(queries, 0)
+
+    def test_update_request_invalidates_wallet(self):
+        self.add_tokens(self.owner, [1, 2])
+        self.request_tokens()
+        Update_Request.objects.create(
+            transaction_hash="0x2", address=self.owner, update_id=1, burn_ids=[2], update_name="one", image="sample"
+        )
+        tokens, _ = self.request_tokens()
+        self.assertTrue(tokens[0]["updated"])
+
+    def test_image_url_change_invalidates_all(self):
+        self.add_tokens(self.owner, [1])
+        self.request_tokens()
+        image_url = ImageUrl.objects.get(id=1)
+        image_url.url = "https://gateway/cid2/"
+        image_url.save()
+        tokens, _ = self.request_tokens()
+        self.assertEqual(tokens[0]["image"], "https://gateway/cid2/1.png")
+
+    def test_newer_block_rebuilds_entry(self):
+        self.add_tokens(self.owner, [1])
+        self.request_tokens()
+        self.add_tokens(self.owner, [2], block_number=5)
+        user_tokens_cache.advance_head(5)
+        tokens, _ = self.request_tokens()
+        self.assertEqual([token["id"] for token in tokens], [1, 2])
+
+class ConditionalGetTests(WalletTestCase):
+    def test_user_tokens_not_modified(self):
+        self.add_tokens(self.owner, [1])
+        auth = f"Token {self.token.key}"
+        response = self.client.get("/user-tokens/", HTTP_AUTHORIZATION=auth)
+        etag = response["ETag"]
+        response = self.client.get("/user-tokens/", HTTP_AUTHORIZATION=auth, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_update_requests_etag_changes_with_rows(self):
+        admin = EthUser.objects.create_user("0xadmin", password="not-used-1", is_staff=True)
+        auth = f"Token {ExpiringToken.objects.create(user=admin, key='b' * 40).key}"
+        url = "/update-requests/?downloaded=false"
+        etag = self.client.get(url, HTTP_AUTHORIZATION=auth)["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_AUTHORIZATION=auth, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Update_Request.objects.create(
+            transaction_hash="0x3", address=self.owner, update_id=1, burn_ids=[2], update_name="one", image="sample"
+        )
+        response = self.client.get(url, HTTP_AUTHORIZATION=auth, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+class TokenAuthenticationTests(WalletTestCase):
+    def test_token_lookup_is_cached(self):
+        auth = f"Token {self.token.key}"
+        with self.assertNumQueries(1):
+            self.client.get("/update-requests/", HTTP_AUTHORIZATION=auth)
+        with self.assertNumQueries(0):
+            self.client.get("/update-requests/", HTTP_AUTHORIZATION=auth)
+
+    def test_invalidated_token_is_rejected(self):
+        auth = f"Token {self.token.key}"
+        self.request_tokens()
+        ExpiringToken.objects.filter(user=self.user).delete()
+        token_cache.invalidate_user(self.user)
+        response = self.client.get("/user-tokens/", HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 403)
+
+    def test_expired_cached_token_is_rejected(self):
+        auth = f"Token {self.token.key}"
+        self.request_tokens()
+        token_cache.get(self.token.key).expires_at = timezone.now()
+        response = self.client.get("/user-tokens/", HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(ExpiringToken.objects.filter(key=self.token.key).exists())
+
+class RuntimeConfigTests(WalletTestCase):
+    def test_singletons_are_read_once(self):
+        self.add_tokens(self.owner, [1])
+        self.request_tokens()
+        user_tokens_cache.invalidate_all()
+        with CaptureQueriesContext(connection) as queries:
+            self.request_tokens()
+        self.assertNotIn("systems_imageurl", " ".join(query["sql"] for query in queries))
+
+    def test_bumps_through_a_shared_cache_arrive_within_the_ttl(self):
+        worker = RuntimeConfig()
+        self.assertEqual(worker.image_url(), "https://ipfs.io/ipfs/cid/")
+        self.assertEqual(worker.app_settings().amount_to_burn, 1000)
+        # both share this process' cache, a write on the other worker only bumps the stamp
+        ImageUrl.objects.filter(id=1).update(url="https://ipfs.io/ipfs/new/")
+        runtime_config.bump()
+        with override_settings(RUNTIME_CONFIG_TTL=60):
+            self.assertEqual(worker.image_url(), "https://ipfs.io/ipfs/cid/")
+        with override_settings(RUNTIME_CONFIG_TTL=0):
+            self.assertEqual(worker.image_url(), "https://ipfs.io/ipfs/new/")
+
+    def test_unseen_changes_arrive_within_the_max_age(self):
+        worker = RuntimeConfig()
+        self.assertEqual(worker.image_url(), "https://ipfs.io/ipfs/cid/")
+        # bumped in another process' locmem cache, or by the update_img_url command
+        ImageUrl.objects.filter(id=1).update(url="https://ipfs.io/ipfs/new/")
+        with override_settings(RUNTIME_CONFIG_TTL=0, RUNTIME_CONFIG_MAX_AGE=60):
+            self.assertEqual(worker.image_url(), "https://ipfs.io/ipfs/cid/")
+            later = time.monotonic() + 61
+            with mock.patch("systems.cache.time.monotonic", return_value=later):
+                self.assertEqual(worker.image_url(), "https://ipfs.io/ipfs/new/")
+
+    def test_loads_run_without_the_lock(self):
+        worker = RuntimeConfig()
+        self.assertFalse(worker._get("probe", worker._lock.locked))
+        # a load racing a bump is returned but not kept
+        self.assertEqual(worker._get("raced", lambda: worker.bump() or "stale"), "stale")
+        self.assertEqual(worker._get("raced", lambda: "fresh"), "fresh")
+
+    def test_update_image_url_replaces_the_url(self):
+        response = self.client.get(
+            "/update-image-url/", {"url": "https://ipfs.io/ipfs/other/"},
+            HTTP_AUTHORIZATION=f"Token {self.token.key}"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ImageUrl.objects.get(id=1).url, "https://ipfs.io/ipfs/other/")
+        self.assertEqual(runtime_config.image_url(), "https://ipfs.io/ipfs/other/")
+
+class SignedTokenTests(WalletTestCase):
+    def setUp(self):
+        super().setUp()
+        deny_list.invalidate()
+        self.key = SignedToken.issue(self.user).key
+
+    def get(self, key):
+        return self.client.get("/user-tokens/", HTTP_AUTHORIZATION=f"Token {key}")
+
+    def test_authenticates_without_token_lookup(self):
+        self.add_tokens(self.owner, [1])
+        self.get(self.key)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get(self.key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["tokens"]), 1)
+        tables = " ".join(query["sql"] for query in queries)
+        for table in ("expiringtoken", "authtoken", "revokedtoken", "ethuser"):
+            self.assertNotIn(table, tables.lower())
+
+    def test_rejects_tampered_and_expired_tokens(self):
+        _, signature = self.key[4:].split(".")
+        forged = SignedToken.issue(EthUser(address=self.owner, is_staff=True)).key[4:].split(".")[0]
+        self.assertEqual(self.get(f"st1.{forged}.{signature}").status_code, 403)
+        self.assertEqual(self.get("st1.garbage").status_code, 403)
+        with override_settings(CUSTOM_EXPIRATION_HOURS=0):
+            expired = SignedToken.issue(self.user).key
+        self.assertEqual(self.get(expired).status_code, 403)
+
+    def test_revocation(self):
+        self.add_tokens(self.owner, [1])
+        other = SignedToken.issue(self.user)
+        revoke_signed_tokens(token=other)
+        self.assertEqual(self.get(other.key).status_code, 403)
+        self.assertEqual(self.get(self.key).status_code, 200)
+        revoke_signed_tokens(address=self.owner)
+        self.assertEqual(self.get(self.key).status_code, 403)
+        # the stored token of the same wallet keeps working
+        self.assertEqual(self.get(self.token.key).status_code, 200)
+
+class PurgeExpiredTokensTests(TestCase):
+    def test_purge_deletes_in_batches(self):
+        user = EthUser.objects.create_user("0x00000000000000000000000000000000000000bb")
+        past = timezone.now() - datetime.timedelta(hours=1)
+        ExpiringToken.objects.bulk_create([
+            ExpiringToken(key=f"{i:040}", user=user, expires_at=past) for i in range(25)
+        ])
+        live = ExpiringToken.objects.create(key="c" * 40, user=user)
+        with self.assertNumQueries(7):
+            deleted, finished = ExpiringToken.purge_expired(batch_size=10)
+        self.assertEqual((deleted, finished), (25, True))
+        self.assertEqual(list(ExpiringToken.objects.values_list('key', flat=True)), [live.key])
+
+class UpdateRequestListTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        admin = EthUser.objects.create_user("0xadmin", password="not-used-1", is_staff=True)
+        self.auth = f"Token {ExpiringToken.objects.create(user=admin, key='d' * 40).key}"
+        for i in range(5):
+            Update_Request.objects.create(
+                transaction_hash=f"0x{i}", address="0xaa", update_id=i, burn_ids=[i], update_name="n", image="sample"
+            )
+
+    def test_cursor_pages_with_sparse_fields(self):
+        url = "/update-requests/?downloaded=false&page_size=2&fields=transaction_hash,update_id"
+        seen = []
+        while url:
+            page = self.client.get(url, HTTP_AUTHORIZATION=self.auth).json()
+            self.assertLessEqual(len(page["results"]), 2)
+            for row in page["results"]:
+                self.assertEqual(set(row), {"transaction_hash", "update_id"})
+                seen.append(row["transaction_hash"])
+            url = page["next"]
+        self.assertEqual(seen, [f"0x{i}" for i in range(5)])
+
+    def test_plain_list_is_unpaginated(self):
+        response = self.client.get("/update-requests/", HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(len(response.json()), 5)
+
+    def test_image_urls_follow_image_changes(self):
+        before = Update_Request.objects.get(pk="0x1")
+        self.assertIn("/sample", before.image_original_url)
+        response = self.client.patch(
+            "/update-requests/0x1/", {"image": "image/upload/v2/replaced.jpg"},
+            content_type="application/json", HTTP_AUTHORIZATION=self.auth
+        )
+        self.assertEqual(response.status_code, 200)
+        after = Update_Request.objects.get(pk="0x1")
+        self.assertEqual((after.image_original_url, after.image_small_url), Update_Request.build_image_urls(after.image))
+        self.assertIn("replaced.jpg", after.image_original_url)
+        self.assertEqual(response.json()["image_url"], after.image_original_url)
+
+        # a save that keeps the image leaves the urls alone
+        with self.assertNumQueries(1):
+            after.save()
+        after.image = None
+        after.save()
+        self.assertEqual(Update_Request.objects.filter(pk="0x1", image_original_url="", image_small_url="").count(), 1)
+
+    def test_writes_of_other_processes_change_the_etag(self):
+        url = "/update-requests/?downloaded=false"
+        etag = self.client.get(url, HTTP_AUTHORIZATION=self.auth)["ETag"]
+        StagedImage.stage(Update_Request.objects.get(pk="0x1"), SimpleUploadedFile("art.png", png(10, 10)))
+        # the uploader runs elsewhere, its stamp bump lands in another process' cache
+        with mock.patch("systems.uploads.bump_update_requests_stamp"):
+            self.assertEqual(ImageUploader(InMemoryStorage()).upload_batch()["uploaded"], 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("/staged/", {row["transaction_hash"]: row for row in response.json()}["0x1"]["image_url"])
+
+    def test_rows_match_serializer(self):
+        Update_Request.objects.create(
+            transaction_hash="0xlegacy", address="0xaa", update_id=9, burn_ids=[9], update_name="n",
+            image="image/upload/v2/legacy.jpg", description="old row"
+        )
+        Update_Request.objects.filter(pk="0xlegacy").update(image_original_url="", image_small_url="")
+        queryset = Update_Request.objects.order_by('created_at')
+        rows = UpdateRequestRows()
+        self.assertEqual(rows.serialize(rows.values(queryset)), UpdateRequestSerializer(queryset, many=True).data)
+
+class ExportTests(TestCase):
+    """Streamed zip exports of UpdateRequestViewSet, image fetches are stubbed"""
+    def setUp(self):
+        token_cache.clear()
+        admin = EthUser.objects.create_user("0xadmin", password="not-used-1", is_staff=True)
+        self.auth = f"Token {ExpiringToken.objects.create(user=admin, key='d' * 40).key}"
+        for i, ext in enumerate(["png", "svg", "png"]):
+            Update_Request.objects.create(
+                transaction_hash=f"0x{i}", address="0xaa", update_id=i, burn_ids=[i], update_name=f"n{i}",
+                image="sample", description="desc"
+            )
+            Update_Request.objects.filter(pk=f"0x{i}").update(image_original_url=f"https://img.test/{i}.{ext}")
+
+    def download(self, path):
+        with mock.patch("systems.exports.fetch_image", side_effect=lambda url: f"image {url}".encode()):
+            response = self.client.get(path, HTTP_AUTHORIZATION=self.auth)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            return zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+
+    def test_streamed_archive(self):
+        with self.download("/update-requests/download_all/") as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), [
+                "0x0/metadata.txt", "0x0/image.png", "0x1/metadata.txt", "0x1/image.svg",
+                "0x2/metadata.txt", "0x2/image.png",
+            ])
+            # already compressed images are stored, anything else deflated
+            self.assertEqual(archive.getinfo("0x0/image.png").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(archive.getinfo("0x1/image.svg").compress_type, zipfile.ZIP_DEFLATED)
+            self.assertEqual(archive.read("0x0/image.png"), b"image https://img.test/0.png")
+            metadata = archive.read("0x1/metadata.txt").decode()
+        created_at = Update_Request.objects.get(pk="0x1").created_at
+        self.assertEqual(metadata, (
+            "Transaction Hash: 0x1\nAddress: 0xaa\nUpdate ID: 1\nUpdate Name: n1\nBurn IDs: [1]\n"
+            f"Created At: {created_at:%Y-%m-%d %H:%M:%S}\nDownloaded: False\nDescription: desc\n"
+        ))
+        self.assertEqual(Update_Request.objects.filter(downloaded=True).count(), 3)
+
+    def stream(self, path):
+        response = self.client.get(path, HTTP_AUTHORIZATION=self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response, iter(response.streaming_content)
+
+    def test_download_new_claims_a_batch_with_skip_locked(self):
+        select_for_update = QuerySet.select_for_update
+        with mock.patch.object(QuerySet, "select_for_update", autospec=True, side_effect=select_for_update) as lock:
+            with self.download("/update-requests/download_new/?batch_size=2") as archive:
+                self.assertEqual(archive.namelist(), [
+                    "0x0/metadata.txt", "0x0/image.png", "0x1/metadata.txt", "0x1/image.svg",
+                ])
+        self.assertEqual(lock.call_args.kwargs, {"skip_locked": True})
+        self.assertEqual(
+            list(Update_Request.objects.filter(downloaded=True).values_list("pk", flat=True).order_by("pk")),
+            ["0x0", "0x1"]
+        )
+        # the next claim starts after the downloaded rows
+        with self.download("/update-requests/download_new/") as archive:
+            self.assertEqual(archive.namelist(), ["0x2/metadata.txt", "0x2/image.png"])
+        self.assertEqual(self.client.get(
+            "/update-requests/download_new/?batch_size=0", HTTP_AUTHORIZATION=self.auth
+        ).status_code, 400)
+
+    def test_rows_marked_only_once_the_archive_is_complete(self):
+        with mock.patch("systems.exports.fetch_image", return_value=b"img"):
+            response, chunks = self.stream("/update-requests/download_new/")
+            body = [next(chunks)]
+            self.assertFalse(Update_Request.objects.filter(downloaded=True).exists())
+            body.extend(chunks)
+        self.assertIsNone(zipfile.ZipFile(BytesIO(b"".join(body))).testzip())
+        self.assertEqual(Update_Request.objects.filter(downloaded=True).count(), 3)
+
+    def test_aborted_download_marks_nothing(self):
+        for path in ("/update-requests/download_new/", "/update-requests/download_all/"):
+            with mock.patch("systems.exports.fetch_image", return_value=b"img"):
+                response, chunks = self.stream(path)
+                next(chunks)
+                # the client went away
+                response.close()
+                with self.assertRaises(StopIteration):
+                    next(chunks)
+            self.assertFalse(Update_Request.objects.filter(downloaded=True).exists())
+
+class StubImageResponse:
+    def __init__(self, status_code=200, chunks=(b"img",), chunk_delay=0.0):
+        self.status_code = status_code
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}")
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            time.sleep(self.chunk_delay)
+            yield chunk
+
+class StubImageSession:
+    """Hands out `responses` in turn, each after `delay` seconds"""
+    def __init__(self, *responses, delay=0.0):
+        self.responses = list(responses)
+        self.delay = delay
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.responses.pop(0)
+
+@override_settings(UPDATE_REQUEST_EXPORT_FETCH_TIMEOUT=0.3, UPDATE_REQUEST_EXPORT_FETCH_BACKOFF=0.05)
+class FetchImageTests(TestCase):
+    def fetch(self, session):
+        with mock.patch("systems.exports.get_session", return_value=session):
+            started = time.monotonic()
+            try:
+                return fetch_image("https://img.test/1.png")
+            finally:
+                self.elapsed = time.monotonic() - started
+
+    def test_retries_within_the_deadline(self):
+        session = StubImageSession(StubImageResponse(503), StubImageResponse(chunks=(b"a", b"b")))
+        self.assertEqual(self.fetch(session), b"ab")
+        self.assertEqual(session.calls, 2)
+
+    @override_settings(UPDATE_REQUEST_EXPORT_FETCH_BACKOFF=0.2)
+    def test_retries_stop_at_the_deadline(self):
+        # every attempt takes 0.2s, the backoff after the first would end past the deadline
+        session = StubImageSession(*[StubImageResponse(503)] * 4, delay=0.2)
+        with self.assertRaises(TimeoutError):
+            self.fetch(session)
+        self.assertEqual(session.calls, 1)
+        self.assertLess(self.elapsed, 0.3)
+
+    def test_slow_body_hits_the_deadline(self):
+        session = StubImageSession(StubImageResponse(chunks=[b"x"] * 20, chunk_delay=0.05))
+        with self.assertRaises(TimeoutError):
+            self.fetch(session)
+        self.assertLess(self.elapsed, 0.5)
+
+class PrefetchTests(TestCase):
+    class Instance:
+        def __init__(self, url):
+            self.url = url
+
+        def get_image_original(self):
+            if self.url == "unresolvable":
+                raise ValueError("no public id")
+            return self.url
+
+    def test_order_kept_while_fetching_concurrently(self):
+        running, peak, lock = [0], [0], threading.Lock()
+
+        def fetch(url):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            # earlier images finish last
+            time.sleep(0.05 * (10 - int(url)) / 10)
+            with lock:
+                running[0] -= 1
+            return url.encode()
+
+        instances = [self.Instance(str(i)) for i in range(10)]
+        stats = FetchStats()
+        with mock.patch("systems.exports.fetch_image", side_effect=fetch):
+            results = list(prefetch(instances, stats, workers=4))
+        self.assertEqual([instance for instance, _ in results], instances)
+        self.assertEqual([content for _, (_, content, _) in results], [str(i).encode() for i in range(10)])
+        self.assertGreater(peak[0], 1)
+        self.assertLessEqual(peak[0], 4)
+        self.assertEqual(stats.snapshot(), {"fetched": 10, "failed": 0, "bytes": 10})
+
+    @override_settings(UPDATE_REQUEST_EXPORT_FETCH_TIMEOUT=0.2, UPDATE_REQUEST_EXPORT_FETCH_RETRIES=0)
+    def test_failures_become_placeholders(self):
+        responses = {
+            "https://img.test/slow.png": StubImageResponse(chunks=[b"x"] * 20, chunk_delay=0.05),
+            "https://img.test/ok.png": StubImageResponse(chunks=(b"fine",)),
+            "https://img.test/missing.png": StubImageResponse(404),
+        }
+        session = mock.Mock()
+        session.get.side_effect = lambda url, **kwargs: responses[url]
+        urls = ["https://img.test/slow.png", "unresolvable", "https://img.test/ok.png", "https://img.test/missing.png", None]
+        stats = FetchStats()
+        with mock.patch("systems.exports.get_session", return_value=session):
+            results = [fetched for _, fetched in prefetch([self.Instance(url) for url in urls], stats, workers=2)]
+        self.assertIsInstance(results[0][2], TimeoutError)
+        self.assertIsInstance(results[1][2], ValueError)
+        self.assertEqual(results[2], ("https://img.test/ok.png", b"fine", None))
+        self.assertIsInstance(results[3][2], requests.HTTPError)
+        self.assertEqual(results[4], (None, None, None))
+        self.assertEqual(stats.snapshot(), {"fetched": 1, "failed": 3, "bytes": 4})
+
+        archive = BytesIO()
+        with zipfile.ZipFile(archive, "w") as zip_file:
+            write_instance(zip_file, Update_Request(transaction_hash="0xslow", created_at=timezone.now()), results[0])
+        with zipfile.ZipFile(archive) as zip_file:
+            self.assertIn("took longer than", zip_file.read("0xslow/error.txt").decode())
+            self.assertEqual(zip_file.namelist(), ["0xslow/metadata.txt", "0xslow/error.txt"])
+
+class StubRpcHandler(BaseHTTPRequestHandler):
+    """JSON-RPC stand-in for an EVM node, serving the chain held by the server"""
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        requests = body if isinstance(body, list) else [body]
+        self.server.requests += 1
+        replies = [self.server.reply(request) for request in requests]
+        payload = json.dumps(replies if isinstance(body, list) else replies[0]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+class StubRpcServer(ThreadingHTTPServer):
+    def __init__(self, head, max_range=None):
+        super().__init__(("127.0.0.1", 0), StubRpcHandler)
+        self.head = head
+        self.max_range = max_range
+        self.logs = []
+        self.forks = {}  # block number -> suffix making its hash differ
+        self.calls = []
+        self.requests = 0
+        self.multicall = None
+        self.transactions = {}
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def transfer(self, block, to, token_id, log_index=0):
+        self.logs.append({
+            "blockNumber": hex(block), "logIndex": hex(log_index), "transactionHash": f"0x{block:064x}",
+            "topics": [TRANSFER_TOPIC, "0x" + "0" * 64, "0x" + to[2:].rjust(64, "0"), "0x" + format(token_id, "064x")],
+        })
+
+    def reply(self, request):
+        method, params = request["method"], request["params"]
+        self.calls.append(method)
+        result = None
+        if method == "eth_blockNumber":
+            result = hex(self.head)
+        elif method == "eth_getBlockByNumber":
+            number = int(params[0], 16)
+            result = {"hash": f"0x{number:x}{self.forks.get(number, '')}", "timestamp": hex(1700000000 + number)}
+        elif method == "eth_getTransactionReceipt":
+            result = self.transactions.get(params[0], (None, None))[0]
+        elif method == "eth_getTransactionByHash":
+            result = self.transactions.get(params[0], (None, None))[1]
+        elif method == "eth_call":
+            result = "0x" + self.eth_call(params[0]["to"], bytes.fromhex(params[0]["data"][2:])).hex()
+        elif method == "eth_getLogs":
+            start, end = int(params[0]["fromBlock"], 16), int(params[0]["toBlock"], 16)
+            if self.max_range and end - start + 1 > self.max_range:
+                return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32005, "message": "range too large"}}
+            tokens = params[0]["topics"][3] if len(params[0]["topics"]) > 3 else None
+            result = [
+                log for log in self.logs
+                if start <= int(log["blockNumber"], 16) <= end and (tokens is None or log["topics"][3] in tokens)
+            ]
+        return {"jsonrpc": "2.0", "id": request["id"], "result": result}
+
+    def eth_call(self, to, data):
+        if to == self.multicall:
+            calls = decode(["(address,bool,bytes)[]"], data[4:])[0]
+            return encode(["(bool,bytes)[]"], [[self.contract_call(call) for _, _, call in calls]])
+        return self.contract_call(data)[1]
+
+    def contract_call(self, data):
+        """tokenURI/ownerOf for token ids below 100, reverts above"""
+        selector, token_id = data[:4], decode(["uint256"], data[4:])[0]
+        if token_id >= 100:
+            return False, b""
+        if selector == TOKEN_URI_SELECTOR:
+            return True, encode(["string"], [f"ipfs://cid/{token_id}.json"])
+        return True, encode(["address"], ["0x" + format(token_id, "040x")])
+
+class RpcClientTests(TestCase):
+    def setUp(self):
+        self.node = StubRpcServer(head=1)
+        self.node.multicall = "0x" + "c" * 40
+        self.addCleanup(self.node.shutdown)
+        self.addCleanup(self.node.server_close)
+
+    def test_batched_token_uris(self):
+        client = RpcClient(self.node.url, batch_size=4)
+        uris = client.token_uris("0xcontract", [1, 2, 3, 150, 5])
+        self.assertEqual(uris[2], "ipfs://cid/2.json")
+        self.assertIsNone(uris[150])
+        # five eth_calls in two HTTP round trips
+        self.assertEqual(self.node.calls.count("eth_call"), 5)
+        self.assertEqual(self.node.requests, 2)
+
+    @override_settings(RPC_MULTICALL_ADDRESS="0x" + "c" * 40)
+    def test_multicall_owners(self):
+        client = RpcClient(self.node.url, batch_size=50)
+        owners = client.owners_of("0x" + "d" * 40, range(1, 121))
+        self.assertEqual(owners[7], "0x" + format(7, "040x"))
+        self.assertIsNone(owners[120])
+        self.assertEqual(self.node.calls.count("eth_call"), 3)
+
+class Stop(Exception):
+    """Ends a polling management command from inside a test"""
+
+class BurnVerifierCommandTests(TestCase):
+    def run_command(self, passes, *args):
+        self.sleeps = []
+        with mock.patch("systems.management.commands.verify_burns.BurnVerifier.verify_batch", side_effect=passes), \
+                mock.patch("systems.management.commands.verify_burns.time.sleep", side_effect=self.sleeps.append), \
+                override_settings(VERIFY_BATCH_SIZE=2, VERIFY_POLL_INTERVAL=5, RPC_RETRY_MAX_BACKOFF=8):
+            call_command("verify_burns", *args, stdout=StringIO(), stderr=StringIO())
+
+    def test_full_batches_of_pending_rows_wait_between_passes(self):
+        full, settled = {"verified": 0, "rejected": 0, "pending": 2}, {"verified": 1, "rejected": 1, "pending": 0}
+        with self.assertRaises(Stop):
+            self.run_command([full, settled, full, Stop()])
+        # a pass that settled rows goes straight on, one that only found pending rows waits
+        self.assertEqual(self.sleeps, [5, 5])
+
+    def test_transient_rpc_errors_back_off(self):
+        errors = [requests.ConnectionError("reset"), RPCError(-32000, "busy"), requests.HTTPError("502"), requests.Timeout()]
+        self.run_command(errors + [{"verified": 1, "rejected": 0, "pending": 0}], "--once")
+        self.assertEqual(self.sleeps, [5, 8, 8, 8])
+        # a --once run gives up after RPC_RETRY_ATTEMPTS failures in a row
+        with self.assertRaises(RPCError):
+            self.run_command([RPCError(-32000, "busy")] * 5, "--once")
+
+class TransferIndexerTests(WhatcraftTestCase):
+    alice = "0x" + "a1" * 20
+    bob = "0x" + "b0" * 20
+
+    def setUp(self):
+        super().setUp()
+        self.node = StubRpcServer(head=105, max_range=40)
+        self.addCleanup(self.node.shutdown)
+        self.addCleanup(self.node.server_close)
+        self.indexer = TransferIndexer(
+            RpcClient(self.node.url), "0xcontract", start_block=1, confirmations=5, chunk_size=64
+        )
+
+    def owners(self):
+        return dict(Whatcraft.objects.values_list("token_id", "current_owner"))
+
+    def test_indexes_to_confirmed_head(self):
+        self.node.transfer(10, self.alice, 1)
+        self.node.transfer(20, self.alice, 2)
+        self.node.transfer(30, self.bob, 1, log_index=1)
+        self.node.transfer(103, self.bob, 2)  # not confirmed yet
+        checkpoint = self.indexer.run_once()
+
+        self.assertEqual(checkpoint.block_number, 100)
+        self.assertEqual(self.owners(), {1: self.bob, 2: self.alice})
+        # the node rejected 64 block ranges so the indexer shrank its chunks
+        self.assertLessEqual(self.indexer.chunk_size, 40)
+        self.assertEqual(self.indexer.stats.blocks, 100)
+
+        self.node.head = 110
+        self.indexer.run_once()
+        self.assertEqual(self.owners(), {1: self.bob, 2: self.bob})
+        self.assertEqual(IndexerCheckpoint.objects.get(name="whatcraft").block_number, 105)
+
+    def test_reorg_is_rewound(self, legacy=False):
+        self.node.transfer(10, self.alice, 1)
+        self.node.transfer(95, self.bob, 1)
+        self.node.transfer(96, self.bob, 3)
+        self.indexer.run_once()
+        self.assertEqual(self.owners(), {1: self.bob, 3: self.bob})
+        if legacy:
+            IndexerCheckpoint.objects.filter(name="whatcraft").update(snapshots_since=None)
+
+        # blocks after 80 are replaced, the transfers in them never happened
+        self.node.logs = [log for log in self.node.logs if int(log["blockNumber"], 16) < 80]
+        self.node.forks = {number: "f" for number in range(80, 120)}
+        self.node.head = 110
+        with self.assertLogs("systems.indexer", "WARNING"):
+            self.indexer.run_once()
+        self.assertEqual(self.owners(), {1: self.alice})
+        self.assertEqual(IndexerCheckpoint.objects.get(name="whatcraft").block_number, 105)
+
+    def test_reorg_of_a_checkpoint_without_snapshots_rescans(self):
+        self.test_reorg_is_rewound(legacy=True)
+
+    def test_shallow_reorg_reads_no_old_logs(self):
+        self.node.transfer(10, self.alice, 1)
+        self.node.transfer(99, self.bob, 1)
+        self.node.transfer(98, self.bob, 5)
+        self.indexer.run_once()
+        self.assertEqual(self.owners(), {1: self.bob, 5: self.bob})
+        tracked = IndexerCheckpoint.objects.get(name="whatcraft").recent_blocks
+        fork_point = tracked[-2][0]
+        self.assertLess(fork_point, 98)
+        self.assertEqual(IndexerSnapshot.objects.filter(block_number=tracked[-1][0]).count(), 2)
+
+        # only the newest chunk is orphaned
+        self.node.logs = [log for log in self.node.logs if int(log["blockNumber"], 16) <= fork_point]
+        self.node.forks = {number: "f" for number in range(fork_point + 1, 120)}
+        with mock.patch.object(self.indexer, "get_logs", wraps=self.indexer.get_logs) as get_logs, \
+                self.assertLogs("systems.indexer", "WARNING"):
+            self.indexer.run_once()
+        self.assertEqual(self.owners(), {1: self.alice})
+        self.assertTrue(get_logs.call_args_list)
+        self.assertTrue(all(call.args[0] > fork_point for call in get_logs.call_args_list))
+        # the orphaned chunk's snapshots went with it, the re-indexed blocks changed nothing
+        self.assertFalse(IndexerSnapshot.objects.filter(block_number__gt=fork_point).exists())
+
+    def test_command_retries_transient_failures(self):
+        self.node.transfer(10, self.alice, 1)
+        run_once, errors = TransferIndexer.run_once, [requests.ConnectionError("reset"), requests.HTTPError("503")]
+
+        def flaky(indexer, **kwargs):
+            if errors:
+                raise errors.pop(0)
+            return run_once(indexer, **kwargs)
+
+        with mock.patch.object(TransferIndexer, "run_once", autospec=True, side_effect=flaky), \
+                mock.patch("systems.management.commands.index_transfers.time.sleep") as sleep, \
+                override_settings(INDEXER_POLL_INTERVAL=2):
+            call_command(
+                "index_transfers", "--once", "--rpc-url", self.node.url, "--contract", "0xcontract",
+                "--from-block", "1", stdout=StringIO(), stderr=StringIO()
+            )
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [2, 4])
+        self.assertEqual(self.owners(), {1: self.alice})
+
+class BurnVerifierTests(TestCase):
+    manager = "0x" + "e" * 40
+    collection = "0x" + "f" * 40
+    owner = "0x" + "a1" * 20
+
+    def setUp(self):
+        self.node = StubRpcServer(head=100)
+        self.addCleanup(self.node.shutdown)
+        self.addCleanup(self.node.server_close)
+        self.verifier = BurnVerifier(RpcClient(self.node.url), self.manager, self.collection, confirmations=5)
+
+    def burn(self, tx_hash, token_ids, update_id, block=50):
+        logs = [{
+            "address": self.collection,
+            "topics": [TRANSFER_TOPIC, "0x" + self.owner[2:].rjust(64, "0"), "0x" + "0" * 64, "0x" + format(token_id, "064x")],
+        } for token_id in token_ids]
+        tx_input = "0x" + (CREATE_PREMIUM_SELECTOR + encode(["uint32[]", "uint32"], [token_ids, update_id])).hex()
+        self.node.transactions[tx_hash] = (
+            {"blockNumber": hex(block), "status": "0x1", "logs": logs},
+            {"from": self.owner, "to": self.manager, "input": tx_input},
+        )
+
+    def request(self, tx_hash, burn_ids, update_id):
+        return Update_Request.objects.create(
+            transaction_hash=tx_hash, address=self.owner, update_id=update_id, burn_ids=burn_ids,
+            update_name="n", image="sample"
+        )
+
+    def test_verify_batch(self):
+        self.burn("0x1", [4, 5], 7)
+        self.burn("0x2", [6], 8)
+        self.burn("0x3", [9], 9, block=99)
+        self.request("0x1", [5, 4], 7)
+        self.request("0x2", [6], 1)
+        self.request("0x3", [9], 9)
+        self.request("0x4", [1], 1)
+
+        counts = self.verifier.verify_batch()
+        self.assertEqual(counts, {"verified": 1, "rejected": 1, "pending": 2})
+        self.assertEqual(self.node.requests, 1)
+        rows = {row.pk: row for row in Update_Request.objects.all()}
+        self.assertEqual((rows["0x1"].verification_status, rows["0x1"].verification_block), ("verified", 50))
+        self.assertEqual(rows["0x2"].verification_error, "update_id does not match the transaction")
+        self.assertEqual(rows["0x3"].verification_error, "Waiting for confirmations")
+        self.assertEqual(rows["0x4"].verification_error, "Transaction not found")
+        # re-checking a row that stays pending the same way leaves the list etag alone
+        self.verifier.verify_batch()
+        self.assertEqual(Update_Request.objects.get(pk="0x4").updated_at, rows["0x4"].updated_at)
+
+    def test_verification_changes_the_list_etag(self):
+        token_cache.clear()
+        self.burn("0x1", [4], 7)
+        self.request("0x1", [4], 7)
+        admin = EthUser.objects.create_user("0xadmin", password="not-used-1", is_staff=True)
+        auth = f"Token {ExpiringToken.objects.create(user=admin, key='d' * 40).key}"
+        url = "/update-requests/?downloaded=false"
+        etag = self.client.get(url, HTTP_AUTHORIZATION=auth)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.verifier.verify_batch()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]["verification_status"], "verified")
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        time.sleep(self.server.delay)
+        body = self.server.files.get(self.path[len("/ipfs/"):])
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # a hedged request that lost the race
+            pass
+
+    def log_message(self, *args):
+        pass
+
+class StubGateway(ThreadingHTTPServer):
+    """IPFS gateway stand-in answering after `delay` seconds"""
+    def __init__(self, files, delay=0.0):
+        super().__init__(("127.0.0.1", 0), StubGatewayHandler)
+        self.files = files
+        self.delay = delay
+        self.requests = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/ipfs/"
+
+class IPFSClientTests(TestCase):
+    files = {"cid/1.json": json.dumps({"image": "ipfs://imgcid/1.png"}).encode()}
+
+    def gateway(self, files, delay=0.0):
+        gateway = StubGateway(files, delay)
+        self.addCleanup(gateway.shutdown)
+        self.addCleanup(gateway.server_close)
+        return gateway
+
+    def ipfs_client(self, gateways, **kwargs):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        return IPFSClient([gateway.url for gateway in gateways], cache_dir=cache_dir.name, **kwargs)
+
+    def test_ipfs_path(self):
+        self.assertEqual(ipfs_path("ipfs://cid/1.json"), "cid/1.json")
+        self.assertEqual(ipfs_path("https://ipfs.io/ipfs/cid/1.json"), "cid/1.json")
+        self.assertIsNone(ipfs_path("https://example.com/1.json"))
+
+    def test_hedged_fetch_prefers_fastest(self):
+        slow = self.gateway(self.files, delay=1.0)
+        fast = self.gateway(self.files)
+        client = self.ipfs_client([slow, fast], hedge_delay=0.05)
+
+        started = time.monotonic()
+        self.assertEqual(collection_image_base("ipfs://cid/1.json", client), "ipfs://imgcid/")
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(client.ranked_gateways()[0], fast.url)
+
+    async def test_async_hedged_fetch_prefers_fastest(self):
+        slow = self.gateway(self.files, delay=1.0)
+        fast = self.gateway(self.files)
+        client = self.ipfs_client([slow, fast], hedge_delay=0.05)
+
+        started = time.monotonic()
+        try:
+            self.assertEqual(await acollection_image_base("ipfs://cid/1.json", client), "ipfs://imgcid/")
+        finally:
+            await close_http_session()
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(client.ranked_gateways()[0], fast.url)
+
+    def test_content_is_cached_on_disk(self):
+        gateway = self.gateway(self.files)
+        client = self.ipfs_client([gateway])
+        client.fetch("ipfs://cid/1.json")
+        again = IPFSClient([gateway.url], cache_dir=client.cache_dir)
+        self.assertEqual(again.fetch_json("https://ipfs.io/ipfs/cid/1.json")["image"], "ipfs://imgcid/1.png")
+        self.assertEqual(len(gateway.requests), 1)
+
+    def test_failing_gateway_falls_through(self):
+        broken = self.gateway({})
+        working = self.gateway(self.files)
+        client = self.ipfs_client([broken, working], hedge_delay=5)
+        self.assertEqual(client.fetch_json("ipfs://cid/1.json")["image"], "ipfs://imgcid/1.png")
+        with self.assertRaises(IPFSError):
+            client.fetch("ipfs://cid/missing.json")
+
+def png(width, height):
+    out = BytesIO()
+    Image.new("RGB", (width, height), (200, 10, 10)).save(out, "PNG")
+    return out.getvalue()
+
+@override_settings(THUMBNAIL_SIZES=(64, 128))
+class ThumbnailTests(WalletTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fetched = []
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.thumbnails = ThumbnailCache(cache_dir.name, fetch=lambda url: self.fetched.append(url) or png(400, 200))
+        patcher = mock.patch("systems.views.get_thumbnail_cache", return_value=self.thumbnails)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.add_tokens(self.owner, [1])
+        self.version = source_version("https://ipfs.io/ipfs/cid/")
+
+    def test_variants_rendered_from_one_fetch(self):
+        response = self.client.get(f"/thumbnails/{self.version}/128/1.webp")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/webp")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (128, 64))
+
+        response = self.client.get(f"/thumbnails/{self.version}/64/1.png")
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (64, 32))
+        self.assertEqual(self.fetched, ["https://ipfs.io/ipfs/cid/1.png"])
+
+    def test_rejects_unknown_sizes_tokens_and_versions(self):
+        self.assertEqual(self.client.get(f"/thumbnails/{self.version}/300/1.webp").status_code, 404)
+        self.assertEqual(self.client.get(f"/thumbnails/{self.version}/64/2.webp").status_code, 404)
+        response = self.client.get(f"/thumbnails/{'0' * 12}/64/1.webp")
+        self.assertRedirects(response, f"/thumbnails/{self.version}/64/1.webp", fetch_redirect_response=False)
+
+    def test_lru_eviction(self):
+        self.thumbnails.warm("https://ipfs.io/ipfs/cid/", 1)
+        per_token = self.thumbnails.disk_usage()
+        self.thumbnails.max_bytes = int(per_token * 1.5)
+        self.thumbnails.warm("https://ipfs.io/ipfs/cid/", 2)
+        self.assertFalse(self.thumbnails.has("https://ipfs.io/ipfs/cid/", 1))
+        self.assertTrue(self.thumbnails.has("https://ipfs.io/ipfs/cid/", 2))
+        self.assertLessEqual(self.thumbnails.disk_usage(), self.thumbnails.max_bytes)
+
+    def test_user_tokens_thumbnail_urls(self):
+        response = self.client.get("/user-tokens/?thumbnail=64&thumbnail_format=png", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(
+            response.json()["tokens"][0]["image"], f"http://testserver/thumbnails/{self.version}/64/1.png"
+        )
+        tokens, _ = self.request_tokens()
+        self.assertEqual(tokens[0]["image"], "https://ipfs.io/ipfs/cid/1.png")
+        response = self.client.get("/user-tokens/?thumbnail=65", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertEqual(response.status_code, 400)
+
+class FlakyStorage(InMemoryStorage):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def upload(self, data, name):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("upload timed out")
+        return super().upload(data, name)
+
+class AsyncViewTests(WalletTestCase):
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+
+    async def call(self, view, path, data=None, key=None, **kwargs):
+        request = self.factory.get(path, data, authorization=f"Token {key or self.token.key}")
+        try:
+            return await view.as_view(**kwargs.pop("initkwargs", {}))(request, **kwargs)
+        finally:
+            await close_http_session()
+
+    async def test_tokens_match_the_sync_view(self):
+        await Whatcraft.objects.acreate(token_id=7, current_owner=self.owner, block_number=1, timestamp=0, transaction_hash="0x")
+        response = await self.call(AsyncGettokens, "/user-tokens/")
+        self.assertEqual(response.status_code, 200)
+        expected = await sync_to_async(Gettokens().tokens_owned)(self.owner, "https://ipfs.io/ipfs/cid/")
+        self.assertEqual(json.loads(response.content)["tokens"], expected)
+
+        request = self.factory.get("/user-tokens/", authorization=f"Token {self.token.key}", if_none_match=response["ETag"])
+        self.assertEqual((await AsyncGettokens.as_view()(request)).status_code, 304)
+        self.assertEqual((await self.call(AsyncGettokens, "/user-tokens/", key="b" * 40)).status_code, 403)
+        self.assertEqual((await self.call(AsyncGettokens, "/user-tokens/", {"thumbnail": "7"})).status_code, 400)
+
+    async def test_update_image_url_from_ipfs(self):
+        gateway = StubGateway({"cid/1.json": json.dumps({"image": "ipfs://imgcid/1.png"}).encode()})
+        self.addCleanup(gateway.shutdown)
+        self.addCleanup(gateway.server_close)
+        with override_settings(IPFS_GATEWAYS=[gateway.url], IPFS_CACHE_DIR=tempfile.mkdtemp()), \
+                mock.patch("systems.ipfs._client", None):
+            response = await self.call(AsyncUpdateImageUrlFromIPFS, "/update-from-ipfs/", {"url": "ipfs://cid/1.json"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await ImageUrl.objects.aget(id=1)).url, "ipfs://imgcid/")
+
+    async def test_download_all(self):
+        gateway = StubGateway({"a.png": b"png-a"})
+        self.addCleanup(gateway.shutdown)
+        self.addCleanup(gateway.server_close)
+        for i, url in enumerate([f"{gateway.url}a.png", f"{gateway.url}missing.png"]):
+            await Update_Request.objects.acreate(
+                transaction_hash=f"0x{i}", address=self.owner, update_id=i, burn_ids=[1],
+                update_name="x", image="sample"
+            )
+            await Update_Request.objects.filter(pk=f"0x{i}").aupdate(image_original_url=url)
+        self.assertEqual((await self.call(AsyncUpdateRequestDownload, "/update-requests/download_all/")).status_code, 403)
+        self.user.is_staff = True
+        await sync_to_async(self.user.save)()
+        token_cache.clear()
+
+        response = await self.call(AsyncUpdateRequestDownload, "/update-requests/download_all/", initkwargs={"scope": "all"})
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archive:
+            self.assertEqual(archive.read("0x0/image.png"), b"png-a")
+            self.assertIn("0x1/error.txt", archive.namelist())
+        self.assertEqual(await Update_Request.objects.filter(downloaded=True).acount(), 2)
+
+    async def test_download_new_claims_off_the_event_loop(self):
+        for i in range(3):
+            await Update_Request.objects.acreate(
+                transaction_hash=f"0x{i}", address=self.owner, update_id=i, burn_ids=[1],
+                update_name="x", image="sample"
+            )
+            await Update_Request.objects.filter(pk=f"0x{i}").aupdate(image_original_url=f"https://img.test/{i}.png")
+        await Update_Request.objects.filter(pk="0x0").aupdate(downloaded=True)
+        self.user.is_staff = True
+        await sync_to_async(self.user.save)()
+        token_cache.clear()
+
+        path, initkwargs = "/update-requests/download_new/", {"scope": "new"}
+        response = await self.call(AsyncUpdateRequestDownload, path, {"batch_size": "0"}, initkwargs=initkwargs)
+        self.assertEqual(response.status_code, 400)
+        # any query left to the response iterator would raise SynchronousOnlyOperation here
+        with mock.patch("systems.exports.fetch_image", return_value=b"img"):
+            response = await self.call(AsyncUpdateRequestDownload, path, {"batch_size": "1"}, initkwargs=initkwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await Update_Request.objects.filter(downloaded=True).acount(), 2)
+        with zipfile.ZipFile(BytesIO(b"".join(response.streaming_content))) as archive:
+            self.assertEqual(archive.namelist(), ["0x1/metadata.txt", "0x1/image.png"])
+
+@override_settings(IMAGE_UPLOAD_DEFERRED=True)
+class DeferredUploadTests(WalletTestCase):
+    def create(self, image=None):
+        return self.client.post("/update-requests/", {
+            "transaction_hash": "0x1", "address": self.owner, "update_id": 1, "burn_ids": "[3]",
+            "update_name": "one", "image": image or SimpleUploadedFile("art.png", png(10, 10), content_type="image/png"),
+        }, HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def test_create_stages_image(self):
+        response = self.create()
+        self.assertEqual(response.status_code, 201, response.content)
+        row = Update_Request.objects.get(pk="0x1")
+        self.assertIsNone(row.image)
+        self.assertEqual(bytes(row.staged_image.data), png(10, 10))
+
+        storage = InMemoryStorage()
+        self.assertEqual(ImageUploader(storage).upload_batch(), {"uploaded": 1, "retrying": 0, "failed": 0})
+        row.refresh_from_db()
+        self.assertEqual(storage.files[row.image.get_prep_value()], png(10, 10))
+        self.assertTrue(row.image_small_url)
+        self.assertFalse(StagedImage.objects.exists())
+
+    def test_failed_uploads_back_off(self):
+        self.create()
+        uploader = ImageUploader(FlakyStorage(failures=2), max_attempts=2, backoff=0)
+        self.assertEqual(uploader.upload_batch(), {"uploaded": 0, "retrying": 1, "failed": 0})
+        self.assertEqual(uploader.upload_batch(), {"uploaded": 0, "retrying": 0, "failed": 1})
+        # out of attempts, left staged for inspection
+        self.assertEqual(uploader.upload_batch(), {"uploaded": 0, "retrying": 0, "failed": 0})
+        staged = StagedImage.objects.get()
+        self.assertEqual((staged.attempts, staged.last_error), (2, "upload timed out"))
+
+        uploader.backoff = 60
+        uploader.storage.failures = 1
+        StagedImage.objects.update(attempts=0)
+        uploader.upload_batch()
+        self.assertGreater(StagedImage.objects.get().next_attempt_at, timezone.now())
+        self.assertEqual(uploader.upload_batch(), {"uploaded": 0, "retrying": 0, "failed": 0})
+
+    def test_uploads_run_outside_the_claim_transaction(self):
+        self.create()
+        # uploads run on pool threads, what matters is the state of this thread's connection
+        main, seen = connections["default"], []
+        outside = len(main.atomic_blocks)
+
+        class ObservingStorage(InMemoryStorage):
+            def upload(storage, data, name):
+                seen.append(len(main.atomic_blocks))
+                return super().upload(data, name)
+
+        self.assertEqual(ImageUploader(ObservingStorage()).upload_batch()["uploaded"], 1)
+        self.assertEqual(seen, [outside])
+
+    def test_claimed_images_are_leased(self):
+        self.create()
+        row = Update_Request.objects.get(pk="0x1")
+        first = ImageUploader(InMemoryStorage())
+        claimed = first.claim()
+        self.assertEqual([item.pk for item in claimed], [row.pk])
+        self.assertEqual(ImageUploader(InMemoryStorage()).upload_batch()["uploaded"], 0)
+        # the lease ran out and another uploader took the row over, the first one then records nothing
+        StagedImage.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual([item.pk for item in ImageUploader(InMemoryStorage()).claim()], [row.pk])
+        with mock.patch.object(first, "claim", return_value=claimed):
+            self.assertEqual(first.upload_batch(), {"uploaded": 0, "retrying": 0, "failed": 0})
+        self.assertTrue(StagedImage.objects.exists())
+        self.assertIsNone(Update_Request.objects.get(pk="0x1").image)
+
+    def test_records_dimensions(self):
+        self.create()
+        row = Update_Request.objects.get()
+        self.assertEqual((row.image_width, row.image_height, row.image_bytes), (10, 10, len(png(10, 10))))
+
+    @override_settings(IMAGE_MAX_DIMENSION=100)
+    def test_downscales_and_strips_metadata(self):
+        exif = Image.Exif()
+        exif[0x010F] = "Camera maker"
+        out = BytesIO()
+        Image.new("RGB", (400, 200), (1, 2, 3)).save(out, "JPEG", exif=exif.tobytes())
+        response = self.create(SimpleUploadedFile("photo.jpeg", out.getvalue(), content_type="image/jpeg"))
+        self.assertEqual(response.status_code, 201, response.content)
+        staged = StagedImage.objects.get()
+        image = Image.open(BytesIO(bytes(staged.data)))
+        self.assertEqual((image.format, image.size), ("JPEG", (100, 50)))
+        self.assertNotIn("exif", image.info)
+        self.assertEqual(staged.name, "photo.jpg")
+        self.assertEqual(Update_Request.objects.get().image_bytes, len(staged.data))
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=1024)
+    def test_rejects_oversized_and_invalid_images(self):
+        noise = Image.frombytes("L", (100, 100), os.urandom(10000))
+        out = BytesIO()
+        noise.save(out, "PNG")
+        response = self.create(SimpleUploadedFile("big.png", out.getvalue(), content_type="image/png"))
+        self.assertEqual(response.status_code, 413)
+        response = self.create(SimpleUploadedFile("art.png", b"not an image", content_type="image/png"))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Update_Request.objects.exists())
+
+    def test_png_text_is_stripped_without_decoding_clean_pngs(self):
+        info = PngImagePlugin.PngInfo()
+        info.add_text("Software", "Editor 1.0")
+        out = BytesIO()
+        Image.new("RGB", (10, 10), (1, 2, 3)).save(out, "PNG", pnginfo=info)
+        with mock.patch.object(PngImagePlugin.PngImageFile, "load", autospec=True, side_effect=Image.Image.load) as load:
+            self.assertEqual(self.create(SimpleUploadedFile("clean.png", png(10, 10))).status_code, 201)
+            load.assert_not_called()
+        Update_Request.objects.all().delete()
+        response = self.create(SimpleUploadedFile("tagged.png", out.getvalue(), content_type="image/png"))
+        self.assertEqual(response.status_code, 201, response.content)
+        image = Image.open(BytesIO(bytes(StagedImage.objects.get().data)))
+        image.load()
+        self.assertNotIn("Software", image.info)
+
+    def test_rejects_truncated_png(self):
+        info = PngImagePlugin.PngInfo()
+        info.add_text("Comment", "after the pixels")
+        out = BytesIO()
+        Image.frombytes("L", (64, 64), os.urandom(64 * 64)).save(out, "PNG", pnginfo=info)
+        for data in (png(64, 64)[:-40], out.getvalue()[:len(out.getvalue()) // 2]):
+            response = self.create(SimpleUploadedFile("cut.png", data, content_type="image/png"))
+            self.assertEqual(response.status_code, 400, response.content)
+        self.assertFalse(Update_Request.objects.exists())
+
+    def test_rejects_decompression_bombs(self):
+        def chunk(kind, data):
+            return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+        # a 20000x20000 header, Pillow refuses it while opening
+        header = chunk(b"IHDR", struct.pack(">IIBBBBB", 20000, 20000, 1, 0, 0, 0, 0))
+        data = b"\x89PNG\r\n\x1a\n" + header + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b"")
+        response = self.create(SimpleUploadedFile("bomb.png", data, content_type="image/png"))
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertFalse(Update_Request.objects.exists())
+
+class ColdStartTests(TestCase):
+    def test_heavy_modules_stay_lazy(self):
+        # timing is left to the benchmark, here only the forbidden imports are checked
+        call_command("bench_cold_start", settings_module="core.settings", runs=1, budget_ms=60000, stdout=StringIO())
+
+class SignatureRecoveryTests(TestCase):
+    text = "Sign this message to authenticate: 00ff"
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from eth_account import Account
+        from eth_account.messages import encode_defunct
+        cls.account = Account.from_key("0x" + "4c" * 32)
+        cls.signature = cls.account.sign_message(encode_defunct(text=cls.text)).signature.hex()
+
+    def variants(self):
+        """The same signature with v as 27/28, 0/1 and EIP-155 style"""
+        body, v = self.signature[:-2], int(self.signature[-2:], 16)
+        return [self.signature, body + format(v - 27, "02x"), body + format(v - 27 + 37, "02x")]
+
+    def check_backend(self, name):
+        backend = BACKENDS[name]()
+        for signature in self.variants():
+            self.assertEqual(backend.recover(self.text, signature), self.account.address)
+        self.assertNotEqual(backend.recover(self.text + "!", self.signature), self.account.address)
+        for bad in ["0x1234", "zz" * 65, self.signature[:-2] + "05", "0x" + "00" * 64 + "1b"]:
+            with self.assertRaises(InvalidSignature):
+                backend.recover(self.text, bad)
+
+    def test_eth_account_backend(self):
+        self.check_backend("eth_account")
+
+    @unittest.skipUnless(importlib.util.find_spec("coincurve"), "coincurve is not installed")
+    def test_coincurve_backend_matches(self):
+        self.check_backend("coincurve")
+
+    def login(self, wallet=None, **extra):
+        from eth_account.messages import encode_defunct
+        wallet = wallet or self.account.address
+        issued = self.client.get(f"/sign-message/?wallet={wallet}").json()
+        signature = self.account.sign_message(encode_defunct(text=issued["message"])).signature.hex()
+        data = {"wallet_address": wallet, "signature": signature, "nonce": issued["nonce"], **extra}
+        return data, self.client.post("/verify-signature/", data)
+
+    def test_verify_signature_view(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(f"/sign-message/?wallet={self.account.address}")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(EthUser.objects.exists())
+
+        data, response = self.login()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(ExpiringToken.objects.filter(key=response.json()["token"]).exists())
+        self.assertTrue(EthUser.objects.filter(address=self.account.address).exists())
+        # single use
+        response = self.client.post("/verify-signature/", data)
+        self.assertEqual((response.status_code, response.json()["error"]), (403, "Nonce already used"))
+
+    @override_settings(SIGN_NONCE_LEGACY_CLIENTS=True)
+    def test_legacy_clients_sign_the_stored_nonce(self):
+        from eth_account.messages import encode_defunct
+        # unknown wallets get nothing written
+        self.client.get(f"/sign-message/?wallet={'0x' + 'ab' * 20}")
+        self.assertFalse(EthUser.objects.exists())
+
+        wallet = self.account.address
+        EthUser.objects.create_user(wallet)
+        with self.assertNumQueries(1):
+            message = self.client.get(f"/sign-message/?wallet={wallet}").json()["message"]
+        signature = self.account.sign_message(encode_defunct(text=message)).signature.hex()
+        data = {"wallet_address": wallet, "signature": signature}
+        response = self.client.post("/verify-signature/", data)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(ExpiringToken.objects.filter(key=response.json()["token"]).exists())
+        # the same signature can't log in twice, with or without the nonce
+        response = self.client.post("/verify-signature/", data)
+        self.assertEqual((response.status_code, response.json()["error"]), (400, "Request a new message to sign"))
+        response = self.client.post("/verify-signature/", {**data, "nonce": message.rsplit(" ", 1)[1]})
+        self.assertEqual((response.status_code, response.json()["error"]), (403, "Nonce already used"))
+
+    @override_settings(SIGN_NONCE_LEGACY_CLIENTS=True)
+    def test_new_clients_spend_the_stored_nonce(self):
+        # replaying a new client's signature without the nonce must not fall back to the stored copy
+        EthUser.objects.create_user(self.account.address)
+        data, response = self.login()
+        self.assertEqual(response.status_code, 200, response.content)
+        del data["nonce"]
+        response = self.client.post("/verify-signature/", data)
+        self.assertEqual(response.status_code, 403)
+
+    def test_used_nonces_are_shared_through_the_database(self):
+        data, response = self.login()
+        self.assertEqual(response.status_code, 200, response.content)
+        # another worker has none of this process' cache
+        cache.clear()
+        response = self.client.post("/verify-signature/", data)
+        self.assertEqual((response.status_code, response.json()["error"]), (403, "Nonce already used"))
+        self.assertFalse(claim_nonce(data["nonce"]))
+
+        UsedNonce.objects.update(expires_at=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertTrue(claim_nonce("still-valid"))
+        with mock.patch.dict(os.environ, {"CRON_KEY": "secret"}):
+            response = self.client.post("/cleanup-expired-token/", HTTP_X_CRON_SECRET="secret")
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(list(UsedNonce.objects.values_list("nonce", flat=True)), ["still-valid"])
+
+    def test_rejected_nonces(self):
+        self.assertEqual(self.client.get("/sign-message/?wallet=").status_code, 400)
+        other = "0x" + "ab" * 20
+        # a nonce issued for another wallet
+        nonce = self.client.get(f"/sign-message/?wallet={other}").json()["nonce"]
+        _, response = self.login(nonce=nonce)
+        self.assertEqual(response.status_code, 400)
+        # signed by someone else
+        _, response = self.login(wallet=other)
+        self.assertEqual(response.status_code, 403)
+        with override_settings(SIGN_NONCE_TTL=-60):
+            _, response = self.login()
+        self.assertEqual((response.status_code, response.json()["error"]), (400, "Nonce expired"))
+        self.assertFalse(ExpiringToken.objects.exists())
+
+class BenchmarkSuiteTests(WhatcraftTestCase):
+    def test_every_scenario_runs_against_the_stubs(self):
+        results = BenchmarkSuite(tokens=40, update_requests=10, users=4, requests=3, login_wallets=2).run()
+        self.assertEqual(list(results["scenarios"]), list(SCENARIOS))
+        for name, result in results["scenarios"].items():
+            self.assertEqual((name, result["errors"], result["requests"]), (name, 0, 3))
+            self.assertGreater(result["rps"], 0)
+        self.assertEqual(results["scenarios"]["user-tokens"]["queries_per_request"], 0)
+        self.assertEqual(results["meta"]["volumes"]["tokens"], 40)
+
+    def test_compare_flags_regressions(self):
+        baseline = {"scenarios": {"a": {"p50_ms": 10, "p95_ms": 20, "p99_ms": 30, "rps": 100, "queries_per_request": 2}}}
+        current = {"scenarios": {
+            "a": {"p50_ms": 11, "p95_ms": 30, "p99_ms": 30, "rps": 70, "queries_per_request": 3},
+            "new": {"p50_ms": 1, "p95_ms": 1, "p99_ms": 1, "rps": 1, "queries_per_request": 0},
+        }}
+        regressed = {row["metric"] for row in compare(current, baseline, 0.2) if row["regressed"]}
+        self.assertEqual(regressed, {"p95_ms", "rps", "queries_per_request"})
+
+class RequestMetricsTests(WalletTestCase):
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    def test_server_timing_and_view_histograms(self):
+        self.add_tokens(self.owner, [1, 2])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/user-tokens/", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        # the query log is cleared when the next request starts
+        count = len(queries)
+        self.assertIn('db;dur=', response["Server-Timing"])
+        self.assertIn(f'desc="{count} queries"', response["Server-Timing"])
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+        # an unset key lets nothing in, with or without the header
+        with mock.patch.dict(os.environ, {"CRON_KEY": ""}):
+            self.assertEqual(self.client.get("/metrics/").status_code, 403)
+            self.assertEqual(self.client.get("/metrics/", HTTP_X_CRON_SECRET="").status_code, 403)
+            self.assertEqual(self.client.post("/upload-staged-images/").status_code, 403)
+        with mock.patch.dict(os.environ):
+            os.environ.pop("CRON_KEY", None)
+            self.assertEqual(self.client.get("/metrics/").status_code, 403)
+        with mock.patch.dict(os.environ, {"CRON_KEY": "secret"}):
+            self.assertEqual(self.client.get("/metrics/").status_code, 403)
+            self.assertEqual(self.client.get("/metrics/", HTTP_X_CRON_SECRET="secreT").status_code, 403)
+            metrics = self.client.get("/metrics/", HTTP_X_CRON_SECRET="secret")
+        self.assertEqual(metrics.status_code, 200)
+        self.assertTrue(metrics["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = metrics.content.decode()
+        self.assertIn('api_requests_total{view="user-tokens",method="GET",status="200"} 1', body)
+        self.assertIn('api_request_duration_seconds_count{view="user-tokens"} 1', body)
+        self.assertIn(f'api_request_dependency_calls_total{{view="user-tokens",kind="db"}} {count}', body)
+
+    def test_cache_and_export_counters(self):
+        def sample(name):
+            with mock.patch.dict(os.environ, {"CRON_KEY": "secret"}):
+                body = self.client.get("/metrics/", HTTP_X_CRON_SECRET="secret").content.decode()
+            return int(next(line for line in body.splitlines() if line.startswith(name + " ")).rsplit(" ", 1)[1])
+
+        names = [
+            'user_tokens_cache_requests_total{result="hit"}', 'user_tokens_cache_requests_total{result="miss"}',
+            'update_request_export_images_total{result="failed"}', 'update_request_export_image_bytes_total',
+        ]
+        # the counters live as long as the process, only what this test adds is checked
+        before = [sample(name) for name in names]
+        self.add_tokens(self.owner, [1])
+        user_tokens_cache.invalidate_all()
+        for _ in range(2):
+            self.client.get("/user-tokens/", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        rows = [
+            Update_Request(
+                transaction_hash=f"0x{i}", address="0xaa", update_id=i, burn_ids=[i], update_name="n",
+                image="sample", image_original_url=f"https://img.test/{i}.png", created_at=timezone.now()
+            ) for i in range(2)
+        ]
+        with mock.patch("systems.exports.fetch_image", side_effect=[b"12345", requests.Timeout()]):
+            list(iter_zip(rows))
+        self.assertEqual([sample(name) - value for name, value in zip(names, before)], [1, 1, 1, 5])
+
+    def test_outbound_calls_are_counted_by_kind(self):
+        node = StubRpcServer(head=1)
+        self.addCleanup(node.shutdown)
+        self.addCleanup(node.server_close)
+        gateway = StubGateway({"cid/1.json": b"{}"})
+        self.addCleanup(gateway.shutdown)
+        self.addCleanup(gateway.server_close)
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+
+        with override_settings(ETH_PROVIDER_URL=node.url), measure() as metrics:
+            RpcClient(node.url).token_uris("0xcontract", [1, 2])
+            IPFSClient([gateway.url], cache_dir=cache_dir.name).fetch("ipfs://cid/1.json")
+        calls = metrics.snapshot()
+        self.assertEqual(calls["rpc"][0], 1)
+        self.assertEqual(calls["ipfs"][0], 1)
+        self.assertEqual(call_kind("https://res.cloudinary.com/demo/image/upload/x.png"), "cloudinary")
+        self.assertEqual(call_kind("https://example.com/metadata/1.json"), "http")
+
+    async def test_async_calls_are_counted(self):
+        gateway = StubGateway({"cid/1.json": json.dumps({"image": "ipfs://imgcid/1.png"}).encode()})
+        self.addCleanup(gateway.shutdown)
+        self.addCleanup(gateway.server_close)
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        try:
+            with measure() as metrics:
+                await acollection_image_base("ipfs://cid/1.json", IPFSClient([gateway.url], cache_dir=cache_dir.name))
+        finally:
+            await close_http_session()
+        self.assertEqual(metrics.snapshot()["ipfs"][0], 1)
+
+    def test_histogram_buckets_are_cumulative(self):
+        metrics = MetricsRegistry()
+        for seconds in (0.001, 0.02, 30):
+            request = RequestMetrics()
+            request.started -= seconds
+            request.add("db", seconds / 2)
+            metrics.observe('we"ird', "GET", 200, request)
+        body = metrics.render()
+        self.assertIn('api_request_duration_seconds_bucket{view="we\\"ird",le="0.005"} 1', body)
+        self.assertIn('api_request_duration_seconds_bucket{view="we\\"ird",le="0.025"} 2', body)
+        self.assertIn('api_request_duration_seconds_bucket{view="we\\"ird",le="+Inf"} 3', body)
+        self.assertIn('api_request_dependency_seconds_bucket{view="we\\"ird",kind="db",le="10.0"} 2', body)
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import tempfile
+import threading
+from io import BytesIO
+from django.conf import settings
+
+FORMATS = {"webp": "image/webp", "png": "image/png"}
+
+def thumbnail_sizes() -> tuple:
+    return tuple(getattr(settings, "THUMBNAIL_SIZES", (128, 300, 600)))
+
+def source_version(image_url:str) -> str:
+    """Short hash of the collection image base, part of every thumbnail url"""
+    return hashlib.sha256(image_url.encode()).hexdigest()[:12]
+
+def render(source:bytes, size:int, fmt:str) -> bytes:
+    """Fit the image into size x size, keeping the aspect ratio"""
+    from PIL import Image
+    with Image.open(BytesIO(source)) as image:
+        image.thumbnail((size, size), Image.LANCZOS)
+        if fmt == "webp":
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        out = BytesIO()
+        if fmt == "webp":
+            image.save(out, "WEBP", quality=80, method=4)
+        else:
+            image.save(out, "PNG", optimize=True)
+        return out.getvalue()
+
+class ThumbnailCache:
+    """
+    Size bounded LRU of thumbnail files on disk.
+
+    Recency is the file mtime, touched on every hit. When a write takes the
+    directory over `max_bytes` the least recently used files are removed.
+    Variants of one token are rendered together from a single source fetch,
+    a per-token lock keeps concurrent misses from fetching it twice.
+    """
+    def __init__(self, cache_dir:str = None, max_bytes:int = None, fetch=None):
+        self.cache_dir = cache_dir or getattr(
+            settings, "THUMBNAIL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "what-the-burn-thumbnails")
+        )
+        self.max_bytes = max_bytes or getattr(settings, "THUMBNAIL_CACHE_MAX_BYTES", 512 * 1024 * 1024)
+        self.fetch = fetch or self._fetch_ipfs
+        self._lock = threading.Lock()
+        self._token_locks = {}
+        self._total = None
+
+    def _fetch_ipfs(self, url:str) -> bytes:
+        from .ipfs import get_ipfs_client
+        return get_ipfs_client().fetch(url)
+
+    def path(self, version:str, token_id:int, size:int, fmt:str) -> str:
+        return os.path.join(self.cache_dir, f"{version}-{token_id}-{size}.{fmt}")
+
+    def _read(self, path:str):
+        try:
+            with open(path, "rb") as file:
+                content = file.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return content
+
+    def _token_lock(self, key) -> threading.Lock:
+        with self._lock:
+            return self._token_locks.setdefault(key, threading.Lock())
+
+    def get(self, image_url:str, token_id:int, size:int, fmt:str) -> bytes:
+        version = source_version(image_url)
+        path = self.path(version, token_id, size, fmt)
+        content = self._read(path)
+        if content is not None:
+            return content
+        key = (version, token_id)
+        with self._token_lock(key):
+            content = self._read(path)
+            if content is None:
+                variants = self.warm(image_url, token_id)
+                content = variants[(size, fmt)]
+        with self._lock:
+            self._token_locks.pop(key, None)
+        return content
+
+    def warm(self, image_url:str, token_id:int) -> dict:
+        """Render and store every size and format of a token, returns {(size, fmt): bytes}"""
+        version = source_version(image_url)
+        source = self.fetch(f"{image_url}{token_id}.png")
+        variants = {}
+        for size in thumbnail_sizes():
+            for fmt in FORMATS:
+                variants[(size, fmt)] = render(source, size, fmt)
+                self._write(self.path(version, token_id, size, fmt), variants[(size, fmt)])
+        return variants
+
+    def has(self, image_url:str, token_id:int) -> bool:
+        version = source_version(image_url)
+        return all(
+            os.path.exists(self.path(version, token_id, size, fmt))
+            for size in thumbnail_sizes() for fmt in FORMATS
+        )
+
+    def _write(self, path:str, content:bytes):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._total is None:
+                self._total = self.disk_usage()
+            else:
+                self._total += len(content)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def disk_usage(self) -> int:
+        total = 0
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    total += entry.stat().st_size
+        return total
+
+    def _evict(self):
+        """Drop least recently used files until the cache is back under 90% of its bound"""
+        files = []
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        self._total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, size, path in files:
+            if self._total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._total -= size
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ThumbnailCache()
+        return _cache
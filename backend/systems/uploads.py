@@ -0,0 +1,100 @@
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .cache import bump_update_requests_stamp
+from .models import StagedImage, Update_Request
+from .storage import get_image_storage
+
+logger = logging.getLogger(__name__)
+
+class ImageUploader:
+    """
+    Pushes StagedImage rows to image storage and fills in Update_Request.image.
+
+    A batch is claimed in a short transaction by moving its next attempt past
+    IMAGE_UPLOAD_LEASE, so other uploaders skip it while it uploads with no
+    transaction open. Rows of an uploader that died become due again once the
+    lease runs out. A failed upload is retried with exponential backoff until
+    `max_attempts`, then left for inspection.
+    """
+    def __init__(self, storage=None, batch_size:int = None, workers:int = None,
+                 max_attempts:int = None, backoff:float = None, lease:float = None):
+        self.storage = storage or get_image_storage()
+        self.batch_size = batch_size or getattr(settings, "IMAGE_UPLOAD_BATCH_SIZE", 20)
+        self.workers = workers or getattr(settings, "IMAGE_UPLOAD_WORKERS", 4)
+        self.max_attempts = max_attempts or getattr(settings, "IMAGE_UPLOAD_MAX_ATTEMPTS", 8)
+        self.backoff = backoff if backoff is not None else getattr(settings, "IMAGE_UPLOAD_BACKOFF", 30)
+        self.lease = lease if lease is not None else getattr(settings, "IMAGE_UPLOAD_LEASE", 300)
+
+    def _upload(self, staged:StagedImage):
+        """Returns (stored value, error), never raises"""
+        try:
+            return self.storage.upload(bytes(staged.data), staged.name), None
+        except Exception as e:
+            return None, e
+
+    def claim(self) -> list:
+        """The next batch of due images, leased to this uploader"""
+        with transaction.atomic():
+            staged = list(
+                StagedImage.objects.select_for_update(skip_locked=True)
+                .filter(next_attempt_at__lte=timezone.now(), attempts__lt=self.max_attempts)
+                .order_by('next_attempt_at')[:self.batch_size]
+            )
+            if staged:
+                leased_until = timezone.now() + datetime.timedelta(seconds=self.lease)
+                StagedImage.objects.filter(pk__in=[item.pk for item in staged]).update(next_attempt_at=leased_until)
+                for item in staged:
+                    item.next_attempt_at = leased_until
+        return staged
+
+    def upload_batch(self) -> dict:
+        """Upload the next batch of due images, returns counts per outcome"""
+        counts = {"uploaded": 0, "retrying": 0, "failed": 0}
+        staged = self.claim()
+        if not staged:
+            return counts
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(staged))) as pool:
+            results = list(pool.map(self._upload, staged))
+
+        with transaction.atomic():
+            # a row whose lease ran out may have been claimed again meanwhile, that uploader records it
+            leased_until = staged[0].next_attempt_at
+            owned = set(
+                StagedImage.objects.select_for_update()
+                .filter(pk__in=[item.pk for item in staged], next_attempt_at=leased_until)
+                .values_list('pk', flat=True)
+            )
+            now = timezone.now()
+            uploaded, retries = [], []
+            for item, (value, error) in zip(staged, results):
+                if item.pk not in owned:
+                    continue
+                if error is None:
+                    original, small = Update_Request.build_image_urls(value)
+                    Update_Request.objects.filter(pk=item.pk).update(
+                        image=value, image_original_url=original, image_small_url=small, updated_at=now
+                    )
+                    uploaded.append(item.pk)
+                    continue
+                item.attempts += 1
+                item.last_error = str(error)[:255]
+                item.next_attempt_at = now + datetime.timedelta(seconds=self.backoff * 2 ** (item.attempts - 1))
+                retries.append(item)
+                if item.attempts >= self.max_attempts:
+                    counts["failed"] += 1
+                    logger.error("Giving up on image for %s after %s attempts: %s", item.pk, item.attempts, error)
+                else:
+                    counts["retrying"] += 1
+
+            StagedImage.objects.filter(pk__in=uploaded).delete()
+            StagedImage.objects.bulk_update(retries, ['attempts', 'last_error', 'next_attempt_at'])
+            counts["uploaded"] = len(uploaded)
+        if uploaded:
+            # .update() skips the post_save signal that normally bumps it
+            bump_update_requests_stamp()
+        return counts
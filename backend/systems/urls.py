@@ -1,10 +1,11 @@
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, re_path, include
 from systems.views import (
     index,
     GetSignMessageView, VerifySignatureView,
     UpdateImageUrl, UpdateImageUrlFromIPFS,
-    Gettokens, UpdateRequestViewSet,
-    CleanupExpiredTokensView,
+    Gettokens, ThumbnailView, UpdateRequestViewSet,
+    CleanupExpiredTokensView, UploadStagedImagesView, MetricsView,
     AppSettingsView
 )
 from rest_framework.routers import DefaultRouter
@@ -20,6 +21,32 @@ urlpatterns = [
     path('update-image-url/', UpdateImageUrl.as_view(), name='update-image-url'),
     path('update-from-ipfs/', UpdateImageUrlFromIPFS.as_view(), name='update-image-url-from-ipfs'),
     path('user-tokens/', Gettokens.as_view(), name='user-tokens'),
+    re_path(
+        r'^thumbnails/(?P<version>[0-9a-f]{12})/(?P<size>[0-9]+)/(?P<token_id>[0-9]+)\.(?P<fmt>webp|png)$',
+        ThumbnailView.as_view(), name='thumbnail'
+    ),
     path('cleanup-expired-token/', CleanupExpiredTokensView.as_view(), name='cleanup-expired-token'),
+    path('upload-staged-images/', UploadStagedImagesView.as_view(), name='upload-staged-images'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
     path('app-settings/', AppSettingsView.as_view(), name='app-settings'),
 ]
+
+if getattr(settings, "ASYNC_VIEWS", False):
+    # served by core/asgi.py, the async views take over the same paths
+    from systems.async_views import (
+        AsyncGettokens, AsyncUpdateImageUrlFromIPFS, AsyncUpdateRequestDownload
+    )
+    urlpatterns = [
+        path('update-requests/download_all/', AsyncUpdateRequestDownload.as_view(scope="all"),
+             name='update-request-download-all'),
+        path('update-requests/download_new/', AsyncUpdateRequestDownload.as_view(scope="new"),
+             name='update-request-download-new'),
+        path('update-requests/download_downloaded/', AsyncUpdateRequestDownload.as_view(scope="downloaded"),
+             name='update-request-download-downloaded'),
+        path('update-requests/<str:pk>/download/', AsyncUpdateRequestDownload.as_view(scope="one"),
+             name='update-request-download'),
+        path('update-from-ipfs/', AsyncUpdateImageUrlFromIPFS.as_view(), name='update-image-url-from-ipfs'),
+        path('user-tokens/', AsyncGettokens.as_view(), name='user-tokens'),
+    ] + [pattern for pattern in urlpatterns if getattr(pattern, 'name', None) not in (
+        'update-image-url-from-ipfs', 'user-tokens'
+    )]
@@ -0,0 +1,132 @@
+import datetime
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from eth_abi import decode
+from .cache import bump_update_requests_stamp
+from .indexer import TRANSFER_TOPIC, topic_address
+from .models import Update_Request
+from .rpc import RPCError, RpcClient
+
+CREATE_PREMIUM_SELECTOR = bytes.fromhex("41989bef")  # createPremium(uint32[],uint32)
+BURN_SINKS = {"0x" + "0" * 40, "0x000000000000000000000000000000000000dead"}
+
+class Pending(Exception):
+    """The transaction can't be judged yet, try again on a later pass"""
+
+class Rejected(Exception):
+    pass
+
+class BurnVerifier:
+    """
+    Checks Update_Request rows against their on-chain burn transaction.
+
+    A row is verified when its transaction succeeded, called createPremium on
+    the burn manager from `address` with the row's burn_ids and update_id, and
+    its receipt carries a collection Transfer out of `address` into a burn sink
+    (or the manager) for every burned token.
+    Receipts and transactions for a whole batch are fetched in one JSON-RPC batch.
+    """
+    def __init__(self, rpc:RpcClient, burn_manager:str = None, collection:str = None,
+                 batch_size:int = None, confirmations:int = None):
+        self.rpc = rpc
+        self.burn_manager = (burn_manager or settings.ETH_BURN_MANAGER_CONTRACT).lower()
+        self.collection = (collection or settings.ETH_COLLECTION_CONTRACT).lower()
+        self.batch_size = batch_size or getattr(settings, "VERIFY_BATCH_SIZE", 50)
+        self.confirmations = confirmations if confirmations is not None else getattr(settings, "INDEXER_CONFIRMATIONS", 5)
+        self.max_pending = datetime.timedelta(hours=getattr(settings, "VERIFY_MAX_PENDING_HOURS", 24))
+
+    def verify_batch(self) -> dict:
+        """Verify the next batch of pending rows, returns counts per outcome"""
+        counts = {"verified": 0, "rejected": 0, "pending": 0}
+        with transaction.atomic():
+            # skip rows another worker is checking, least recently checked first
+            rows = list(
+                Update_Request.objects.select_for_update(skip_locked=True)
+                .filter(verification_status=Update_Request.Verification.PENDING)
+                .order_by(F('verification_checked_at').asc(nulls_first=True), 'created_at')[:self.batch_size]
+            )
+            if not rows:
+                return counts
+
+            calls = [("eth_blockNumber", [])]
+            for row in rows:
+                calls += [
+                    ("eth_getTransactionReceipt", [row.transaction_hash]),
+                    ("eth_getTransactionByHash", [row.transaction_hash]),
+                ]
+            replies = self.rpc.batch(calls, batch_size=len(calls))
+            if isinstance(replies[0], RPCError):
+                raise replies[0]
+            safe_head = int(replies[0], 16) - self.confirmations
+
+            now = timezone.now()
+            for i, row in enumerate(rows):
+                receipt, tx = replies[1 + 2 * i], replies[2 + 2 * i]
+                before = (row.verification_status, row.verification_block, row.verification_error)
+                try:
+                    row.verification_block = self.check(row, receipt, tx, safe_head)
+                    row.verification_status = Update_Request.Verification.VERIFIED
+                    row.verification_error = ''
+                except Pending as e:
+                    if now - row.created_at > self.max_pending:
+                        row.verification_status = Update_Request.Verification.REJECTED
+                    row.verification_error = str(e)
+                except Rejected as e:
+                    row.verification_status = Update_Request.Verification.REJECTED
+                    row.verification_error = str(e)
+                row.verification_checked_at = now
+                if (row.verification_status, row.verification_block, row.verification_error) != before:
+                    # only visible changes move the list etag, rows still pending are re-checked every pass
+                    row.updated_at = now
+                counts[row.verification_status] += 1
+
+            Update_Request.objects.bulk_update(rows, [
+                'verification_status', 'verification_block', 'verification_error', 'verification_checked_at',
+                'updated_at',
+            ])
+            # bulk_update skips the post_save signal, a list etag built before the commit must not survive it
+            transaction.on_commit(bump_update_requests_stamp)
+        return counts
+
+    def check(self, row, receipt, tx, safe_head:int) -> int:
+        """Returns the block the burn was mined in, raises Pending or Rejected"""
+        if isinstance(receipt, RPCError) or isinstance(tx, RPCError):
+            raise Pending(f"RPC failed: {receipt if isinstance(receipt, RPCError) else tx}")
+        if receipt is None or tx is None:
+            raise Pending("Transaction not found")
+
+        block = int(receipt["blockNumber"], 16)
+        if block > safe_head:
+            raise Pending("Waiting for confirmations")
+        if int(receipt.get("status", "0x0"), 16) != 1:
+            raise Rejected("Transaction reverted")
+        if (tx.get("to") or "").lower() != self.burn_manager:
+            raise Rejected("Transaction was not sent to the burn manager")
+        if tx["from"].lower() != row.address.lower():
+            raise Rejected("Sender does not match address")
+
+        data = bytes.fromhex(tx["input"][2:])
+        if data[:4] != CREATE_PREMIUM_SELECTOR:
+            raise Rejected("Transaction is not a createPremium call")
+        try:
+            token_ids, update_id = decode(["uint32[]", "uint32"], data[4:])
+            burn_ids = sorted(int(token_id) for token_id in row.burn_ids)
+        except Exception:
+            raise Rejected("Could not decode burn ids")
+        if sorted(token_ids) != burn_ids:
+            raise Rejected("burn_ids do not match the transaction")
+        if update_id != row.update_id:
+            raise Rejected("update_id does not match the transaction")
+
+        sinks = BURN_SINKS | {self.burn_manager}
+        burned = set()
+        for log in receipt.get("logs", []):
+            topics = log.get("topics", [])
+            if (log["address"].lower() == self.collection and len(topics) == 4 and topics[0].lower() == TRANSFER_TOPIC
+                    and topic_address(topics[1]) == row.address.lower() and topic_address(topics[2]) in sinks):
+                burned.add(int(topics[3], 16))
+        if not set(burn_ids) <= burned:
+            raise Rejected("Receipt has no burn for every token")
+        return block
@@ -1,26 +1,31 @@
 from datetime import datetime
-from eth_account.messages import encode_defunct
-from eth_account import Account
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework import viewsets, status
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.urls import reverse
+from django.core.files.uploadedfile import UploadedFile
 from django.utils.crypto import get_random_string
 from django.utils import timezone
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Exists, Max, OuterRef, Q
+from django.db.models.functions import Lower
 from .permissions import HasCronSecretPermission
-from .models import EthUser, ImageUrl, Update_Request, AppSettings, Whatcraft, ExpiringToken
+from .nonces import WALLET_RE, InvalidNonce, check_nonce, claim_nonce, issue_nonce, sign_message
+from .auth import SignedToken, token_cache
+from .images import ImageSizeLimitHandler
+from .thumbnails import FORMATS, get_thumbnail_cache, source_version, thumbnail_sizes
+from .cache import runtime_config, user_tokens_cache, update_requests_stamp
+from .pagination import UpdateRequestCursorPagination
+from .conditional import make_etag, etag_matches, not_modified, with_etag
+from .models import EthUser, ImageUrl, Update_Request, StagedImage, RevokedToken, UsedNonce, AppSettings, Whatcraft, ExpiringToken
 from .serializers import (
     SignatureVerifySerializer, UpdateRequestSerializer,
-    AppSettingsSerializer
+    UpdateRequestRows, AppSettingsSerializer
 )
-from io import BytesIO
-from web3 import Web3
-import requests
-import zipfile
-import secrets
 
 def index(request):
     now = datetime.now()
@@ -36,14 +41,19 @@ def index(request):
 
 class GetSignMessageView(APIView):
     permission_classes = [AllowAny]
+    authentication_classes = []
     def get(self, request):
+        """Stateless nonce, nothing is written until the signature checks out"""
         wallet = request.query_params.get("wallet", "")
-        user, _ = EthUser.objects.update_or_create(
-            address=wallet,
-            defaults={"nonce": secrets.token_hex(16)}
-        )
+        if not WALLET_RE.match(wallet):
+            return Response({"error": "Invalid wallet address"}, status=400)
+        nonce = issue_nonce(wallet)
+        if getattr(settings, "SIGN_NONCE_LEGACY_CLIENTS", False):
+            # clients that don't post the nonce back verify against the one on the user, only known wallets get one
+            EthUser.objects.filter(address=wallet).update(nonce=nonce)
         return Response({
-            "message": f"Sign this message to authenticate: {user.nonce}"
+            "message": sign_message(nonce),
+            "nonce": nonce
         })
 
 class VerifySignatureView(APIView):
@@ -54,30 +64,57 @@ class VerifySignatureView(APIView):
         serializer.is_valid(raise_exception=True)
         wallet = serializer.validated_data['wallet_address']
         signature = serializer.validated_data['signature']
-
+        nonce = serializer.validated_data.get('nonce')
+
+        user = None
+        if nonce:
+            try:
+                check_nonce(wallet, nonce)
+            except InvalidNonce as e:
+                return Response({"error": str(e)}, status=400)
+        else:
+            # clients from before stateless nonces sign the nonce stored on the user
+            try:
+                user = EthUser.objects.get(address=wallet)
+            except EthUser.DoesNotExist:
+                return Response({"error": "User not found"}, status=400)
+            if not user.nonce:
+                return Response({"error": "Request a new message to sign"}, status=400)
+            nonce = user.nonce
+            try:
+                check_nonce(wallet, nonce)
+            except InvalidNonce:
+                return Response({"error": "Request a new message to sign"}, status=400)
+
+        # the recovery backend pulls in eth_account or coincurve, only load it to verify
+        from .signatures import InvalidSignature, recover_address
         try:
-            user = EthUser.objects.get(address=wallet)
-        except EthUser.DoesNotExist:
-            return Response({"error": "User not found"}, status=400)
-
-        message = encode_defunct(text=f"Sign this message to authenticate: {user.nonce}")
-        try:
-            recovered = Account.recover_message(message, signature=signature)
-        except Exception as e:
+            recovered = recover_address(sign_message(nonce), signature)
+        except InvalidSignature:
             return Response({"error": "Invalid signature"}, status=400)
 
         if recovered.lower() != wallet.lower():
             return Response({"error": "Signature mismatch"}, status=403)
 
-        ExpiringToken.objects.filter(user=user).delete()
-        token = ExpiringToken.objects.create(
-            user=user,
-            key=get_random_string(40)
-        )
-
-        # Rotate nonce
-        user.nonce = secrets.token_hex(16)
-        user.save(update_fields=["nonce"])
+        # claimed on both paths, a nonce posted back is also the one stored on the user
+        if not claim_nonce(nonce):
+            return Response({"error": "Nonce already used"}, status=403)
+        if user is None:
+            user = self.get_or_create_user(wallet)
+        else:
+            user.nonce = ''
+            user.save(update_fields=["nonce"])
+
+        if getattr(settings, "SESSION_TOKEN_MODE", "db") == "signed":
+            # self-verifying, nothing is written, earlier tokens run out on their own
+            token = SignedToken.issue(user)
+        else:
+            ExpiringToken.objects.filter(user=user).delete()
+            token_cache.invalidate_user(user)
+            token = ExpiringToken.objects.create(
+                user=user,
+                key=get_random_string(40)
+            )
 
         return Response({
             "admin": user.is_staff,
@@ -85,34 +122,108 @@ class VerifySignatureView(APIView):
             "expires_at": token.expires_at
         })
 
+    def get_or_create_user(self, wallet:str) -> EthUser:
+        try:
+            return EthUser.objects.get(address=wallet)
+        except EthUser.DoesNotExist:
+            pass
+        try:
+            with transaction.atomic():
+                return EthUser.objects.create_user(wallet)
+        except IntegrityError:
+            # a concurrent login created it first
+            return EthUser.objects.get(address=wallet)
+
 class Gettokens(APIView): 
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
         wallet = request.user.address.lower()
-        img_url = ImageUrl.objects.get(id=1)
-        tokens = self.tokens_owned(wallet, img_url.url)
-        return Response({"tokens": tokens})
+        thumbnail = request.query_params.get("thumbnail")
+        fmt = request.query_params.get("thumbnail_format", "webp")
+        error = self.thumbnail_error(thumbnail, fmt)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        entry = user_tokens_cache.get_or_build(
+            wallet, lambda: self.tokens_owned(wallet, runtime_config.image_url())
+        )
+        etag = entry["etag"] if thumbnail is None else make_etag(entry["etag"], thumbnail, fmt)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        tokens = entry["tokens"]
+        if thumbnail is not None:
+            tokens = self.with_thumbnails(request, tokens, runtime_config.image_url(), int(thumbnail), fmt)
+        return with_etag(Response({"tokens": tokens}), etag)
+
+    @staticmethod
+    def thumbnail_error(thumbnail, fmt):
+        if thumbnail is not None:
+            if not thumbnail.isdigit() or int(thumbnail) not in thumbnail_sizes() or fmt not in FORMATS:
+                return f"thumbnail must be one of {list(thumbnail_sizes())}, thumbnail_format one of {list(FORMATS)}"
+        return None
+
+    @staticmethod
+    def with_thumbnails(request, tokens, image_url, size, fmt) -> list:
+        """Point each token's image at its thumbnail instead of the full size source"""
+        url = request.build_absolute_uri(reverse("thumbnail", kwargs={
+            "version": source_version(image_url), "size": size, "token_id": 0, "fmt": fmt
+        }))
+        prefix = url[:-len(f"0.{fmt}")]
+        return [{**token, "image": f"{prefix}{token['id']}.{fmt}"} for token in tokens]
+
+    @staticmethod
+    def owned(owner_address):
+        # flag updated tokens in the same query, matched on the lower(address) index
+        updated = Update_Request.objects.alias(
+            address_lower=Lower('address')
+        ).filter(address_lower=owner_address, update_id=OuterRef('token_id'))
+        return Whatcraft.objects.filter(current_owner=owner_address).annotate(
+            is_updated=Exists(updated)
+        ).values_list('token_id', 'is_updated')
+
+    @staticmethod
+    def token_row(token, is_updated, image_url) -> dict:
+        return {
+            "id": token,
+            "image": f"{image_url}{token}.png", # add .png for main build
+            "name": f"WHAT{' (Updated) #' if is_updated else ' #'}{token}", # change to main net eventualy
+            "updated": is_updated
+        }
 
     def tokens_owned(self, owner_address, image_url) -> list:
-        tokens = Whatcraft.objects.filter(current_owner=owner_address).values_list('token_id', flat=True)
-        updated_tokens = Update_Request.objects.filter(address__iexact=owner_address).values_list('update_id', flat=True) # flag them as updated
-        token_ids = []
-        for token in tokens:
-            is_updated = token in updated_tokens
-            token_ids.append({
-                "id": token,
-                "image": f"{image_url}{token}.png", # add .png for main build
-                "name": f"WHAT{' (Updated) #' if is_updated else ' #'}{token}", # change to main net eventualy
-                "updated": is_updated
-            })
-        return token_ids
+        return [self.token_row(token, is_updated, image_url) for token, is_updated in self.owned(owner_address)]
+
+class ThumbnailView(APIView):
+    """Resized token images, the url carries the source version so responses never change"""
+    permission_classes = [AllowAny]
+    authentication_classes = []
+
+    def get(self, request, version, size, token_id, fmt):
+        size, token_id = int(size), int(token_id)
+        if size not in thumbnail_sizes() or not Whatcraft.objects.filter(token_id=token_id).exists():
+            raise Http404
+        image_url = runtime_config.image_url()
+        current = source_version(image_url)
+        if version != current:
+            # the collection images moved, send old links to the current variant
+            response = HttpResponseRedirect(reverse("thumbnail", kwargs={
+                "version": current, "size": size, "token_id": token_id, "fmt": fmt
+            }))
+            response["Cache-Control"] = "no-cache"
+            return response
+        try:
+            content = get_thumbnail_cache().get(image_url, token_id, size, fmt)
+        except Exception as e:
+            return Response({"error": f"Error fetching image {token_id}: {e}"}, status=status.HTTP_502_BAD_GATEWAY)
+        response = HttpResponse(content, content_type=FORMATS[fmt])
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
 
 class UpdateImageUrl(APIView):
     permission_classes = [IsAuthenticated]
     def get(self, request):
         url = request.query_params.get("url", "")
-        _, _ = ImageUrl.objects.update_or_create(id=1, url=url)
+        ImageUrl.objects.update_or_create(id=1, defaults={'url': url})
     
         return Response({
             "message": f"{url} Added"
@@ -124,57 +235,72 @@ class UpdateImageUrlFromIPFS(APIView):
         url = request.query_params.get("url", "")
         if url == "":
             url = self.get_token_uri(1)
-        image_url = self.handel_ipfs(url)
-        
-        user, _ = ImageUrl.objects.update_or_create(id=1, url=image_url)
-    
-        return Response({
-            "message": f"{url} Added"
-        })
-
-    def handel_ipfs(self, json_url:str):
+        from .ipfs import collection_image_base
         try:
-            response = requests.get(json_url, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            image_uri:str = data.get("image")
-            image_uri = image_uri.split("/1.")[0]+"/"
-
+            image_url = collection_image_base(url)
         except Exception as e:
-            self.stderr.write(f"Error fetching {json_url}: {e}")
-        self.update(image_uri)
+            return Response({"error": f"Error fetching {url}: {e}"}, status=status.HTTP_502_BAD_GATEWAY)
+
+        # an unchanged url is not saved, saving flushes every worker's token cache
+        if not ImageUrl.objects.filter(id=1, url=image_url).exists():
+            ImageUrl.objects.update_or_create(id=1, defaults={'url': image_url})
+
+        return Response({
+            "message": f"{image_url} Added"
+        })
 
     def get_token_uri(self, token_id:int = 1)->str:
-        rpc_url = settings.ETH_PROVIDER_URL
-        web3 = Web3(Web3.HTTPProvider(rpc_url))
-        assert web3.is_connected(), "Can't connect to HyperEVM"
-        contract_address = settings.ETH_COLLECTION_CONTRACT
-        abi = [
-            {
-                "constant": True,
-                "inputs": [{"name": "tokenId","type": "uint256"}],
-                "name": "tokenURI",
-                "outputs": [{"name": "", "type": "string"}],
-                "type": "function"
-            }
-        ]
-        contract = web3.eth.contract(address=contract_address, abi=abi)
-        token_uri:str = contract.functions.tokenURI(token_id).call()
-        return token_uri
+        from .rpc import get_client
+        return get_client().token_uri(settings.ETH_COLLECTION_CONTRACT, token_id)
 
 class CleanupExpiredTokensView(APIView):
     permission_classes = [HasCronSecretPermission]
 
     def post(self, request):
         try:
-            count, _ = ExpiringToken.objects.filter(expires_at__lte=timezone.now()).delete()
-            return Response({"deleted_tokens": count})
+            count, finished = ExpiringToken.purge_expired()
+            token_cache.purge_expired()
+            RevokedToken.purge_expired()
+            UsedNonce.purge_expired()
+            return Response({"deleted_tokens": count, "finished": finished})
         except Exception as e:
             return Response({"error": f"Internal server error{e}"}, status=500)   
 
+class MetricsView(APIView):
+    """Per-view request, query and outbound call histograms of this worker, for Prometheus"""
+    permission_classes = [HasCronSecretPermission]
+
+    def get(self, request):
+        from .exports import fetch_totals
+        from .instrumentation import registry, render_counter
+        tokens_cache, fetches = user_tokens_cache.stats(), fetch_totals.snapshot()
+        lines = render_counter(
+            "user_tokens_cache_requests_total", "Lookups of the /user-tokens/ payload cache.",
+            [({"result": "hit"}, tokens_cache["hits"]), ({"result": "miss"}, tokens_cache["misses"])],
+        ) + render_counter(
+            "update_request_export_images_total", "Images fetched for update-request exports.",
+            [({"result": "fetched"}, fetches["fetched"]), ({"result": "failed"}, fetches["failed"])],
+        ) + render_counter(
+            "update_request_export_image_bytes_total", "Bytes of the images fetched for update-request exports.",
+            [({}, fetches["bytes"])],
+        )
+        body = registry.render() + "\n".join(lines) + "\n"
+        return HttpResponse(body, content_type="text/plain; version=0.0.4; charset=utf-8")
+
+class UploadStagedImagesView(APIView):
+    permission_classes = [HasCronSecretPermission]
+
+    def post(self, request):
+        try:
+            from .uploads import ImageUploader
+            return Response(ImageUploader().upload_batch())
+        except Exception as e:
+            return Response({"error": f"Internal server error{e}"}, status=500)
+
 class UpdateRequestViewSet(viewsets.ModelViewSet):
     queryset = Update_Request.objects.all()
     serializer_class = UpdateRequestSerializer
+    pagination_class = UpdateRequestCursorPagination
 
     def get_permissions(self):
         # Only allow authenticated users to POST (create)
@@ -183,8 +309,26 @@ class UpdateRequestViewSet(viewsets.ModelViewSet):
         # All download-related actions and any other method must be admin
         return [IsAdminUser()]
 
+    def create(self, request, *args, **kwargs):
+        # must come first so an oversized image is refused while it streams in
+        request.upload_handlers.insert(0, ImageSizeLimitHandler(request))
+        return super().create(request, *args, **kwargs)
+
+    def perform_create(self, serializer):
+        """
+        Persist the request right away and leave the image upload to the
+        background uploader, the burn is already on chain at this point.
+        """
+        image = serializer.validated_data.get('image')
+        if not getattr(settings, "IMAGE_UPLOAD_DEFERRED", False) or not isinstance(image, UploadedFile):
+            serializer.save()
+            return
+        with transaction.atomic():
+            instance = serializer.save(image=None)
+            StagedImage.stage(instance, image)
+
     def get_queryset(self):
-        """Allows filtering by `downloaded` status"""
+        """Allows filtering by `downloaded` and `verification_status`"""
         queryset = super().get_queryset()
         downloaded = self.request.query_params.get('downloaded')
         if downloaded is not None:
@@ -192,77 +336,128 @@ class UpdateRequestViewSet(viewsets.ModelViewSet):
                 queryset = queryset.filter(downloaded=True)
             elif downloaded.lower() == 'false':
                 queryset = queryset.filter(downloaded=False)
+        verification_status = self.request.query_params.get('verification_status')
+        if verification_status in Update_Request.Verification.values:
+            queryset = queryset.filter(verification_status=verification_status)
         return queryset
 
+    def requested_fields(self):
+        """List calls accept `fields=a,b` to only serialize those fields"""
+        fields = self.request.query_params.get('fields')
+        if not fields:
+            return None
+        return [field.strip() for field in fields.split(',') if field.strip()]
+
+    def list(self, request, *args, **kwargs):
+        """
+        Serializes straight from .values() rows, see UpdateRequestRows.
+        Answers polls with 304 until the filtered rows change.
+        """
+        etag = self.list_etag()
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        rows = UpdateRequestRows(self.requested_fields())
+        queryset = rows.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            response = self.get_paginated_response(rows.serialize(page))
+        else:
+            response = Response(rows.serialize(queryset))
+        return with_etag(response, etag)
+
+    def list_etag(self) -> str:
+        """Validator from aggregates of the filtered queryset, no rows are serialized"""
+        summary = self.filter_queryset(self.get_queryset()).aggregate(
+            count=Count('pk'),
+            latest=Max('created_at'),
+            downloaded=Count('pk', filter=Q(downloaded=True)),
+            # writes from other processes, whose stamp bumps may not reach this one's cache
+            changed=Max('updated_at'),
+        )
+        return make_etag(
+            update_requests_stamp(), self.request.get_full_path(),
+            summary['count'], summary['latest'], summary['downloaded'], summary['changed']
+        )
+
     def generate_zip(self, instances):
-        """Generate a ZIP file from a list of Update_Request instances"""
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for instance in instances:
-                # Add metadata
-                metadata = (
-                    f"Transaction Hash: {instance.transaction_hash}\n"
-                    f"Address: {instance.address}\n"
-                    f"Update ID: {instance.update_id}\n"
-                    f"Update Name: {instance.update_name}\n"
-                    f"Burn IDs: {instance.burn_ids}\n"
-                    f"Created At: {instance.created_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
-                    f"Downloaded: {instance.downloaded}\n"
-                    f"Description: {instance.description}\n"
-                )
-                zip_file.writestr(f"{instance.transaction_hash}/metadata.txt", metadata)
-
-                # Add image
-                if instance.image:
-                    try:
-                        img_url = instance.get_image_original()
-                        img_response = requests.get(img_url)
-                        if img_response.status_code == 200:
-                            ext = img_url.split('.')[-1].split('?')[0]
-                            zip_file.writestr(f"{instance.transaction_hash}/image.{ext}", img_response.content)
-                    except Exception as e:
-                        zip_file.writestr(f"{instance.transaction_hash}/error.txt", f"Image failed: {str(e)}")
-
-                instance.downloaded = True
-                instance.save(update_fields=['downloaded'])
-
-        zip_buffer.seek(0)
-        return zip_buffer
+        """
+        Stream a ZIP file from Update_Request instances.
+        Exported rows are marked as downloaded with a single UPDATE once the
+        whole archive has been produced, an aborted download marks nothing.
+        """
+        exported = []
+        from .exports import iter_zip
+        yield from iter_zip(instances, on_written=lambda instance: exported.append(instance.pk))
+        Update_Request.objects.filter(pk__in=exported, downloaded=False).update(
+            downloaded=True, updated_at=timezone.now()
+        )
+
+    def generate_claimed_zip(self, batch_size):
+        """
+        Claim up to `batch_size` undownloaded rows and stream them.
+        Rows locked by a concurrent export are skipped, the lock is held (and
+        the downloaded flag committed) only until this archive is complete.
+        """
+        with transaction.atomic():
+            claimed = list(
+                Update_Request.objects.select_for_update(skip_locked=True)
+                .filter(downloaded=False, image__isnull=False)
+                .order_by('created_at')[:batch_size]
+            )
+            yield from self.generate_zip(claimed)
+
+    def _iter_instances(self, queryset):
+        """Read rows in chunks instead of caching the whole queryset"""
+        from .exports import export_chunk_size
+        return queryset.order_by('created_at').iterator(chunk_size=export_chunk_size())
 
     @action(detail=False, methods=['get'])
     def download_all(self, request):
         """Download all Update Requests"""
-        instances = Update_Request.objects.all()
-        zip_buffer = self.generate_zip(instances)
-        return self._return_zip(zip_buffer, 'all_update_requests.zip')
+        instances = self._iter_instances(Update_Request.objects.all())
+        return self._return_zip(self.generate_zip(instances), 'all_update_requests.zip')
 
     @action(detail=False, methods=['get'])
     def download_new(self, request):
-        """Download only those not yet downloaded"""
-        instances = Update_Request.objects.filter(downloaded=False)
-        zip_buffer = self.generate_zip(instances)
-        return self._return_zip(zip_buffer, 'new_update_requests.zip')
+        """Download only those not yet downloaded, `batch_size` caps how many are claimed"""
+        batch_size, error = self.claim_batch_size(request.query_params.get('batch_size'))
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        return self._return_zip(self.generate_claimed_zip(batch_size), 'new_update_requests.zip')
+
+    @staticmethod
+    def claim_batch_size(value):
+        """(batch_size, error) from the batch_size parameter of download_new"""
+        max_batch = getattr(settings, "UPDATE_REQUEST_CLAIM_BATCH_SIZE", 500)
+        if value is None:
+            return max_batch, None
+        try:
+            batch_size = min(int(value), max_batch)
+        except ValueError:
+            return None, 'batch_size must be an integer'
+        if batch_size < 1:
+            return None, 'batch_size must be positive'
+        return batch_size, None
 
     @action(detail=False, methods=['get'])
     def download_downloaded(self, request):
         """Download only those already downloaded"""
-        instances = Update_Request.objects.filter(downloaded=True)
-        zip_buffer = self.generate_zip(instances)
-        return self._return_zip(zip_buffer, 'already_downloaded_update_requests.zip')
+        instances = self._iter_instances(Update_Request.objects.filter(downloaded=True))
+        return self._return_zip(self.generate_zip(instances), 'already_downloaded_update_requests.zip')
 
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         """Download a single Update Request"""
         try:
             instance = self.get_object()
-            zip_buffer = self.generate_zip([instance])
-            return self._return_zip(zip_buffer, f"{instance.transaction_hash}.zip")
+            return self._return_zip(self.generate_zip([instance]), f"{instance.transaction_hash}.zip")
         except Update_Request.DoesNotExist:
             return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
 
-    def _return_zip(self, zip_buffer, filename):
-        """Helper to return a zip as an HTTP response"""
-        response = HttpResponse(zip_buffer, content_type='application/zip')
+    def _return_zip(self, zip_chunks, filename):
+        """Helper to stream a zip as an HTTP response"""
+        response = StreamingHttpResponse(zip_chunks, content_type='application/zip')
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
 
@@ -275,8 +470,7 @@ class AppSettingsView(APIView):
         return super().update(request, *args, **kwargs)
 
     def get(self, request):
-        settings = AppSettings.load()
-        serializer = AppSettingsSerializer(settings)
+        serializer = AppSettingsSerializer(runtime_config.app_settings())
         return Response(serializer.data)
 
     def put(self, request):
@@ -54,6 +54,7 @@ function LandingPage() {
                 {
                     wallet_address: walletAddress,
                     signature: signature,
+                    nonce: messageResponse.data.nonce,
                 }
             );
 
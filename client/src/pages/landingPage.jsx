@@ -50,6 +50,7 @@ function LandingPage() {
                 {
                     wallet_address: walletAddress,
                     signature: signature,
+                    nonce: messageResponse.data.nonce,
                 }
             );
 